@@ -0,0 +1,76 @@
+"""Measures how the CPU work of a batch inbox run scales with the number of
+workers: parsing film pages, extracting the film information, and creating
+poster thumbnails. No network is involved, the pages and the poster come
+from the test fixtures.
+
+    $ uv run python scripts/benchmark_cpu.py
+    $ uv run --python 3.14t python scripts/benchmark_cpu.py
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from film2trello import cpu, http
+from film2trello.core import get_film
+from film2trello.trello import create_thumbnail
+
+
+ROOT_DIR = Path(__file__).parent.parent
+
+FILMS_COUNT = 200
+
+
+async def process_film(content: bytes, poster: bytes) -> None:
+    url = "https://www.csfd.cz/film/8283-posledni-skaut/prehled/"
+    page_html = await cpu.run_cpu(
+        http.parse_html, content, url, picklable=False, releases_gil=True
+    )
+    page = http.Page(request_url=url, url=url, html=page_html)
+    await cpu.run_cpu(get_film, {"target": page, "parent": page}, picklable=False)
+    await cpu.run_cpu(create_thumbnail, poster)
+
+
+async def measure(workers_count: int, content: bytes, poster: bytes) -> float:
+    os.environ["FILM2TRELLO_CPU_WORKERS"] = str(workers_count)
+    cpu.get_thread_pool.cache_clear()
+    cpu.get_process_pool.cache_clear()
+    await process_film(content, poster)  # warms up the pools
+
+    started_at = time.perf_counter()
+    await asyncio.gather(*(process_film(content, poster) for _ in range(FILMS_COUNT)))
+    duration = time.perf_counter() - started_at
+
+    cpu.get_thread_pool().shutdown()
+    cpu.get_process_pool().shutdown()
+    return FILMS_COUNT / duration
+
+
+async def main() -> None:
+    content = (ROOT_DIR / "tests" / "csfd.html").read_bytes()
+    poster = (ROOT_DIR / "test_image.jpg").read_bytes()
+    build = "free-threaded" if cpu.is_free_threaded() else "GIL"
+    print(f"Python {sys.version.split()[0]} ({build}), {FILMS_COUNT} films")
+
+    baseline = None
+    workers_count = 1
+    max_workers_count = os.process_cpu_count() or 1
+    while True:
+        throughput = await measure(workers_count, content, poster)
+        baseline = baseline or throughput
+        print(
+            f"{workers_count:>3} workers: {throughput:7.1f} films/s, "
+            f"{throughput / baseline:.2f}x"
+        )
+        if workers_count >= max_workers_count:
+            break
+        workers_count = min(workers_count * 2, max_workers_count)
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as data_dir:
+        os.environ["FILM2TRELLO_DATA_DIR"] = data_dir
+        asyncio.run(main())
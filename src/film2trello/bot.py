@@ -1,5 +1,8 @@
+import asyncio
 import html
 import logging
+import time
+from contextlib import suppress
 from functools import partial
 
 import httpx
@@ -12,26 +15,57 @@ from telegram.ext import (
     filters,
 )
 
-from film2trello.core import process_message
-from film2trello.http import with_scraper
-from film2trello.trello import get_board_url, with_trello_api
+from film2trello.core import FilmCache, import_films, process_inbox, process_message
+from film2trello.csfd import get_user_list_url
+from film2trello.failures import get_failure_cache, log_suppressed
+from film2trello.http import get_profile_stats, get_scraper, log_wait_stats, priority
+from film2trello.mirror import BoardMirror, get_mirror_path
+from film2trello.scheduler import run_periodically
+from film2trello.trello import get_board_url, get_trello_api, register_webhook
+from film2trello.webhook import serve_webhook
 
 
 logger = logging.getLogger("film2trello.bot")
 
 
+PROGRESS_EDIT_INTERVAL = 3
+
+INBOX_JITTER = 0.1
+
+
 def run(
     users: list[tuple[int, str]],
     board_id: str,
     telegram_token: str,
     trello_key: str,
     trello_token: str,
+    inbox_every: float | None = None,
+    webhook_url: str | None = None,
+    webhook_port: int = 8080,
+    trello_secret: str | None = None,
 ) -> None:
     user_ids = [user_id for user_id, _ in users]
     user_filter = filters.User(user_ids, allow_empty=False)
     logger.info(f"Interactions allowed only with these users: {user_ids!r}")
 
-    application = Application.builder().token(telegram_token).build()
+    application = (
+        Application.builder()
+        .token(telegram_token)
+        .post_init(
+            partial(
+                start_clients,
+                board_id=board_id,
+                trello_key=trello_key,
+                trello_token=trello_token,
+                inbox_every=inbox_every,
+                webhook_url=webhook_url,
+                webhook_port=webhook_port,
+                trello_secret=trello_secret,
+            )
+        )
+        .post_shutdown(stop_clients)
+        .build()
+    )
     application.add_handlers(
         [
             CommandHandler(
@@ -44,16 +78,29 @@ def run(
                 partial(help_command, users=users, board_id=board_id),
                 user_filter,
             ),
+            CommandHandler(
+                "import",
+                partial(
+                    import_command,
+                    users=users,
+                    board_id=board_id,
+                    secrets=[telegram_token, trello_key, trello_token],
+                ),
+                user_filter,
+                # an import can take minutes, other messages shouldn't wait
+                block=False,
+            ),
             MessageHandler(
                 user_filter & filters.TEXT & ~filters.COMMAND,
                 partial(
                     save,
                     users=users,
                     board_id=board_id,
-                    trello_key=trello_key,
-                    trello_token=trello_token,
                     secrets=[telegram_token, trello_key, trello_token],
                 ),
+                # the card link is sent early and the card gets filled in
+                # afterwards, meanwhile other messages can be handled
+                block=False,
             ),
         ]
     )
@@ -62,6 +109,89 @@ def run(
     application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 
+async def start_clients(
+    application: Application,
+    board_id: str,
+    trello_key: str,
+    trello_token: str,
+    inbox_every: float | None = None,
+    webhook_url: str | None = None,
+    webhook_port: int = 8080,
+    trello_secret: str | None = None,
+) -> None:
+    # the clients live as long as the bot, so that messages and scheduled
+    # inbox runs reuse open connections and whatever has been cached
+    scraper = get_scraper()
+    trello_api = get_trello_api(trello_key, trello_token)
+    application.bot_data.update(scraper=scraper, trello_api=trello_api)
+
+    mirror = None
+    if webhook_url and trello_secret:
+        logger.info(f"Mirroring the board, webhook URL: {webhook_url}")
+        mirror = BoardMirror(get_mirror_path(board_id), board_id, trello_api)
+        # webhook deliveries might have been missed while the bot was down
+        await mirror.sync()
+        webhook_server = await serve_webhook(
+            mirror, "0.0.0.0", webhook_port, webhook_url, trello_secret
+        )
+        try:
+            # Trello checks the URL right away, so the server must be running
+            await register_webhook(trello_api, board_id, webhook_url)
+        except httpx.HTTPError:
+            # without the webhook the mirror would go stale unnoticed
+            logger.exception("Unable to register the webhook, reading from Trello")
+            webhook_server.close()
+            await webhook_server.wait_closed()
+            mirror.close()
+            mirror = None
+        else:
+            application.bot_data.update(mirror=mirror, webhook_server=webhook_server)
+
+    if inbox_every:
+        logger.info(f"Processing inbox every {inbox_every}h")
+
+        async def process_inbox_job() -> None:
+            # films are scraped anew each run, so that their availability
+            # and durations are up to date
+            summary = await process_inbox(
+                scraper, trello_api, board_id, FilmCache(scraper), mirror=mirror
+            )
+            logger.info(
+                f"Inbox: {summary['processed']} processed, "
+                f"{summary['resumed']} resumed, {len(summary['failed'])} failed"
+            )
+            get_profile_stats().save()
+            get_failure_cache().save()
+            log_wait_stats()
+            log_suppressed()
+
+        application.bot_data["inbox_task"] = asyncio.create_task(
+            run_periodically(
+                process_inbox_job,
+                inbox_every * 3600,
+                jitter=inbox_every * 3600 * INBOX_JITTER,
+            )
+        )
+
+
+async def stop_clients(application: Application) -> None:
+    if inbox_task := application.bot_data.get("inbox_task"):
+        inbox_task.cancel()
+        with suppress(asyncio.CancelledError):
+            await inbox_task
+    if webhook_server := application.bot_data.get("webhook_server"):
+        webhook_server.close()
+        await webhook_server.wait_closed()
+    if mirror := application.bot_data.get("mirror"):
+        mirror.close()
+    await application.bot_data["scraper"].aclose()
+    await application.bot_data["trello_api"].aclose()
+    get_profile_stats().save()
+    get_failure_cache().save()
+    log_wait_stats()
+    log_suppressed()
+
+
 async def start_command(
     update: Update,
     context: ContextTypes.DEFAULT_TYPE,
@@ -92,11 +222,7 @@ async def help_command(
     await update.message.reply_html(get_help_text(board_id, dict(users)[user.id]))
 
 
-@with_trello_api
-@with_scraper
 async def save(
-    scraper: httpx.AsyncClient,
-    trello_api: httpx.AsyncClient,
     update: Update,
     context: ContextTypes.DEFAULT_TYPE,
     users: list[tuple[int, str]],
@@ -110,22 +236,28 @@ async def save(
         raise ValueError("No user available")
     if not update.message:
         raise ValueError("No message available")
+    scraper = context.bot_data["scraper"]
+    trello_api = context.bot_data["trello_api"]
 
     reply = await update.message.reply_html("Processing…")
     try:
-        async for message in process_message(
-            scraper,
-            trello_api,
-            username,
-            update.message.text or "",
-            board_id,
-        ):
-            logger.info(f"Status: {message}")
-            await reply.edit_text(
-                message,
-                parse_mode="HTML",
-                disable_web_page_preview=True,
-            )
+        # someone is waiting for the reply, so this goes before inbox runs
+        # or imports which might be in progress
+        with priority("interactive"):
+            async for message in process_message(
+                scraper,
+                trello_api,
+                username,
+                update.message.text or "",
+                board_id,
+                mirror=context.bot_data.get("mirror"),
+            ):
+                logger.info(f"Status: {message}")
+                await reply.edit_text(
+                    message,
+                    parse_mode="HTML",
+                    disable_web_page_preview=True,
+                )
     except Exception as exc:
         logger.exception("Error while processing the message")
         exc_text = str(exc)
@@ -138,12 +270,66 @@ async def save(
         )
 
 
+async def import_command(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    users: list[tuple[int, str]],
+    board_id: str,
+    secrets: list[str] | None = None,
+) -> None:
+    user = update.effective_user
+    if user:
+        username = dict(users)[user.id]
+    else:
+        raise ValueError("No user available")
+    if not update.message:
+        raise ValueError("No message available")
+
+    list_url = get_user_list_url(" ".join(context.args or []))
+    if not list_url:
+        await update.message.reply_html(
+            "Pošli mi odkaz na seznam filmů na ČSFD, třeba "
+            "<code>/import https://www.csfd.cz/uzivatel/…/chci-videt/</code>"
+        )
+        return
+
+    scraper = context.bot_data["scraper"]
+    trello_api = context.bot_data["trello_api"]
+    reply = await update.message.reply_html("Importing…")
+    try:
+        # Telegram doesn't like a message edited many times per second,
+        # so progress of a long import is shown only every few seconds
+        edited_at = 0
+        message = shown_message = None
+        async for message in import_films(
+            scraper, trello_api, list_url, board_id, username
+        ):
+            logger.info(f"Status: {message}")
+            if time.monotonic() - edited_at > PROGRESS_EDIT_INTERVAL:
+                await reply.edit_text(message, disable_web_page_preview=True)
+                edited_at = time.monotonic()
+                shown_message = message
+        # Telegram refuses to edit a message to the same text
+        if message != shown_message:
+            await reply.edit_text(message, disable_web_page_preview=True)
+    except Exception as exc:
+        logger.exception("Error while importing the list")
+        exc_text = str(exc)
+        if secrets:
+            exc_text = sanitize(exc_text, secrets)
+        await update.message.reply_html(
+            f"Stala se nějaká chyba 😢\n\n<pre>{html.escape(exc_text)}</pre>"
+        )
+
+
 def get_help_text(board_id: str, username: str) -> str:
     return (
         f"Můžeš mi posílat odkazy na filmy z KVIFF.TV nebo ČSFD a já je budu ukládat do tohoto Trella: {get_board_url(board_id)} "
         f"Na kartičku přiřadím Trello uživatele <code>{html.escape(username)}</code>. "
         "Pokud pošleš odkaz na seriál, uložím ti jeho první sérii. "
         "Jestli chceš zaznamenat jinou sérii, musíš poslat odkaz přímo na ni. "
+        "Celý seznam filmů z ČSFD (třeba tvoje <i>Chci vidět</i>) naimportuji "
+        "příkazem <code>/import</code> s odkazem na ten seznam. "
     )
 
 
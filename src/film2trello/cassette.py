@@ -0,0 +1,146 @@
+import asyncio
+import base64
+import gzip
+import json
+import logging
+import time
+from collections import defaultdict, deque
+from pathlib import Path
+from typing import Literal, TypedDict
+
+import httpx
+
+
+logger = logging.getLogger("film2trello.cassette")
+
+
+DECODED_HEADER_NAMES = frozenset(
+    {"content-encoding", "content-length", "transfer-encoding"}
+)
+
+
+class CassetteError(RuntimeError):
+    pass
+
+
+class Interaction(TypedDict):
+    method: str
+    url: str
+    status_code: int
+    headers: list[tuple[str, str]]
+    content: str
+    elapsed: float
+
+
+class Cassette:
+    """HTTP traffic recorded to a gzipped JSON Lines file, one request and
+    response pair per line. Neither request headers nor request bodies are
+    recorded, so credentials don't end up in the file.
+
+    When replaying, requests are matched by method and URL, and the same
+    request made several times gets the responses in the recorded order."""
+
+    def __init__(
+        self,
+        path: Path,
+        mode: Literal["record", "replay"],
+        latency: Literal["original", "zero"] = "zero",
+    ) -> None:
+        self.path = path
+        self.mode = mode
+        self.latency = latency
+        self.interactions: defaultdict[tuple[str, str], deque[Interaction]] = (
+            defaultdict(deque)
+        )
+        if mode == "replay":
+            with gzip.open(path, "rt") as f:
+                for line in f:
+                    interaction = json.loads(line)
+                    key = (interaction["method"], interaction["url"])
+                    self.interactions[key].append(interaction)
+            self.file = None
+        else:
+            self.file = gzip.open(path, "wt")  # noqa: SIM115, closed in close()
+
+    def record(self, interaction: Interaction) -> None:
+        if not self.file:
+            raise CassetteError("Cassette isn't opened for recording")
+        self.file.write(json.dumps(interaction) + "\n")
+
+    def play(self, request: httpx.Request) -> Interaction:
+        try:
+            return self.interactions[(request.method, str(request.url))].popleft()
+        except IndexError:
+            raise CassetteError(f"Not recorded: {request.method} {request.url}")
+
+    def close(self) -> None:
+        if self.file:
+            self.file.close()
+            logger.info(f"Recorded HTTP traffic to {self.path}")
+
+
+class CassetteTransport(httpx.AsyncBaseTransport):
+    """Records traffic going through the wrapped transport to a cassette,
+    or replays it from the cassette without touching the network."""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, cassette: Cassette) -> None:
+        self.transport = transport
+        self.cassette = cassette
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if self.cassette.mode == "replay":
+            interaction = self.cassette.play(request)
+            if self.cassette.latency == "original":
+                await asyncio.sleep(interaction["elapsed"])
+            return httpx.Response(
+                interaction["status_code"],
+                headers=interaction["headers"],
+                content=base64.b64decode(interaction["content"]),
+                request=request,
+            )
+
+        started_at = time.monotonic()
+        response = await self.transport.handle_async_request(request)
+        try:
+            content = await response.aread()
+        finally:
+            await response.aclose()
+        # the content is decoded, so the headers describing the encoding
+        # don't apply anymore (the cassette file as a whole is compressed)
+        headers = [
+            (name, value)
+            for name, value in response.headers.multi_items()
+            if name.lower() not in DECODED_HEADER_NAMES
+        ]
+        self.cassette.record(
+            Interaction(
+                method=request.method,
+                url=str(request.url),
+                status_code=response.status_code,
+                headers=headers,
+                content=base64.b64encode(content).decode("ascii"),
+                elapsed=time.monotonic() - started_at,
+            )
+        )
+        return httpx.Response(
+            response.status_code,
+            headers=headers,
+            content=content,
+            request=request,
+            extensions=response.extensions,
+        )
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+cassette: Cassette | None = None
+
+
+def use_cassette(new_cassette: Cassette | None) -> None:
+    global cassette
+    cassette = new_cassette
+
+
+def get_cassette() -> Cassette | None:
+    return cassette
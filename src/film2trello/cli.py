@@ -1,11 +1,12 @@
 import asyncio
 import logging
+import sys
+from collections.abc import Coroutine
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Literal, TextIO
 
 import click
-from httpx import HTTPStatusError
-
-from film2trello.bot import run as run_bot
-from film2trello.core import process_inbox
 
 
 logger = logging.getLogger("film2trello.cli")
@@ -48,7 +49,39 @@ trello_token_option = click.option(
     is_flag=True,
     help="Set log level to DEBUG",
 )
-def main(debug: bool) -> None:
+@click.option(
+    "--record",
+    "record_path",
+    type=click.Path(dir_okay=False, writable=True, path_type=Path),
+    help="Record all HTTP traffic to a cassette file",
+)
+@click.option(
+    "--replay",
+    "replay_path",
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    help="Replay HTTP traffic from a cassette file instead of using network",
+)
+@click.option(
+    "--replay-latency",
+    type=click.Choice(["original", "zero"]),
+    default="zero",
+    show_default=True,
+    help="Whether replayed responses take as long as the recorded ones",
+)
+@click.option(
+    "--profile",
+    is_flag=True,
+    help="Save CPU profile and asyncio timeline to the current directory",
+)
+@click.pass_context
+def main(
+    context: click.Context,
+    debug: bool,
+    record_path: Path | None,
+    replay_path: Path | None,
+    replay_latency: Literal["original", "zero"],
+    profile: bool,
+) -> None:
     logging.basicConfig(
         format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
         level=logging.DEBUG if debug else logging.INFO,
@@ -56,6 +89,33 @@ def main(debug: bool) -> None:
     for logger_name in ["httpx"]:
         logging.getLogger(logger_name).setLevel(logging.WARNING)
 
+    if record_path and replay_path:
+        raise click.UsageError("Use either --record or --replay, not both")
+    if record_path or replay_path:
+        from film2trello.cassette import Cassette, use_cassette
+
+        if record_path:
+            cassette = Cassette(record_path, "record")
+        else:
+            cassette = Cassette(replay_path, "replay", latency=replay_latency)
+        use_cassette(cassette)
+        context.call_on_close(cassette.close)
+
+    if profile:
+        from film2trello.profiling import Profiling
+
+        profiling = Profiling(
+            Path(f"film2trello-{datetime.now():%Y%m%d-%H%M%S}").absolute()
+        )
+        context.meta["loop_factory"] = profiling.tracer.get_loop
+        profiling.start()
+        context.call_on_close(profiling.stop)
+
+
+def run[R](coro: Coroutine[Any, Any, R]) -> R:
+    loop_factory = click.get_current_context().meta.get("loop_factory")
+    return asyncio.run(coro, loop_factory=loop_factory)
+
 
 @main.command()
 @click.option(
@@ -76,36 +136,262 @@ def main(debug: bool) -> None:
 )
 @trello_key_option
 @trello_token_option
+@click.option(
+    "--inbox-every",
+    type=float,
+    help="Process the inbox every given number of hours",
+    envvar="INBOX_EVERY",
+)
+@click.option(
+    "--webhook-url",
+    help="Public URL of the bot, mirrors the board locally using Trello webhooks",
+    envvar="WEBHOOK_URL",
+)
+@click.option(
+    "--webhook-port",
+    type=int,
+    default=8080,
+    show_default=True,
+    help="Port to receive Trello webhooks on",
+    envvar="PORT",
+)
+@click.option(
+    "--trello-secret",
+    help=(
+        "Trello secret, to refuse webhooks not sent by Trello, "
+        "required with --webhook-url"
+    ),
+    envvar="TRELLO_SECRET",
+)
 def bot(
     users: list[tuple[int, str]],
     board_id: str,
     telegram_token: str,
     trello_key: str,
     trello_token: str,
+    inbox_every: float | None,
+    webhook_url: str | None,
+    webhook_port: int,
+    trello_secret: str | None,
 ) -> None:
-    run_bot(users, board_id, telegram_token, trello_key, trello_token)
+    if webhook_url and not trello_secret:
+        # otherwise anyone could feed the mirror with made-up changes
+        raise click.UsageError("--webhook-url requires --trello-secret")
+
+    # Subcommands import what they need on their own, so that e.g. the inbox
+    # job doesn't pay for importing Telegram. See test_cli.py for the budgets.
+    from film2trello.bot import run as run_bot
+
+    run_bot(
+        users,
+        board_id,
+        telegram_token,
+        trello_key,
+        trello_token,
+        inbox_every,
+        webhook_url,
+        webhook_port,
+        trello_secret,
+    )
 
 
 @main.command()
-@board_id_option
+@click.option(
+    "-b",
+    "--board",
+    "board_ids",
+    help="Trello board ID, use multiple times to process several boards",
+    multiple=True,
+    default=["zmyDOaFL"],
+)
 @trello_key_option
 @trello_token_option
 @click.option("--sort/--no-sort", "sort_cards", default=True)
+@click.option(
+    "--sort-only",
+    is_flag=True,
+    help="Only sort the cards by the film information stored on them",
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    help="Continue an interrupted run from its journal",
+)
 def inbox(
-    board_id: str,
+    board_ids: list[str],
     trello_key: str,
     trello_token: str,
     sort_cards: bool,
+    sort_only: bool,
+    resume: bool,
 ) -> None:
-    try:
-        asyncio.run(
-            process_inbox(
-                board_id,
-                trello_key=trello_key,
-                trello_token=trello_token,
-                sort_cards=sort_cards,
-            )
+    if sort_only:
+        if not sort_cards or resume:
+            raise click.UsageError("--sort-only can't be combined with other options")
+        from film2trello.core import sort_inboxes
+
+        run(sort_inboxes(board_ids, trello_key=trello_key, trello_token=trello_token))
+        return
+
+    from film2trello.core import process_inboxes
+
+    summaries = run(
+        process_inboxes(
+            board_ids,
+            trello_key=trello_key,
+            trello_token=trello_token,
+            sort_cards=sort_cards,
+            resume=resume,
+        )
+    )
+    for summary in summaries:
+        logger.info(
+            f"Board {summary['board_id']}: {summary['processed']} processed, "
+            f"{summary['resumed']} resumed, {len(summary['failed'])} failed"
+            + (f", error: {summary['error']}" if "error" in summary else "")
         )
-    except HTTPStatusError as exc:
-        logger.exception(exc.response.text)
+    if failed_count := sum(len(summary["failed"]) for summary in summaries):
+        raise click.ClickException(
+            f"Failed to process {failed_count} cards, "
+            "run again with --resume to retry them"
+        )
+    if any("error" in summary for summary in summaries):
         raise click.Abort()
+
+
+@main.command("kviff-index")
+@click.option(
+    "--concurrency",
+    default=5,
+    show_default=True,
+    help="How many KVIFF.TV pages to scrape at once",
+)
+@click.option(
+    "--full",
+    is_flag=True,
+    help="Check again also films which are already indexed",
+)
+def kviff_index(concurrency: int, full: bool) -> None:
+    from film2trello.kvifftv import index_catalog
+
+    count = run(index_catalog(concurrency=concurrency, full=full))
+    logger.info(f"Indexed {count} KVIFF.TV films")
+
+
+@main.command()
+@click.argument("urls", nargs=-1)
+@click.option(
+    "--concurrency",
+    default=5,
+    show_default=True,
+    help="How many films to scrape at once",
+)
+def scrape(urls: tuple[str, ...], concurrency: int) -> None:
+    from film2trello.core import write_films
+
+    failed_count = run(
+        write_films(iter(urls) if urls else iter(sys.stdin), sys.stdout, concurrency)
+    )
+    if failed_count:
+        raise click.ClickException(f"Failed to scrape {failed_count} films")
+
+
+@main.command()
+@board_id_option
+@trello_key_option
+@trello_token_option
+@click.option(
+    "-o",
+    "--output",
+    type=click.File("w"),
+    default="-",
+    help="File to write to, stdout by default",
+)
+@click.option(
+    "--format",
+    "output_format",
+    type=click.Choice(["jsonl", "csv"]),
+    default="jsonl",
+    show_default=True,
+)
+@click.option(
+    "--metadata",
+    "with_metadata",
+    is_flag=True,
+    help="Add the film information stored on the cards",
+)
+def export(
+    board_id: str,
+    trello_key: str,
+    trello_token: str,
+    output: TextIO,
+    output_format: Literal["jsonl", "csv"],
+    with_metadata: bool,
+) -> None:
+    from film2trello.export import export_board
+
+    count = run(
+        export_board(
+            board_id,
+            output,
+            output_format,
+            with_metadata,
+            trello_key=trello_key,
+            trello_token=trello_token,
+        )
+    )
+    logger.info(f"Exported {count} cards")
+
+
+@main.command()
+def failures() -> None:
+    from film2trello.failures import format_time, get_failure_cache
+
+    report = get_failure_cache().report()
+    if not report:
+        click.echo("Nothing is being skipped")
+    for failure in report:
+        click.echo(
+            f"{format_time(failure['retry_at'])} {failure['kind']} "
+            f"{failure['resource']} ({failure['failure']}, "
+            f"failed {failure['count']}x): {failure['error']}"
+        )
+
+
+@main.command("import")
+@click.argument("list_url")
+@board_id_option
+@click.option(
+    "-u",
+    "--user",
+    "username",
+    help="Trello username to assign to the created cards",
+)
+@trello_key_option
+@trello_token_option
+@click.option(
+    "--concurrency",
+    default=5,
+    show_default=True,
+    help="How many films to scrape at once",
+)
+def import_list(
+    list_url: str,
+    board_id: str,
+    username: str | None,
+    trello_key: str,
+    trello_token: str,
+    concurrency: int,
+) -> None:
+    from film2trello.core import import_user_list
+
+    run(
+        import_user_list(
+            list_url,
+            board_id,
+            username,
+            concurrency,
+            trello_key=trello_key,
+            trello_token=trello_token,
+        )
+    )
@@ -1,17 +1,38 @@
+import asyncio
+import json
 import logging
-from collections.abc import AsyncGenerator
+import threading
+from collections import OrderedDict
+from collections.abc import AsyncGenerator, Iterator
+from contextlib import suppress
+from dataclasses import dataclass
 from datetime import UTC, datetime, timedelta
+from functools import partial
+from operator import attrgetter
 from pprint import pformat
-from typing import TypedDict
+from typing import NotRequired, TextIO, TypedDict
 
 import httpx
 
-from film2trello import csfd, http, trello
+from film2trello import csfd, http, kvifftv, trello
+from film2trello.cpu import run_cpu
+from film2trello.failures import SuppressedError
+from film2trello.graph import TaskGraph
+from film2trello.journal import Journal, get_journal_path, get_lock_path
+from film2trello.mirror import BoardMirror
+from film2trello.storage import lock_file
 
 
 logger = logging.getLogger("film2trello.core")
 
 
+IMPORT_STATUSES = {
+    "created": "Created",
+    "existing": "Already on the board",
+    "failed": "Failed",
+}
+
+
 class Film(TypedDict):
     title: str
     csfd_url: str
@@ -28,66 +49,258 @@ async def process_message(
     username: str,
     message_text: str,
     board_id: str,
+    mirror: BoardMirror | None = None,
 ) -> AsyncGenerator[str]:
-    yield f"Checking if user '{username}' is allowed to the board"
-    await trello.check_username(trello_api, board_id, username)
+    # The steps start as soon as whatever they depend on is done, e.g. the
+    # board is read while the CSFD.cz URL is being figured out. The progress
+    # messages are still given in a fixed order. The card is located or
+    # created as soon as the CSFD.cz URL is known, so that the user gets the
+    # link right away, while the film is being scraped. Reading labels or
+    # the custom field might create them, so it waits until the user is
+    # known to be allowed to the board.
+    async with TaskGraph() as graph:
+        if mirror:
+            # the board is read from the local mirror instead of Trello
+            graph.add("member_id", partial(mirror.check_username, username))
+            graph.add("lists_ids", mirror.get_working_lists_ids)
+            graph.add("cards", mirror.get_cards, "lists_ids")
+            graph.add("label_ids", mirror.get_board_labels, after=("member_id",))
+            graph.add(
+                "metadata_field_id",
+                mirror.get_metadata_field_id,
+                after=("member_id",),
+            )
+        else:
+            graph.add(
+                "member_id",
+                partial(trello.check_username, trello_api, board_id, username),
+            )
+            graph.add(
+                "lists_ids",
+                partial(trello.get_working_lists_ids, trello_api, board_id),
+            )
+            graph.add("cards", partial(trello.get_cards, trello_api), "lists_ids")
+            graph.add(
+                "label_ids",
+                partial(trello.get_board_labels, trello_api, board_id),
+                after=("member_id",),
+            )
+            graph.add(
+                "metadata_field_id",
+                partial(trello.get_metadata_field_id, trello_api, board_id),
+                after=("member_id",),
+            )
+        graph.add("csfd_url", partial(get_csfd_url, scraper, message_text))
+        graph.add("film", partial(scrape_film, scraper), "csfd_url")
+        graph.add(
+            "card",
+            partial(locate_card, trello_api),
+            "cards",
+            "csfd_url",
+            "lists_ids",
+            "member_id",
+        )
+        graph.add(
+            "film_card",
+            partial(resolve_placeholder_card, trello_api),
+            "card",
+            "cards",
+            "film",
+        )
+        graph.add(
+            "card_update",
+            partial(update_message_card, trello_api),
+            "film_card",
+            "film",
+            "lists_ids",
+            "label_ids",
+        )
+        graph.add(
+            "metadata_update",
+            partial(update_film_metadata, trello_api),
+            "film_card",
+            "film",
+            "metadata_field_id",
+        )
+        graph.add(
+            "members_update",
+            partial(trello.join_card, trello_api),
+            "film_card",
+            "member_id",
+        )
+        graph.add(
+            "attachments_update",
+            partial(update_message_card_attachments, trello_api, scraper),
+            "film_card",
+            "csfd_url",
+            "film",
+        )
 
-    yield "Figuring out CSFD.cz URL…"
-    csfd_url = await get_csfd_url(scraper, message_text)
+        yield f"Checking if user '{username}' is allowed to the board"
+        await graph.get("member_id")
 
-    yield "Scraping information from CSFD.cz…"
-    film = get_film(await get_csfd_pages(scraper, csfd_url))
-    logger.info(f"Film:\n{pformat(film)}")
+        yield "Figuring out CSFD.cz URL…"
+        await graph.get("csfd_url")
 
-    yield "Analyzing columns, assuming first is inbox and last is archive"
-    lists_ids = await trello.get_working_lists_ids(trello_api, board_id)
-    inbox_list_id = lists_ids[0]
+        yield "Analyzing columns, assuming first is inbox and last is archive"
+        await graph.get("lists_ids")
 
-    yield "Checking if card already exists"
-    cards = await trello.get_cards(trello_api, lists_ids)
-    card_id = trello.find_card_id(cards, film["title"], film["csfd_url"])
+        yield "Checking if card already exists"
+        card = await graph.get("card")
+        if card.get("is_placeholder"):
+            yield f"Card created, filling it in: {trello.get_card_url(card['id'])}"
+        else:
+            yield f"Card already exists, updating: {trello.get_card_url(card['id'])}"
+
+        yield "Scraping information from CSFD.cz…"
+        film_card = None
+        try:
+            film = await graph.get("film")
+            logger.info(f"Film:\n{pformat(film)}")
+            film_card = await graph.get("film_card")
+            if film_card is not card:
+                yield (
+                    "Card already exists, updating: "
+                    f"{trello.get_card_url(film_card['id'])}"
+                )
+            await graph.get("card_update")
+        except Exception:
+            if card.get("is_placeholder") and film_card in (None, card):
+                # otherwise a card named after the URL would stay on the board
+                await delete_placeholder_card(trello_api, card)
+            raise
+        await graph.get("metadata_update")
+
+        yield "Updating members"
+        await graph.get("members_update")
+
+        yield "Updating attachments"
+        for error in await graph.get("attachments_update"):
+            logger.error(error)
+            yield error
+
+        yield f"Done! This is your card: {trello.get_card_url(film_card['id'])}"
+
+
+async def locate_card(
+    trello_api: httpx.AsyncClient,
+    cards: list[dict],
+    csfd_url: str,
+    lists_ids: list[str],
+    member_id: str,
+) -> dict:
+    if card := find_card_by_csfd_url(cards, csfd_url):
+        return card
+    # the same film sent twice at the same time gets only one card
+    return await http.in_flight.run(
+        ("placeholder", lists_ids[0], csfd.get_film_path_ids(csfd_url)),
+        partial(create_placeholder_card, trello_api, csfd_url, lists_ids[0], member_id),
+    )
+
+
+async def resolve_placeholder_card(
+    trello_api: httpx.AsyncClient,
+    card: dict,
+    cards: list[dict],
+    film: Film,
+) -> dict:
+    if card.get("is_placeholder") and (
+        existing_card := trello.find_card(cards, film["title"], film["csfd_url"])
+    ):
+        # e.g. the link was to a series, but its first season is on the board
+        await delete_placeholder_card(trello_api, card)
+        return existing_card
+    return card
+
+
+async def delete_placeholder_card(trello_api: httpx.AsyncClient, card: dict) -> None:
+    # messages with the same film share the placeholder, only one deletes it
+    if not card.get("is_deleted"):
+        card["is_deleted"] = True
+        await trello.delete_card(trello_api, card["id"])
+
+
+async def update_message_card(
+    trello_api: httpx.AsyncClient,
+    card: dict,
+    film: Film,
+    lists_ids: list[str],
+    label_ids: dict[str, str],
+) -> None:
     card_data = trello.prepare_card_data(
         film["title"],
         film["csfd_url"],
         move_to_top=True,
-        move_to_list_id=inbox_list_id,
+        move_to_list_id=lists_ids[0],
     )
+    card_data["idLabels"] = trello.get_card_label_ids(card, get_labels(film), label_ids)
+    if changes := trello.get_card_changes(card, card_data):
+        await trello.update_card(trello_api, card["id"], changes)
 
-    if card_id:
-        yield f"Card already exists, updating: {trello.get_card_url(card_id)}"
-        await trello.update_card(trello_api, card_id, card_data)
-    else:
-        yield "Card does not exist, creating"
-        card_id = await trello.create_card(trello_api, card_data)
-        yield f"Card created: {trello.get_card_url(card_id)}"
-
-    yield "Updating members"
-    await trello.join_card(trello_api, card_id, username)
-
-    yield "Updating labels"
-    labels = get_labels(film)
-    await trello.update_card_labels(trello_api, card_id, labels)
 
-    yield "Updating attachments"
-    errors = await trello.update_card_attachments(
+async def update_message_card_attachments(
+    trello_api: httpx.AsyncClient,
+    scraper: httpx.AsyncClient,
+    card: dict,
+    csfd_url: str,
+    film: Film,
+) -> list[str]:
+    return await trello.update_card_attachments(
         trello_api,
         scraper,
-        card_id,
+        card["id"],
         list(filter(None, [csfd_url, film["kvifftv_url"]])),
         film.get("poster_url"),
+        card["attachments"],
     )
-    for error in errors:
-        logger.error(error)
-        yield error
 
-    yield f"Done! This is your card: {trello.get_card_url(card_id)}"
+
+def find_card_by_csfd_url(cards: list[dict], csfd_url: str) -> dict | None:
+    film_ids = csfd.get_film_path_ids(csfd_url)
+    for card in cards:
+        if (
+            card_csfd_url := csfd.get_csfd_url(card["desc"])
+        ) and csfd.get_film_path_ids(card_csfd_url) == film_ids:
+            return card
+    return None
+
+
+async def create_placeholder_card(
+    trello_api: httpx.AsyncClient,
+    csfd_url: str,
+    inbox_list_id: str,
+    member_id: str,
+) -> dict:
+    card_data = trello.prepare_card_data(
+        csfd_url, csfd_url, move_to_top=True, move_to_list_id=inbox_list_id
+    )
+    card_data["idMembers"] = [member_id]
+    card_data["id"] = await trello.create_card(trello_api, card_data)
+    return card_data | {
+        "labels": [],
+        "idLabels": [],
+        "attachments": [],
+        "is_placeholder": True,
+    }
 
 
-async def get_csfd_url(scraper: httpx.AsyncClient, message_text: str) -> str:
+async def get_csfd_url(
+    scraper: httpx.AsyncClient,
+    message_text: str,
+    kvifftv_index: kvifftv.KviffTvIndex | None = None,
+) -> str:
     if input_url := csfd.get_kvifftv_url(message_text):
-        logger.info(f"Detected KVIFF.TV URL, scraping: {input_url}")
-        response = await scraper.get(input_url)
-        if csfd_url := csfd.get_csfd_url(response.text):
+        kvifftv_index = kvifftv_index or kvifftv.get_index()
+        slug = kvifftv.get_slug(input_url)
+        if slug in kvifftv_index:
+            logger.info(f"Detected KVIFF.TV URL, already indexed: {input_url}")
+            csfd_url = kvifftv_index.get(slug)
+        else:
+            logger.info(f"Detected KVIFF.TV URL, scraping: {input_url}")
+            csfd_url = await http.search_text(scraper, input_url, csfd.CSFD_URL_RE)
+            kvifftv_index.set(slug, csfd_url)
+            kvifftv_index.save()
+        if csfd_url:
             logger.info(f"Found CSFD.cz URL: {csfd_url}")
             return csfd_url
         raise ValueError("Could not find CSFD.cz URL")
@@ -97,6 +310,13 @@ async def get_csfd_url(scraper: httpx.AsyncClient, message_text: str) -> str:
     raise ValueError("Could not find a valid film URL")
 
 
+async def scrape_film(scraper: httpx.AsyncClient, csfd_url: str) -> Film:
+    # the pages (and their DOM trees) are thrown away as soon as the film
+    # information is extracted from them
+    pages = await get_csfd_pages(scraper, csfd_url)
+    return await run_cpu(get_film, pages, picklable=False)
+
+
 async def get_csfd_pages(
     scraper: httpx.AsyncClient,
     csfd_url: str,
@@ -125,7 +345,11 @@ async def get_csfd_pages(
     return {"target": target_page, "parent": parent_page}
 
 
-def get_film(pages: dict[str, http.Page]) -> Film:
+def get_film(
+    pages: dict[str, http.Page],
+    kvifftv_index: kvifftv.KviffTvIndex | None = None,
+) -> Film:
+    kvifftv_index = kvifftv_index or kvifftv.get_index()
     return Film(
         csfd_url=pages["target"]["url"],
         title=csfd.parse_title(pages["target"]["html"]),
@@ -134,7 +358,10 @@ def get_film(pages: dict[str, http.Page]) -> Film:
             or csfd.parse_poster_url(pages["parent"]["html"])
         ),
         durations=list(csfd.parse_durations(pages["target"]["html"])),
-        kvifftv_url=csfd.parse_kvifftv_url(pages["parent"]["html"]),
+        kvifftv_url=(
+            csfd.parse_kvifftv_url(pages["parent"]["html"])
+            or kvifftv_index.find_kvifftv_url(pages["target"]["url"])
+        ),
         netflix_url=csfd.parse_netflix_url(pages["parent"]["html"]),
         is_tvshow=csfd.parse_is_tvshow(pages["parent"]["html"]),
     )
@@ -151,73 +378,600 @@ def get_labels(film: Film) -> list[dict[str, str]]:
     return labels
 
 
+async def import_films(
+    scraper: httpx.AsyncClient,
+    trello_api: httpx.AsyncClient,
+    list_url: str,
+    board_id: str,
+    username: str | None = None,
+    concurrency: int = 5,
+) -> AsyncGenerator[str]:
+    member_id = None
+    if username:
+        yield f"Checking if user '{username}' is allowed to the board"
+        member_id = await trello.check_username(trello_api, board_id, username)
+
+    yield "Reading the CSFD.cz list…"
+    csfd_urls = await get_user_list_film_urls(scraper, list_url)
+    yield f"Found {len(csfd_urls)} films on the list"
+
+    yield "Checking which films are already on the board"
+    lists_ids = await trello.get_working_lists_ids(trello_api, board_id)
+    inbox_list_id = lists_ids[0]
+    cards = await trello.get_cards(trello_api, lists_ids)
+    label_ids = await trello.get_board_labels(trello_api, board_id)
+    metadata_field_id = await trello.get_metadata_field_id(trello_api, board_id)
+    existing_count = len(csfd_urls)
+    csfd_urls = [
+        csfd_url
+        for csfd_url in csfd_urls
+        if not any(csfd_url in card["desc"] for card in cards)
+    ]
+    existing_count -= len(csfd_urls)
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def import_film(csfd_url: str) -> tuple[str, str]:
+        try:
+            async with semaphore:
+                film = await scrape_film(scraper, csfd_url)
+                created = await import_film_card(
+                    scraper,
+                    trello_api,
+                    cards,
+                    film,
+                    inbox_list_id,
+                    label_ids,
+                    metadata_field_id,
+                    member_id,
+                )
+            return ("created" if created else "existing"), film["title"]
+        except Exception:
+            logger.exception(f"Failed to import {csfd_url}")
+            return "failed", csfd_url
+
+    counts = {"created": 0, "existing": existing_count, "failed": 0}
+    tasks = [asyncio.create_task(import_film(csfd_url)) for csfd_url in csfd_urls]
+    try:
+        for done, task in enumerate(asyncio.as_completed(tasks), start=1):
+            status, name = await task
+            counts[status] += 1
+            yield f"[{done}/{len(tasks)}] {IMPORT_STATUSES[status]}: {name}"
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    yield (
+        f"Done! Created {counts['created']} cards, "
+        f"{counts['existing']} films were already on the board, "
+        f"{counts['failed']} failed: {trello.get_board_url(board_id)}"
+    )
+
+
+async def get_user_list_film_urls(
+    scraper: httpx.AsyncClient,
+    list_url: str,
+) -> list[str]:
+    csfd_urls = {}
+    page_url = list_url
+    while page_url:
+        logger.info(f"Scraping CSFD.cz list: {page_url}")
+        page = await http.get_html(scraper, page_url)
+        csfd_urls.update(dict.fromkeys(csfd.parse_user_list_film_urls(page["html"])))
+        page_url = csfd.parse_next_page_url(page["html"])
+    return list(csfd_urls)
+
+
+async def import_film_card(
+    scraper: httpx.AsyncClient,
+    trello_api: httpx.AsyncClient,
+    cards: list[dict],
+    film: Film,
+    inbox_list_id: str,
+    label_ids: dict[str, str],
+    metadata_field_id: str,
+    member_id: str | None = None,
+) -> bool:
+    if trello.find_card(cards, film["title"], film["csfd_url"]):
+        logger.info(f"Already on the board: {film['title']}")
+        return False
+
+    card_data = trello.prepare_card_data(
+        film["title"], film["csfd_url"], move_to_list_id=inbox_list_id
+    )
+    card_data["idLabels"] = trello.get_card_label_ids(
+        {"labels": [], "idLabels": []}, get_labels(film), label_ids
+    )
+    if member_id:
+        card_data["idMembers"] = [member_id]
+    # claimed before the card exists, so that a film listed twice (e.g. a
+    # series and its first season) doesn't get two cards
+    cards.append(card_data)
+    card_data["id"] = await trello.create_card(trello_api, card_data)
+    logger.info(f"Created: {film['title']} {trello.get_card_url(card_data['id'])}")
+    await update_film_metadata(trello_api, card_data, film, metadata_field_id)
+
+    page_urls = [film["csfd_url"], film["kvifftv_url"], film["netflix_url"]]
+    errors = await trello.update_card_attachments(
+        trello_api,
+        scraper,
+        card_data["id"],
+        list(filter(None, page_urls)),
+        film.get("poster_url"),
+        [],
+    )
+    for error in errors:
+        logger.error(error)
+    return True
+
+
+@http.with_scraper
+async def write_films(
+    scraper: httpx.AsyncClient,
+    urls: Iterator[str],
+    output: TextIO,
+    concurrency: int = 5,
+) -> int:
+    failed_count = 0
+    async for result in scrape_films(scraper, urls, concurrency):
+        failed_count += "error" in result
+        output.write(json.dumps(result, ensure_ascii=False) + "\n")
+        output.flush()
+    return failed_count
+
+
+async def scrape_films(
+    scraper: httpx.AsyncClient,
+    urls: Iterator[str],
+    concurrency: int = 5,
+) -> AsyncGenerator[dict]:
+    """Scrapes films as the URLs come and yields them as soon as they're
+    ready, in no particular order. The next URL is read only when there's
+    room for it, so that e.g. a long list from stdin doesn't end up in memory
+    all at once."""
+    reading = None
+    exhausted = False
+    tasks: set[asyncio.Task[dict]] = set()
+    try:
+        while True:
+            if not reading and not exhausted and len(tasks) < concurrency:
+                # reading e.g. from stdin mustn't block scraping
+                reading = read_next(urls)
+            if not (waiting := tasks | ({reading} if reading else set())):
+                break
+            done, _ = await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+            if reading in done:
+                if (url := reading.result()) is None:
+                    exhausted = True
+                elif url := url.strip():
+                    tasks.add(asyncio.create_task(scrape_url(scraper, url)))
+                reading = None
+            for task in done & tasks:
+                tasks.remove(task)
+                yield task.result()
+    finally:
+        if reading:
+            reading.cancel()
+        for task in tasks:
+            task.cancel()
+
+
+def read_next(urls: Iterator[str]) -> asyncio.Future[str | None]:
+    """Reads the next URL in a daemon thread. Unlike asyncio.to_thread(),
+    which waits for its threads when the loop closes, an interactive stdin
+    then can't keep e.g. Ctrl+C from stopping the program until EOF."""
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def set_result(result: str | None) -> None:
+        if not future.done():
+            future.set_result(result)
+
+    def set_exception(exc: BaseException) -> None:
+        if not future.done():
+            future.set_exception(exc)
+
+    def read() -> None:
+        try:
+            result = next(urls, None)
+        except Exception as exc:  # noqa: BLE001, raised in the loop
+            callback = partial(set_exception, exc)
+        else:
+            callback = partial(set_result, result)
+        with suppress(RuntimeError):  # the loop is closed already
+            loop.call_soon_threadsafe(callback)
+
+    threading.Thread(target=read, name="read-urls", daemon=True).start()
+    return future
+
+
+async def scrape_url(scraper: httpx.AsyncClient, url: str) -> dict:
+    try:
+        csfd_url = await get_csfd_url(scraper, url)
+        return {"url": url, **await scrape_film(scraper, csfd_url)}
+    except Exception as exc:
+        logger.exception(f"Failed to scrape {url}")
+        return {"url": url, "error": str(exc)}
+
+
 @trello.with_trello_api
 @http.with_scraper
-async def process_inbox(
+async def import_user_list(
     scraper: httpx.AsyncClient,
     trello_api: httpx.AsyncClient,
+    list_url: str,
     board_id: str,
-    sort_cards: bool = True,
+    username: str | None = None,
+    concurrency: int = 5,
 ) -> None:
-    inbox_list_id, archive_list_id = await trello.get_working_lists_ids(
-        trello_api, board_id
+    async for message in import_films(
+        scraper, trello_api, list_url, board_id, username, concurrency
+    ):
+        logger.info(message)
+
+
+class FilmMetadata(TypedDict):
+    """What's stored on the card, so that it can be sorted without scraping"""
+
+    csfd_id: int | None
+    durations: list[int]
+    is_tvshow: bool
+    kvifftv: bool
+    netflix: bool
+    scraped_at: str
+
+
+def get_film_metadata(film: Film) -> FilmMetadata:
+    return FilmMetadata(
+        csfd_id=csfd.get_film_id(film["csfd_url"]),
+        durations=film["durations"],
+        is_tvshow=film["is_tvshow"],
+        kvifftv=bool(film["kvifftv_url"]),
+        netflix=bool(film["netflix_url"]),
+        scraped_at=datetime.now(UTC).isoformat(timespec="seconds"),
     )
 
+
+async def update_film_metadata(
+    trello_api: httpx.AsyncClient,
+    card: dict,
+    film: Film,
+    metadata_field_id: str,
+) -> None:
+    metadata = get_film_metadata(film)
+    card_metadata = trello.get_card_metadata(card, metadata_field_id) or {}
+    # the timestamp is of the last scrape which changed anything
+    if card_metadata | {"scraped_at": None} != metadata | {"scraped_at": None}:
+        await trello.update_card_metadata(
+            trello_api, card["id"], metadata_field_id, dict(metadata)
+        )
+
+
+class InboxSummary(TypedDict):
+    board_id: str
+    processed: int
+    resumed: int
+    failed: list[str]
+    error: NotRequired[str]
+
+
+@dataclass(slots=True, frozen=True)
+class InboxItem:
+    """What's left of a processed inbox card for sorting"""
+
+    card_id: str
+    pos: float
+    sort_key: tuple[int, int, str]
+
+
+class FilmCache:
+    """Recently scraped films, shared by boards processed at the same time.
+    Whoever asks for a film which is just being scraped waits for the same
+    scrape."""
+
+    def __init__(self, scraper: httpx.AsyncClient, maxsize: int = 1000) -> None:
+        self.scraper = scraper
+        self.maxsize = maxsize
+        self.films: OrderedDict[str, asyncio.Task[Film]] = OrderedDict()
+
+    async def get(self, csfd_url: str) -> Film:
+        try:
+            task = self.films[csfd_url]
+            self.films.move_to_end(csfd_url)
+        except KeyError:
+            task = asyncio.create_task(scrape_film(self.scraper, csfd_url))
+            task.add_done_callback(partial(self.forget_failed, csfd_url))
+            self.films[csfd_url] = task
+            if len(self.films) > self.maxsize:
+                self.films.popitem(last=False)
+        return await asyncio.shield(task)
+
+    def forget_failed(self, csfd_url: str, task: asyncio.Task[Film]) -> None:
+        if (task.cancelled() or task.exception()) and (
+            self.films.get(csfd_url) is task
+        ):
+            del self.films[csfd_url]
+
+
+@trello.with_trello_api
+@http.with_scraper
+async def process_inboxes(
+    scraper: httpx.AsyncClient,
+    trello_api: httpx.AsyncClient,
+    board_ids: list[str],
+    sort_cards: bool = True,
+    resume: bool = False,
+) -> list[InboxSummary]:
+    films = FilmCache(scraper)
+
+    async def process_board(board_id: str) -> InboxSummary:
+        try:
+            return await process_inbox(
+                scraper, trello_api, board_id, films, sort_cards, resume
+            )
+        except Exception as exc:
+            logger.exception(f"Failed to process board {board_id}")
+            if isinstance(exc, httpx.HTTPStatusError):
+                logger.error(exc.response.text)
+            return InboxSummary(
+                board_id=board_id, processed=0, resumed=0, failed=[], error=str(exc)
+            )
+
+    return await asyncio.gather(*(process_board(board_id) for board_id in board_ids))
+
+
+async def process_inbox(
+    scraper: httpx.AsyncClient,
+    trello_api: httpx.AsyncClient,
+    board_id: str,
+    films: FilmCache,
+    sort_cards: bool = True,
+    resume: bool = False,
+    mirror: BoardMirror | None = None,
+) -> InboxSummary:
+    # e.g. the bot's scheduled run and the inbox command share the journal
+    with lock_file(get_lock_path(board_id)):
+        return await process_locked_inbox(
+            scraper, trello_api, board_id, films, sort_cards, resume, mirror
+        )
+
+
+async def process_locked_inbox(
+    scraper: httpx.AsyncClient,
+    trello_api: httpx.AsyncClient,
+    board_id: str,
+    films: FilmCache,
+    sort_cards: bool = True,
+    resume: bool = False,
+    mirror: BoardMirror | None = None,
+) -> InboxSummary:
+    if mirror:
+        inbox_list_id, archive_list_id = await mirror.get_working_lists_ids()
+    else:
+        inbox_list_id, archive_list_id = await trello.get_working_lists_ids(
+            trello_api, board_id
+        )
+
     years_ago = datetime.now(UTC).date() - timedelta(days=365 * 2)
-    years_old_cards = await trello.get_old_cards(trello_api, inbox_list_id, years_ago)
+    if mirror:
+        years_old_cards = await mirror.get_old_cards(inbox_list_id, years_ago)
+    else:
+        years_old_cards = await trello.get_old_cards(
+            trello_api, inbox_list_id, years_ago
+        )
     logger.info(f"Found {len(years_old_cards)} years old cards")
     for card in years_old_cards:
         logger.info(f"Archiving card: {card['name']} {trello.get_card_url(card['id'])}")
     await trello.archive_cards(trello_api, archive_list_id, years_old_cards)
 
-    index = []
+    if mirror:
+        label_ids = await mirror.get_board_labels()
+        metadata_field_id = await mirror.get_metadata_field_id()
+        cards = mirror.iter_cards(inbox_list_id)
+    else:
+        label_ids = await trello.get_board_labels(trello_api, board_id)
+        metadata_field_id = await trello.get_metadata_field_id(trello_api, board_id)
+        cards = trello.iter_cards(trello_api, inbox_list_id)
+    summary = InboxSummary(board_id=board_id, processed=0, resumed=0, failed=[])
+    journal = Journal(get_journal_path(board_id), resume=resume)
+    items = []
+    failed_cards = []
 
-    cards = await trello.get_cards(trello_api, [inbox_list_id])
-    for card in cards:
-        logger.info(f"Processing: {card['name']} {trello.get_card_url(card['id'])}")
-        if csfd_url := csfd.get_csfd_url(card["desc"]):
-            logger.info(f"CSFD.cz URL: {csfd_url}")
+    try:
+        async for card in cards:
+            if (entry := journal.get(card["id"])) and entry["status"] != "failed":
+                logger.info(f"Already processed: {card['name']}")
+                if entry["film"]:
+                    items.append(get_inbox_item(card, entry["film"]))
+                else:
+                    items.append(get_stored_inbox_item(card, metadata_field_id))
+                summary["resumed"] += 1
+            elif await process_journaled_card(
+                scraper,
+                trello_api,
+                journal,
+                card,
+                label_ids,
+                films,
+                items,
+                metadata_field_id,
+            ):
+                summary["processed"] += 1
+            else:
+                failed_cards.append(card)
+
+        if failed_cards:
+            logger.info(f"Retrying {len(failed_cards)} failed cards")
+        for card in failed_cards:
+            if await process_journaled_card(
+                scraper,
+                trello_api,
+                journal,
+                card,
+                label_ids,
+                films,
+                items,
+                metadata_field_id,
+            ):
+                summary["processed"] += 1
+            else:
+                summary["failed"].append(card["id"])
+                items.append(get_stored_inbox_item(card, metadata_field_id))
+
+        if sort_cards:
+            await sort_inbox_items(trello_api, items)
+        else:
+            logger.info("Skipping cards sorting")
+    except BaseException:
+        # the journal stays for --resume
+        journal.close()
+        raise
+    journal.close(remove=not summary["failed"])
+    return summary
 
-            film = get_film(await get_csfd_pages(scraper, csfd_url))
-            logger.info(f"Film:\n{pformat(film)}")
 
-            logger.info(f"Updating: {card['name']} {trello.get_card_url(card['id'])}")
-            card_data = trello.prepare_card_data(film["title"], film["csfd_url"])
-            await trello.update_card(trello_api, card["id"], card_data)
+async def process_journaled_card(
+    scraper: httpx.AsyncClient,
+    trello_api: httpx.AsyncClient,
+    journal: Journal,
+    card: dict,
+    label_ids: dict[str, str],
+    films: FilmCache,
+    items: list[InboxItem],
+    metadata_field_id: str | None = None,
+) -> bool:
+    try:
+        film = await process_inbox_card(
+            scraper, trello_api, card, label_ids, films, metadata_field_id
+        )
+    except SuppressedError as exc:
+        logger.info(str(exc))
+        journal.record(card["id"], "skipped")
+        items.append(get_stored_inbox_item(card, metadata_field_id))
+        return True
+    except Exception as exc:
+        logger.exception(f"Failed: {card['name']} {trello.get_card_url(card['id'])}")
+        journal.record(card["id"], "failed", error=str(exc))
+        return False
+    if film:
+        items.append(get_inbox_item(card, film))
+        journal.record(card["id"], "done", film=dict(film))
+    else:
+        items.append(get_stored_inbox_item(card, metadata_field_id))
+        journal.record(card["id"], "skipped")
+    return True
 
-            labels = get_labels(film)
-            await trello.update_card_labels(trello_api, card["id"], labels)
 
-            page_urls = [csfd_url, film["kvifftv_url"], film["netflix_url"]]
-            errors = await trello.update_card_attachments(
-                trello_api,
-                scraper,
-                card["id"],
-                list(filter(None, page_urls)),
-                film.get("poster_url"),
-            )
-            for error in errors:
-                logger.error(error)
+async def process_inbox_card(
+    scraper: httpx.AsyncClient,
+    trello_api: httpx.AsyncClient,
+    card: dict,
+    label_ids: dict[str, str],
+    films: FilmCache,
+    metadata_field_id: str | None = None,
+) -> Film | None:
+    logger.info(f"Processing: {card['name']} {trello.get_card_url(card['id'])}")
+    if csfd_url := csfd.get_csfd_url(card["desc"]):
+        logger.info(f"CSFD.cz URL: {csfd_url}")
+
+        film = await films.get(csfd_url)
+        logger.info(f"Film:\n{pformat(film)}")
+
+        errors = await update_inbox_card(
+            trello_api, scraper, card, csfd_url, film, label_ids, metadata_field_id
+        )
+        for error in errors:
+            logger.error(error)
 
-            index.append((card, film))
-            logger.info(f"Done! {trello.get_card_url(card['id'])}")
-        else:
-            logger.info("Card description doesn't contain CSFD.cz URL")
+        logger.info(f"Done! {trello.get_card_url(card['id'])}")
+        return film
+    logger.info("Card description doesn't contain CSFD.cz URL")
+    return None
 
-    if sort_cards:
-        logger.info("Sorting cards")
-        for position, (card, _) in enumerate(
-            sorted(index, key=sort_inbox_key), start=1
-        ):
-            logger.info(f"#{position}: {card['name']}")
-            await trello.update_card_position(trello_api, card["id"], position)
-    else:
-        logger.info("Skipping cards sorting")
+
+def get_inbox_item(card: dict, film: Film | FilmMetadata | None) -> InboxItem:
+    return InboxItem(
+        card_id=card["id"],
+        pos=card["pos"],
+        sort_key=sort_inbox_key(card, film),
+    )
+
+
+def get_stored_inbox_item(card: dict, metadata_field_id: str | None) -> InboxItem:
+    # cards which haven't been scraped are sorted the same as by --sort-only,
+    # by what's stored on them, or last, e.g. if there's no CSFD.cz URL
+    metadata = (
+        trello.get_card_metadata(card, metadata_field_id) if metadata_field_id else None
+    )
+    return get_inbox_item(card, metadata)
+
+
+async def update_inbox_card(
+    trello_api: httpx.AsyncClient,
+    scraper: httpx.AsyncClient,
+    card: dict,
+    csfd_url: str,
+    film: Film,
+    label_ids: dict[str, str],
+    metadata_field_id: str | None = None,
+) -> list[str]:
+    card_data = trello.prepare_card_data(film["title"], film["csfd_url"])
+    card_data["idLabels"] = trello.get_card_label_ids(card, get_labels(film), label_ids)
+    if changes := trello.get_card_changes(card, card_data):
+        logger.info(f"Updating: {card['name']} {trello.get_card_url(card['id'])}")
+        await trello.update_card(trello_api, card["id"], changes)
+    if metadata_field_id:
+        await update_film_metadata(trello_api, card, film, metadata_field_id)
+
+    page_urls = [csfd_url, film["kvifftv_url"], film["netflix_url"]]
+    return await trello.update_card_attachments(
+        trello_api,
+        scraper,
+        card["id"],
+        list(filter(None, page_urls)),
+        film.get("poster_url"),
+        card["attachments"],
+    )
 
 
-def sort_inbox_key(index_item: tuple[dict, Film]) -> tuple[int, int, str]:
-    card, film = index_item
+@trello.with_trello_api
+async def sort_inboxes(trello_api: httpx.AsyncClient, board_ids: list[str]) -> None:
+    await asyncio.gather(*(sort_inbox(trello_api, board_id) for board_id in board_ids))
+
+
+async def sort_inbox(trello_api: httpx.AsyncClient, board_id: str) -> None:
+    inbox_list_id, _ = await trello.get_working_lists_ids(trello_api, board_id)
+    metadata_field_id = await trello.get_metadata_field_id(trello_api, board_id)
+    items = []
+    missing_count = 0
+    async for card in trello.iter_cards(trello_api, inbox_list_id):
+        if not trello.get_card_metadata(card, metadata_field_id):
+            missing_count += 1
+        items.append(get_stored_inbox_item(card, metadata_field_id))
+    if missing_count:
+        logger.warning(
+            f"Board {board_id}: {missing_count} cards have no film metadata "
+            "and go last, run inbox without --sort-only to add it"
+        )
+    await sort_inbox_items(trello_api, items)
+
 
+async def sort_inbox_items(
+    trello_api: httpx.AsyncClient,
+    items: list[InboxItem],
+) -> None:
+    logger.info("Sorting cards")
+    items.sort(key=attrgetter("sort_key"))
+    for position, item in enumerate(items, start=1):
+        if item.pos == position:
+            continue
+        logger.info(f"#{position}: {item.sort_key[-1]}")
+        await trello.update_card_position(trello_api, item.card_id, position)
+
+
+def sort_inbox_key(
+    card: dict, film: Film | FilmMetadata | None
+) -> tuple[int, int, str]:
     min_duration = min(film["durations"]) if (film and film["durations"]) else 1000
     labels = [label["name"].upper() for label in (card["labels"] or [])]
     is_available = (
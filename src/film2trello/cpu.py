@@ -0,0 +1,60 @@
+import asyncio
+import multiprocessing
+import os
+import sys
+from collections.abc import Callable
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import cache, partial
+
+
+def is_free_threaded() -> bool:
+    return not sys._is_gil_enabled()
+
+
+def get_workers_count() -> int:
+    if count := os.environ.get("FILM2TRELLO_CPU_WORKERS"):
+        return int(count)
+    return os.process_cpu_count() or 1
+
+
+@cache
+def get_thread_pool() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(get_workers_count(), thread_name_prefix="cpu")
+
+
+@cache
+def get_process_pool() -> ProcessPoolExecutor:
+    # forking a process which already runs threads could deadlock the child
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context(
+        "forkserver" if "forkserver" in methods else None
+    )
+    return ProcessPoolExecutor(get_workers_count(), mp_context=context)
+
+
+def get_executor(picklable: bool = True, releases_gil: bool = False) -> Executor | None:
+    """Threads run in parallel on the free-threaded build, or if the work lets
+    go of the GIL, such as lxml parsing. Otherwise only processes do, but they
+    can take only work which can be pickled. Returns None if there's no way
+    to run the work in parallel."""
+    if is_free_threaded() or releases_gil:
+        return get_thread_pool()
+    if picklable:
+        return get_process_pool()
+    return None
+
+
+async def run_cpu[R](
+    fn: Callable[..., R],
+    *args,
+    picklable: bool = True,
+    releases_gil: bool = False,
+) -> R:
+    """Runs CPU-heavy work off the event loop, if it can run in parallel.
+    With `picklable=False`, the function, its arguments, or its result can't
+    be sent to another process, e.g. lxml trees."""
+    if executor := get_executor(picklable, releases_gil):
+        return await asyncio.get_running_loop().run_in_executor(
+            executor, partial(fn, *args)
+        )
+    return fn(*args)
@@ -22,6 +22,12 @@ KVIFF_URL_RE = re.compile(r"https?://(www\.)?kviff\.tv/katalog/[^\s\"']+")
 
 CSFD_URL_RE = re.compile(r"https?://(www\.)?csfd\.cz/film/[^\s\"']+")
 
+FILM_ID_RE = re.compile(r"csfd\.cz/film/(\d+)")
+
+FILM_PATH_RE = re.compile(r"csfd\.cz/film/((\d+)[^/\s\"']*/)((\d+)[^/\s\"']*/)?")
+
+USER_LIST_URL_RE = re.compile(r"https?://(www\.)?csfd\.cz/uzivatel/[^\s\"']+")
+
 TV_SHOW_SUFFIXES = ("seriál", "série", "epizoda")
 
 
@@ -66,6 +72,27 @@ def get_csfd_url(text: str) -> str | None:
     return None
 
 
+def get_user_list_url(text: str) -> str | None:
+    if match := USER_LIST_URL_RE.search(text):
+        return match.group(0)
+    return None
+
+
+def get_film_id(csfd_url: str) -> int | None:
+    if match := FILM_ID_RE.search(csfd_url):
+        return int(match.group(1))
+    return None
+
+
+def get_film_path_ids(csfd_url: str) -> tuple[int, ...]:
+    """IDs of the film and, if it's e.g. a season, of its episode or season"""
+    if match := FILM_PATH_RE.search(
+        csfd_url if csfd_url.endswith("/") else f"{csfd_url}/"
+    ):
+        return tuple(int(id_) for id_ in (match.group(2), match.group(4)) if id_)
+    return ()
+
+
 def parse_title(csfd_html: html.HtmlElement) -> str:
     title_text = csfd_html.cssselect("title")[0].text_content().strip()
     main_title_text = title_text.split("|")[0].strip()
@@ -180,3 +207,17 @@ def parse_is_tvshow(csfd_html: html.HtmlElement) -> bool:
             if tv_show_suffix in suffix:
                 return True
     return False
+
+
+def parse_user_list_film_urls(csfd_html: html.HtmlElement) -> list[str]:
+    return [
+        ensure_overview_url(link.get("href"))
+        for link in csfd_html.cssselect("a.film-title-name")
+        if link.get("href")
+    ]
+
+
+def parse_next_page_url(csfd_html: html.HtmlElement) -> str | None:
+    if links := csfd_html.cssselect(".pagination a.page-next"):
+        return links[0].get("href")
+    return None
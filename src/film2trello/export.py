@@ -0,0 +1,116 @@
+import csv
+import json
+import logging
+from collections.abc import Callable
+from typing import Literal, TextIO
+
+import httpx
+
+from film2trello import csfd, trello
+from film2trello.core import FilmMetadata
+
+
+logger = logging.getLogger("film2trello.export")
+
+
+type ExportFormat = Literal["jsonl", "csv"]
+
+EXPORT_CARD_FIELDS = [*trello.CARD_FIELDS, "closed", "dateLastActivity"]
+
+EXPORT_FIELDS = [
+    "list_id",
+    "list_name",
+    "card_id",
+    "card_url",
+    "archived",
+    "name",
+    "csfd_url",
+    "labels",
+    "members",
+    "created_at",
+    "last_activity_at",
+]
+
+METADATA_FIELDS = list(FilmMetadata.__annotations__)
+
+
+@trello.with_trello_api
+async def export_board(
+    trello_api: httpx.AsyncClient,
+    board_id: str,
+    output: TextIO,
+    output_format: ExportFormat = "jsonl",
+    with_metadata: bool = False,
+) -> int:
+    """Writes a row for each card of the board as soon as it's read, incl.
+    archived lists and cards. Only the cards of one list are in memory at
+    a time."""
+    lists = (
+        await trello_api.get(f"/boards/{board_id}/lists", params={"filter": "all"})
+    ).json()
+    members = await trello.get_board_members(trello_api, board_id)
+    usernames = {member["id"]: member["username"] for member in members}
+    metadata_field_id = None
+    if with_metadata:
+        metadata_field_id = await trello.find_metadata_field_id(trello_api, board_id)
+        if not metadata_field_id:
+            logger.warning("The board has no film information stored on its cards")
+
+    write = get_writer(
+        output,
+        output_format,
+        EXPORT_FIELDS + (METADATA_FIELDS if with_metadata else []),
+    )
+    count = 0
+    for lst in lists:
+        logger.info(f"Exporting list: {lst['name']}")
+        async for card in trello.iter_cards(
+            trello_api, lst["id"], fields=EXPORT_CARD_FIELDS, card_filter="all"
+        ):
+            row = get_export_row(lst, card, usernames)
+            if with_metadata:
+                metadata = (
+                    trello.get_card_metadata(card, metadata_field_id)
+                    if metadata_field_id
+                    else None
+                ) or {}
+                row |= {field: metadata.get(field) for field in METADATA_FIELDS}
+            write(row)
+            count += 1
+    return count
+
+
+def get_export_row(lst: dict, card: dict, usernames: dict[str, str]) -> dict:
+    return {
+        "list_id": lst["id"],
+        "list_name": lst["name"],
+        "card_id": card["id"],
+        "card_url": trello.get_card_url(card["id"]),
+        # also cards of an archived list, which are gone from the board too
+        "archived": card["closed"] or lst.get("closed", False),
+        "name": card["name"],
+        "csfd_url": csfd.get_csfd_url(card["desc"]),
+        "labels": [label["name"] for label in card["labels"]],
+        "members": [
+            usernames.get(member_id, member_id) for member_id in card["idMembers"]
+        ],
+        "created_at": trello.get_card_created_at(card["id"]).isoformat(),
+        "last_activity_at": card.get("dateLastActivity"),
+    }
+
+
+def get_writer(
+    output: TextIO,
+    output_format: ExportFormat,
+    fields: list[str],
+) -> Callable[[dict], None]:
+    if output_format == "csv":
+        writer = csv.DictWriter(output, fields, lineterminator="\n")
+        writer.writeheader()
+        return lambda row: writer.writerow(
+            {
+                key: "; ".join(map(str, value)) if isinstance(value, list) else value
+                for key, value in row.items()
+            }
+        )
+    return lambda row: output.write(json.dumps(row, ensure_ascii=False) + "\n")
@@ -0,0 +1,142 @@
+import logging
+import time
+from datetime import datetime
+from functools import cache
+from pathlib import Path
+from typing import TypedDict
+
+from film2trello.storage import get_data_dir, load_json, save_json
+
+
+logger = logging.getLogger("film2trello.failures")
+
+
+# how long to leave a resource alone after its first failure, the delay
+# doubles with every further failure of the same kind
+BACKOFF_BASES = {
+    "antibot": 6 * 60 * 60,
+    "http": 24 * 60 * 60,
+    "decode": 7 * 24 * 60 * 60,
+}
+
+BACKOFF_DEFAULT_BASE = 60 * 60
+
+BACKOFF_MAX = 60 * 24 * 60 * 60
+
+
+class Failure(TypedDict):
+    kind: str
+    resource: str
+    failure: str
+    count: int
+    error: str
+    failed_at: float
+    retry_at: float
+
+
+class SuppressedError(RuntimeError):
+    def __init__(self, failure: Failure) -> None:
+        self.failure = failure
+        super().__init__(
+            f"Skipping {failure['kind']} {failure['resource']} until "
+            f"{format_time(failure['retry_at'])}, it keeps failing: {failure['error']}"
+        )
+
+
+class FailureCache:
+    """Persistent record of resources which keep failing, e.g. posters which
+    can't be decoded or pages which always get an Anubis challenge. Each of
+    them is left alone for a while, which grows exponentially with every
+    further failure of the same type."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.failures: dict[str, Failure] = load_json(path, {})
+        self.suppressed_count = 0
+
+    def check(self, kind: str, resource: str) -> None:
+        """Raises SuppressedError if the resource should be left alone"""
+        failure = self.failures.get(get_key(kind, resource))
+        if failure and failure["retry_at"] > time.time():
+            self.suppressed_count += 1
+            raise SuppressedError(failure)
+
+    def record_failure(
+        self,
+        kind: str,
+        resource: str,
+        failure_type: str,
+        error: str,
+    ) -> Failure:
+        key = get_key(kind, resource)
+        previous = self.failures.get(key)
+        count = (
+            previous["count"] + 1
+            if previous and previous["failure"] == failure_type
+            else 1
+        )
+        base = BACKOFF_BASES.get(failure_type, BACKOFF_DEFAULT_BASE)
+        now = time.time()
+        self.failures[key] = failure = Failure(
+            kind=kind,
+            resource=resource,
+            failure=failure_type,
+            count=count,
+            error=error,
+            failed_at=now,
+            retry_at=now + min(base * 2 ** (count - 1), BACKOFF_MAX),
+        )
+        logger.info(
+            f"Failed {count}x ({failure_type}), leaving {kind} {resource} alone "
+            f"until {format_time(failure['retry_at'])}"
+        )
+        return failure
+
+    def record_success(self, kind: str, resource: str) -> None:
+        self.failures.pop(get_key(kind, resource), None)
+
+    def report(self) -> list[Failure]:
+        now = time.time()
+        return sorted(
+            (
+                failure
+                for failure in self.failures.values()
+                if failure["retry_at"] > now
+            ),
+            key=lambda failure: failure["retry_at"],
+        )
+
+    def prune(self, max_age: float = BACKOFF_MAX * 2) -> None:
+        # e.g. cards of the film have been archived since, nobody asks anymore
+        now = time.time()
+        self.failures = {
+            key: failure
+            for key, failure in self.failures.items()
+            if now - failure["failed_at"] < max_age
+        }
+
+    def save(self) -> None:
+        self.prune()
+        save_json(self.path, self.failures)
+
+
+@cache
+def get_failure_cache() -> FailureCache:
+    return FailureCache(get_data_dir() / "failures.json")
+
+
+def log_suppressed() -> None:
+    failure_cache = get_failure_cache()
+    if failure_cache.suppressed_count:
+        logger.info(
+            f"Skipped {failure_cache.suppressed_count} resources which keep "
+            "failing, run 'film2trello failures' to see them"
+        )
+
+
+def get_key(kind: str, resource: str) -> str:
+    return f"{kind} {resource}"
+
+
+def format_time(timestamp: float) -> str:
+    return f"{datetime.fromtimestamp(timestamp):%Y-%m-%d %H:%M}"
@@ -0,0 +1,49 @@
+import asyncio
+from collections.abc import Awaitable, Callable
+from typing import Any, Self
+
+
+class TaskGraph:
+    """Steps which depend on results of other steps. Each step starts as soon
+    as all its dependencies are done, so independent steps run concurrently.
+    Must be used as an async context manager, which cancels whatever is left
+    running when leaving it, e.g. because one of the steps has failed."""
+
+    def __init__(self) -> None:
+        self.tasks: dict[str, asyncio.Task] = {}
+
+    async def __aenter__(self) -> Self:
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        for task in self.tasks.values():
+            task.cancel()
+        # retrieves exceptions of the tasks nobody has waited for
+        await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+
+    def add(
+        self,
+        name: str,
+        func: Callable[..., Awaitable[Any]],
+        *dependencies: str,
+        after: tuple[str, ...] = (),
+    ) -> None:
+        """Adds a step, which gets called with results of the dependencies
+        as positional arguments, in the given order. Steps given as `after`
+        must succeed too before it starts, but their results aren't passed."""
+        if name in self.tasks:
+            raise ValueError(f"Step '{name}' already exists")
+        if missing := [dep for dep in (*dependencies, *after) if dep not in self.tasks]:
+            raise ValueError(f"Step '{name}' depends on unknown steps: {missing!r}")
+        tasks = [self.tasks[dep] for dep in dependencies]
+        after_tasks = [self.tasks[dep] for dep in after]
+
+        async def run() -> Any:
+            for task in after_tasks:
+                await task
+            return await func(*[await task for task in tasks])
+
+        self.tasks[name] = asyncio.create_task(run(), name=name)
+
+    async def get(self, name: str) -> Any:
+        return await self.tasks[name]
@@ -1,13 +1,34 @@
+import asyncio
 import logging
+import os
 import random
-from collections.abc import Callable, Coroutine
-from functools import wraps
-from typing import Any, TypedDict
+import re
+import statistics
+import time
+from collections import defaultdict, deque
+from collections.abc import (
+    AsyncIterator,
+    Callable,
+    Coroutine,
+    Hashable,
+    Iterable,
+    Iterator,
+)
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import cache, partial, wraps
+from pathlib import Path
+from typing import Any, Literal, TypedDict
 
 import httpx
 import stamina
 from lxml import html
 
+from film2trello.cassette import CassetteTransport, get_cassette
+from film2trello.cpu import run_cpu
+from film2trello.failures import get_failure_cache, log_suppressed
+from film2trello.storage import get_data_dir, load_json, save_json
+
 
 logger = logging.getLogger("film2trello.http")
 
@@ -40,8 +61,299 @@ class RetryTransport(httpx.AsyncBaseTransport):
         await self.transport.aclose()
 
 
-def get_transport() -> httpx.AsyncBaseTransport:
-    return RetryTransport(httpx.AsyncHTTPTransport(http2=True))
+class HedgingTransport(httpx.AsyncBaseTransport):
+    """Sends a duplicate of a safe request which has been outstanding for
+    longer than most recent requests to the same host took. Whichever
+    response comes first wins, the other request gets cancelled."""
+
+    def __init__(
+        self,
+        transport: httpx.AsyncBaseTransport,
+        percentile: int = 95,
+        max_share: float = 0.1,
+        window: int = 100,
+        min_samples: int = 20,
+    ) -> None:
+        self.transport = transport
+        self.percentile = percentile
+        self.max_share = max_share
+        self.min_samples = min_samples
+        self.latencies: defaultdict[str, deque[float]] = defaultdict(
+            partial(deque, maxlen=window)
+        )
+        self.requests_count = 0
+        self.hedged_count = 0
+        self.closing: set[asyncio.Task] = set()
+
+    def get_hedge_delay(self, host: str) -> float | None:
+        latencies = self.latencies[host]
+        if len(latencies) < self.min_samples:
+            return None
+        if self.hedged_count >= self.requests_count * self.max_share:
+            return None
+        return statistics.quantiles(latencies, n=100)[self.percentile - 1]
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if request.method not in RetryTransport.SAFE_METHODS:
+            return await self.transport.handle_async_request(request)
+
+        self.requests_count += 1
+        started_at = time.monotonic()
+        tasks = [asyncio.create_task(self.transport.handle_async_request(request))]
+        winner = None
+        try:
+            if delay := self.get_hedge_delay(request.url.host):
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done:
+                    logger.debug(f"Hedging request after {delay:.2f}s: {request.url}")
+                    self.hedged_count += 1
+                    tasks.append(
+                        asyncio.create_task(
+                            self.transport.handle_async_request(request)
+                        )
+                    )
+            winner = await self.race(tasks)
+        finally:
+            for task in tasks:
+                if task is not winner:
+                    task.cancel()
+                    # the loser might have got its response before the cancel
+                    task.add_done_callback(self.close_response)
+        # the original request took at least this long even if the hedge won,
+        # counting only the winners would make the percentile too low
+        self.latencies[request.url.host].append(time.monotonic() - started_at)
+        return winner.result()
+
+    async def race(self, tasks: list[asyncio.Task]) -> asyncio.Task:
+        pending = set(tasks)
+        while True:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            # if the first request fails, the other one still has a chance
+            for task in tasks:
+                if task in done and not task.exception():
+                    return task
+            if not pending:
+                raise done.pop().exception()
+
+    def close_response(self, task: asyncio.Task) -> None:
+        if task.cancelled() or task.exception():
+            return
+        closing = asyncio.create_task(task.result().aclose())
+        self.closing.add(closing)
+        closing.add_done_callback(self.closing.discard)
+
+    async def aclose(self) -> None:
+        await asyncio.gather(*self.closing, return_exceptions=True)
+        await self.transport.aclose()
+
+
+class RateLimitTransport(httpx.AsyncBaseTransport):
+    """Lets at most `limit` requests through in any `period` of seconds,
+    the rest waits. Everyone using the same client shares the budget."""
+
+    def __init__(
+        self,
+        transport: httpx.AsyncBaseTransport,
+        limit: int,
+        period: float,
+    ) -> None:
+        self.transport = transport
+        self.limit = limit
+        self.period = period
+        self.sent_at: deque[float] = deque()
+        self.lock = asyncio.Lock()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                while self.sent_at and self.sent_at[0] <= now - self.period:
+                    self.sent_at.popleft()
+                if len(self.sent_at) < self.limit:
+                    break
+                await asyncio.sleep(self.sent_at[0] + self.period - now)
+            self.sent_at.append(now)
+        return await self.transport.handle_async_request(request)
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+type Priority = Literal["interactive", "background"]
+
+PRIORITIES: tuple[Priority, ...] = ("interactive", "background")
+
+PRIORITY_MIN_SHARES: dict[Priority, float] = {"background": 0.2}
+
+PRIORITY_CAPACITY = 8
+
+priority_var: ContextVar[Priority] = ContextVar("priority", default="background")
+
+
+@contextmanager
+def priority(name: Priority) -> Iterator[None]:
+    """Requests sent inside the block are of given priority"""
+    token = priority_var.set(name)
+    try:
+        yield
+    finally:
+        priority_var.reset(token)
+
+
+class WaitStats:
+    """How long requests of each priority waited for their turn"""
+
+    def __init__(self) -> None:
+        self.counts: dict[str, int] = defaultdict(int)
+        self.totals: dict[str, float] = defaultdict(float)
+        self.maximums: dict[str, float] = defaultdict(float)
+
+    def record(self, name: str, wait: float) -> None:
+        self.counts[name] += 1
+        self.totals[name] += wait
+        self.maximums[name] = max(self.maximums[name], wait)
+
+    def format(self) -> str:
+        return ", ".join(
+            f"{name} {self.counts[name]} requests waited "
+            f"{self.totals[name] / self.counts[name]:.2f}s on average, "
+            f"{self.maximums[name]:.2f}s at most"
+            for name in PRIORITIES
+            if self.counts[name]
+        )
+
+
+wait_stats = WaitStats()
+
+
+def log_wait_stats() -> None:
+    if text := wait_stats.format():
+        logger.info(f"Queue wait: {text}")
+
+
+class PriorityTransport(httpx.AsyncBaseTransport):
+    """Lets at most `capacity` requests be in flight. Those waiting are let
+    through by priority, unless a class got less than its minimum share of
+    the recent turns, so that background work still makes progress while
+    interactive requests keep coming."""
+
+    def __init__(
+        self,
+        transport: httpx.AsyncBaseTransport,
+        capacity: int = PRIORITY_CAPACITY,
+        min_shares: dict[Priority, float] = PRIORITY_MIN_SHARES,
+        window: int = 100,
+    ) -> None:
+        self.transport = transport
+        self.capacity = capacity
+        self.min_shares = min_shares
+        self.active = 0
+        self.waiters: dict[Priority, deque[asyncio.Future]] = {
+            name: deque() for name in PRIORITIES
+        }
+        self.turns: deque[Priority] = deque(maxlen=window)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        name = priority_var.get()
+        started_at = time.monotonic()
+        await self.acquire(name)
+        wait_stats.record(name, time.monotonic() - started_at)
+        try:
+            response = await self.transport.handle_async_request(request)
+        except BaseException:
+            self.release()
+            raise
+        if response.is_closed:
+            # the body has been read already, e.g. when replaying a cassette
+            self.release()
+        else:
+            # the turn lasts until the response body is read or closed
+            response.stream = ReleasingStream(response.stream, self.release)
+        return response
+
+    async def acquire(self, name: Priority) -> None:
+        if self.active < self.capacity and not any(self.waiters.values()):
+            self.take_turn(name)
+            return
+        future = asyncio.get_running_loop().create_future()
+        self.waiters[name].append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.cancelled():
+                if future in self.waiters[name]:
+                    self.waiters[name].remove(future)
+            else:
+                self.release()
+            raise
+
+    def take_turn(self, name: Priority) -> None:
+        self.active += 1
+        self.turns.append(name)
+
+    def release(self) -> None:
+        self.active -= 1
+        while self.active < self.capacity and (name := self.choose()):
+            future = self.waiters[name].popleft()
+            if not future.done():
+                self.take_turn(name)
+                future.set_result(None)
+
+    def choose(self) -> Priority | None:
+        waiting = [name for name in PRIORITIES if self.waiters[name]]
+        for name in waiting:
+            if self.get_share(name) < self.min_shares.get(name, 0):
+                return name
+        return waiting[0] if waiting else None
+
+    def get_share(self, name: Priority) -> float:
+        if not self.turns:
+            return 0
+        return self.turns.count(name) / len(self.turns)
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+class ReleasingStream(httpx.AsyncByteStream):
+    def __init__(
+        self, stream: httpx.AsyncByteStream, release: Callable[[], None]
+    ) -> None:
+        self.stream = stream
+        self.release = release
+        self.released = False
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self.stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self.stream.aclose()
+        finally:
+            if not self.released:
+                self.released = True
+                self.release()
+
+
+def get_transport(
+    hedge: bool = False,
+    rate_limit: tuple[int, float] | None = None,
+) -> httpx.AsyncBaseTransport:
+    transport = httpx.AsyncHTTPTransport(http2=True)
+    if hedge:
+        transport = HedgingTransport(transport)
+    if rate_limit:
+        transport = RateLimitTransport(transport, *rate_limit)
+    # outside the rate limit, otherwise requests would queue there in the
+    # order they came, regardless of their priority
+    transport = PriorityTransport(transport)
+    transport = RetryTransport(transport)
+    if cassette := get_cassette():
+        transport = CassetteTransport(transport, cassette)
+    return transport
 
 
 BROWSER_PROFILES: tuple[dict[str, str], ...] = (
@@ -111,16 +423,82 @@ ANTIBOT_RETRY_ATTEMPTS = 5
 ANUBIS_CHALLENGE_SELECTOR = "script#anubis_challenge"
 
 
-def get_default_headers() -> dict[str, str]:
-    profile = random.choice(BROWSER_PROFILES)
+PROFILE_HEADER_NAMES = frozenset(
+    name.lower() for profile in BROWSER_PROFILES for name in profile
+)
+
+PROFILE_STATS_MAX_COUNT = 200
+
+
+class ProfileStats:
+    """Persistent counts of successful requests and Anubis challenges per
+    browser profile. Picks profiles by Thompson sampling, so the ones which
+    get challenged less are used more, but the others still get a chance."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.counts: dict[str, list[float]] = load_json(path, {})
+
+    def choose(self, exclude: Iterable[dict[str, str]] = ()) -> dict[str, str]:
+        excluded = [profile["User-Agent"] for profile in exclude]
+        profiles = [
+            profile
+            for profile in BROWSER_PROFILES
+            if profile["User-Agent"] not in excluded
+        ] or list(BROWSER_PROFILES)
+        return max(profiles, key=self.sample)
+
+    def sample(self, profile: dict[str, str]) -> float:
+        successes, challenges = self.counts.get(profile["User-Agent"], (0, 0))
+        return random.betavariate(successes + 1, challenges + 1)
+
+    def record(self, profile: dict[str, str], challenged: bool) -> None:
+        counts = self.counts.setdefault(profile["User-Agent"], [0, 0])
+        counts[1 if challenged else 0] += 1
+        # forget old outcomes gradually, Anubis may change its mind
+        if sum(counts) > PROFILE_STATS_MAX_COUNT:
+            counts[:] = [count / 2 for count in counts]
+
+    def save(self) -> None:
+        save_json(self.path, self.counts)
+
+
+@cache
+def get_profile_stats() -> ProfileStats:
+    return ProfileStats(get_data_dir() / "profiles.json")
+
+
+def get_default_headers(profile: dict[str, str] | None = None) -> dict[str, str]:
+    profile = profile or get_profile_stats().choose()
     return {**BASE_HEADERS, **profile}
 
 
+def apply_profile(headers: httpx.Headers, profile: dict[str, str]) -> None:
+    for name in PROFILE_HEADER_NAMES:
+        headers.pop(name, None)
+    headers.update(get_default_headers(profile))
+
+
+def get_client_profile(scraper: httpx.AsyncClient) -> dict[str, str]:
+    user_agent = scraper.headers.get("User-Agent")
+    for profile in BROWSER_PROFILES:
+        if profile["User-Agent"] == user_agent:
+            return profile
+    # e.g. a client which hasn't been created by get_scraper()
+    profile = get_profile_stats().choose()
+    apply_profile(scraper.headers, profile)
+    return profile
+
+
+def is_hedging_enabled() -> bool:
+    return os.environ.get("FILM2TRELLO_HEDGE", "") not in ("", "0")
+
+
 def get_scraper() -> httpx.AsyncClient:
     return httpx.AsyncClient(
         headers=get_default_headers(),
         follow_redirects=True,
-        transport=get_transport(),
+        transport=get_transport(hedge=is_hedging_enabled()),
         event_hooks={"response": [raise_on_error]},
     )
 
@@ -137,7 +515,13 @@ def with_scraper[R](
     @wraps(fn)
     async def wrapper(*args, **kwargs) -> R:
         async with get_scraper() as client:
-            return await fn(client, *args, **kwargs)
+            try:
+                return await fn(client, *args, **kwargs)
+            finally:
+                get_profile_stats().save()
+                get_failure_cache().save()
+                log_wait_stats()
+                log_suppressed()
 
     return wrapper
 
@@ -156,19 +540,131 @@ def is_antibot_page(page_html: html.HtmlElement) -> bool:
     return bool(page_html.cssselect(ANUBIS_CHALLENGE_SELECTOR))
 
 
+class SingleFlight:
+    """Callers asking for the same key at the same time share one call and its
+    result (or exception). Cancelling one of the callers doesn't cancel the
+    call as long as others wait for it. The call runs in the context of the
+    first caller, e.g. with its priority."""
+
+    def __init__(self) -> None:
+        self.calls: dict[Hashable, asyncio.Task] = {}
+        self.coalesced_count = 0
+
+    async def run[R](
+        self,
+        key: Hashable,
+        fn: Callable[[], Coroutine[Any, Any, R]],
+    ) -> R:
+        if task := self.calls.get(key):
+            logger.debug(f"Joining a call in flight: {key!r}")
+            self.coalesced_count += 1
+        else:
+            task = asyncio.create_task(fn())
+            self.calls[key] = task
+            task.add_done_callback(partial(self.forget, key))
+        return await asyncio.shield(task)
+
+    def forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self.calls.get(key) is task:
+            del self.calls[key]
+        if not task.cancelled():
+            # retrieved even if all callers got cancelled meanwhile
+            task.exception()
+
+
+in_flight = SingleFlight()
+
+
+def get_flight_key(scraper: httpx.AsyncClient, kind: str, url: str) -> Hashable:
+    # different clients may e.g. replay different cassettes
+    return (id(scraper), kind, str(httpx.URL(url).copy_with(fragment=None)))
+
+
 async def get_html(scraper: httpx.AsyncClient, url: str) -> Page:
+    if priority_var.get() == "background":
+        # whoever waits for a reply rather gets a fresh attempt
+        get_failure_cache().check("page", url)
+    page = await in_flight.run(
+        get_flight_key(scraper, "html", url), partial(fetch_html, scraper, url)
+    )
+    # the page tree is shared by everyone who asked for it at the same time
+    return page | {"request_url": url}
+
+
+async def get_content(scraper: httpx.AsyncClient, url: str) -> bytes:
+    async def fetch_content() -> bytes:
+        return (await scraper.get(url)).content
+
+    return await in_flight.run(get_flight_key(scraper, "content", url), fetch_content)
+
+
+async def fetch_html(scraper: httpx.AsyncClient, url: str) -> Page:
+    profile_stats = get_profile_stats()
+    used_profiles = []
+
     @stamina.retry(
         on=AntiBotError,
         attempts=ANTIBOT_RETRY_ATTEMPTS,
     )
     async def fetch_page() -> Page:
+        # the client keeps impersonating the same browser, as switching
+        # browsers within a session with cookies looks suspicious, but
+        # after a challenge it becomes a different one
+        if used_profiles:
+            apply_profile(scraper.headers, profile_stats.choose(exclude=used_profiles))
+        profile = get_client_profile(scraper)
+        used_profiles.append(profile)
+
         response = await scraper.get(url)
         page_url = str(response.url)
-        page_html = html.fromstring(response.content)
+        page_html = await run_cpu(
+            parse_html, response.content, page_url, picklable=False, releases_gil=True
+        )
         if is_antibot_page(page_html):
+            profile_stats.record(profile, challenged=True)
             logger.warning("Anubis challenge (request_url=%s, url=%s)", url, page_url)
             raise AntiBotError(f"Anubis challenge (request_url={url}, url={page_url})")
-        page_html.make_links_absolute(page_url)
+        profile_stats.record(profile, challenged=False)
         return Page(request_url=url, url=page_url, html=page_html)
 
-    return await fetch_page()
+    failure_cache = get_failure_cache()
+    try:
+        page = await fetch_page()
+    except AntiBotError as exc:
+        failure_cache.record_failure("page", url, "antibot", str(exc))
+        raise
+    except httpx.HTTPStatusError as exc:
+        # server errors are likely to go away on their own
+        if exc.response.is_client_error:
+            failure_cache.record_failure("page", url, "http", str(exc))
+        raise
+    failure_cache.record_success("page", url)
+    return page
+
+
+def parse_html(content: bytes, url: str) -> html.HtmlElement:
+    page_html = html.fromstring(content)
+    page_html.make_links_absolute(url)
+    return page_html
+
+
+async def search_text(
+    scraper: httpx.AsyncClient,
+    url: str,
+    pattern: re.Pattern,
+    overlap: int = 1024,
+) -> str | None:
+    """Streams the page and stops downloading it as soon as the pattern
+    matches. Keeps only the last few characters of what's been read, so that
+    a match split between two chunks isn't missed."""
+    text = ""
+    async with scraper.stream("GET", url) as response:
+        async for chunk in response.aiter_text():
+            text += chunk
+            # a match touching the end of the text could continue in the next chunk
+            if (match := pattern.search(text)) and match.end() < len(text):
+                return match.group(0)
+            text = text[-overlap:]
+    if match := pattern.search(text):
+        return match.group(0)
+    return None
@@ -0,0 +1,78 @@
+import json
+import logging
+from pathlib import Path
+from typing import Literal, TypedDict
+
+from film2trello.storage import get_data_dir
+
+
+logger = logging.getLogger("film2trello.journal")
+
+
+class JournalEntry(TypedDict):
+    card_id: str
+    status: Literal["done", "skipped", "failed"]
+    film: dict | None
+    error: str | None
+
+
+class Journal:
+    """Append-only log of per-card progress of an inbox run, stored as
+    JSON Lines, so that an interrupted run can be resumed."""
+
+    def __init__(self, path: Path, resume: bool = False) -> None:
+        self.path = path
+        self.entries: dict[str, JournalEntry] = {}
+        if resume:
+            self.entries = load_entries(path)
+            logger.info(f"Resuming from {path} ({len(self.entries)} cards)")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.file = path.open("a" if resume else "w")
+        if self.file.tell():
+            # a crash could have left a partially written line behind
+            self.file.write("\n")
+
+    def get(self, card_id: str) -> JournalEntry | None:
+        return self.entries.get(card_id)
+
+    def record(
+        self,
+        card_id: str,
+        status: Literal["done", "skipped", "failed"],
+        film: dict | None = None,
+        error: str | None = None,
+    ) -> None:
+        entry = JournalEntry(card_id=card_id, status=status, film=film, error=error)
+        self.file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        # the film is needed only when resuming, no need to keep it in memory
+        self.entries[card_id] = entry | {"film": None}
+        self.file.flush()
+
+    def close(self, remove: bool = False) -> None:
+        self.file.close()
+        if remove:
+            self.path.unlink(missing_ok=True)
+
+
+def get_journal_path(board_id: str) -> Path:
+    return get_data_dir() / f"inbox-{board_id}.jsonl"
+
+
+def get_lock_path(board_id: str) -> Path:
+    return get_data_dir() / f"inbox-{board_id}.lock"
+
+
+def load_entries(path: Path) -> dict[str, JournalEntry]:
+    entries = {}
+    try:
+        with path.open() as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f"Skipping corrupted journal line: {line!r}")
+                    continue
+                entries[entry["card_id"]] = entry
+    except FileNotFoundError:
+        pass
+    return entries
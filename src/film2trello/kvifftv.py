@@ -0,0 +1,194 @@
+import asyncio
+import logging
+import re
+from collections.abc import Iterable
+from datetime import UTC, datetime, timedelta
+from functools import cache
+from pathlib import Path
+
+import httpx
+from lxml import html
+
+from film2trello import csfd, http
+from film2trello.storage import get_data_dir, load_json, save_json
+
+
+logger = logging.getLogger("film2trello.kvifftv")
+
+
+CATALOG_URL = "https://kviff.tv/katalog/vypis"
+
+SLUG_RE = re.compile(r"kviff\.tv/katalog/(?P<slug>[^/?#\s\"']+)")
+
+FILM_PATH_RE = re.compile(
+    r"^(https?://(www\.)?kviff\.tv)?/katalog/(?P<slug>[^/?#]+)/?$"
+)
+
+NON_FILM_SLUGS = frozenset({"vypis", "tag", "zanr"})
+
+MISSING_TTL = timedelta(days=7)
+
+LISTED_TTL = timedelta(days=30)
+
+
+class KviffTvIndex:
+    """Persistent mapping of KVIFF.TV catalogue slugs to CSFD.cz URLs.
+
+    Films without a CSFD.cz link are remembered as well, but only for
+    MISSING_TTL, because KVIFF.TV can add the link later. Films count as
+    available on KVIFF.TV only for LISTED_TTL since they were last seen
+    there, and a complete crawl of the catalogue forgets films which
+    aren't listed anymore."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        data = load_json(path, {})
+        self.films: dict[str, str] = data.get("films", {})
+        self.missing: dict[str, str] = data.get("missing", {})
+        self.listed: dict[str, str] = data.get("listed", {})
+        self.slugs_by_film_id: dict[int, str] | None = None
+
+    def __contains__(self, slug: str) -> bool:
+        if slug in self.films:
+            return True
+        if checked_at := self.missing.get(slug):
+            return datetime.now(UTC) - datetime.fromisoformat(checked_at) < MISSING_TTL
+        return False
+
+    def get(self, slug: str) -> str | None:
+        return self.films.get(slug)
+
+    def set(self, slug: str, csfd_url: str | None) -> None:
+        self.touch(slug)
+        if csfd_url:
+            self.films[slug] = csfd_url
+            self.missing.pop(slug, None)
+        else:
+            self.films.pop(slug, None)
+            self.missing[slug] = datetime.now(UTC).isoformat()
+        self.slugs_by_film_id = None
+
+    def touch(self, slug: str) -> None:
+        self.listed[slug] = datetime.now(UTC).isoformat()
+        self.slugs_by_film_id = None
+
+    def prune(self, slugs: Iterable[str]) -> int:
+        slugs = set(slugs)
+        gone = (self.films.keys() | self.missing.keys()) - slugs
+        for slug in gone:
+            self.films.pop(slug, None)
+            self.missing.pop(slug, None)
+            self.listed.pop(slug, None)
+        self.slugs_by_film_id = None
+        return len(gone)
+
+    def is_listed(self, slug: str) -> bool:
+        if listed_at := self.listed.get(slug):
+            return datetime.now(UTC) - datetime.fromisoformat(listed_at) < LISTED_TTL
+        return False
+
+    def find_kvifftv_url(self, csfd_url: str) -> str | None:
+        if self.slugs_by_film_id is None:
+            self.slugs_by_film_id = {
+                film_id: slug
+                for slug, url in self.films.items()
+                if self.is_listed(slug) and (film_id := csfd.get_film_id(url))
+            }
+        if slug := self.slugs_by_film_id.get(csfd.get_film_id(csfd_url)):
+            return get_url(slug)
+        return None
+
+    def save(self) -> None:
+        save_json(
+            self.path,
+            {"films": self.films, "missing": self.missing, "listed": self.listed},
+        )
+
+
+@cache
+def get_index() -> KviffTvIndex:
+    return KviffTvIndex(get_data_dir() / "kvifftv.json")
+
+
+def get_slug(kvifftv_url: str) -> str:
+    if match := SLUG_RE.search(kvifftv_url):
+        return match.group("slug")
+    raise ValueError(f"Not a KVIFF.TV catalogue URL: {kvifftv_url}")
+
+
+def get_url(slug: str) -> str:
+    return f"https://kviff.tv/katalog/{slug}"
+
+
+def parse_catalog_slugs(catalog_html: html.HtmlElement) -> list[str]:
+    slugs = {}
+    for element in catalog_html.cssselect("[href*='/katalog/'], [data-href]"):
+        url = element.get("data-href") or element.get("href")
+        if (match := FILM_PATH_RE.search(url)) and (
+            match.group("slug") not in NON_FILM_SLUGS
+        ):
+            slugs[match.group("slug")] = True
+    return list(slugs)
+
+
+def parse_next_page_url(catalog_html: html.HtmlElement) -> str | None:
+    if links := catalog_html.cssselect("link[rel='next'], a[rel='next']"):
+        return links[0].get("href")
+    return None
+
+
+async def crawl_catalog(
+    scraper: httpx.AsyncClient,
+    kvifftv_index: KviffTvIndex,
+    concurrency: int = 5,
+    full: bool = False,
+    catalog_url: str = CATALOG_URL,
+) -> int:
+    slugs = {}
+    page_url = catalog_url
+    while page_url:
+        logger.info(f"Scraping catalogue: {page_url}")
+        page = await http.get_html(scraper, page_url)
+        slugs.update(dict.fromkeys(parse_catalog_slugs(page["html"])))
+        page_url = parse_next_page_url(page["html"])
+    logger.info(f"Found {len(slugs)} films in the catalogue")
+
+    if removed_count := kvifftv_index.prune(slugs):
+        logger.info(f"Removed {removed_count} films which left the catalogue")
+    for slug in slugs:
+        kvifftv_index.touch(slug)
+    if not full:
+        slugs = [slug for slug in slugs if slug not in kvifftv_index]
+    logger.info(f"Indexing {len(slugs)} films")
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def index_film(slug: str) -> bool:
+        try:
+            async with semaphore:
+                csfd_url = await http.search_text(
+                    scraper, get_url(slug), csfd.CSFD_URL_RE
+                )
+        except Exception:
+            logger.exception(f"Failed to index {slug}")
+            return False
+        logger.info(f"Indexed {slug}: {csfd_url}")
+        kvifftv_index.set(slug, csfd_url)
+        return True
+
+    try:
+        results = await asyncio.gather(*(index_film(slug) for slug in slugs))
+    finally:
+        kvifftv_index.save()
+    if failed_count := results.count(False):
+        logger.warning(f"Failed to index {failed_count} films, run again to retry")
+    return results.count(True)
+
+
+@http.with_scraper
+async def index_catalog(
+    scraper: httpx.AsyncClient,
+    concurrency: int = 5,
+    full: bool = False,
+) -> int:
+    return await crawl_catalog(scraper, get_index(), concurrency=concurrency, full=full)
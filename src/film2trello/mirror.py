@@ -0,0 +1,347 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from collections.abc import AsyncGenerator
+from datetime import date
+from pathlib import Path
+
+import httpx
+
+from film2trello import trello
+from film2trello.storage import get_data_dir
+
+
+logger = logging.getLogger("film2trello.mirror")
+
+
+MIRROR_MAX_AGE = 24 * 60 * 60  # seconds
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS lists (id TEXT PRIMARY KEY, data TEXT);
+CREATE TABLE IF NOT EXISTS cards (
+    id TEXT PRIMARY KEY, id_list TEXT, pos REAL, data TEXT
+);
+CREATE INDEX IF NOT EXISTS cards_id_list ON cards (id_list, pos);
+CREATE TABLE IF NOT EXISTS labels (id TEXT PRIMARY KEY, name TEXT);
+CREATE TABLE IF NOT EXISTS members (id TEXT PRIMARY KEY, username TEXT);
+CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+# what changes with these gets re-read from Trello, because the payloads
+# don't tell e.g. which attachment previews the card now has
+CARD_ACTIONS = frozenset(
+    {
+        "createCard",
+        "copyCard",
+        "moveCardToBoard",
+        "convertToCardFromCheckItem",
+        "emailCard",
+        "addAttachmentToCard",
+        "deleteAttachmentFromCard",
+        "addLabelToCard",
+        "removeLabelFromCard",
+        "addMemberToCard",
+        "removeMemberFromCard",
+        "updateCustomFieldItem",
+    }
+)
+
+DELETED_CARD_ACTIONS = frozenset({"deleteCard", "moveCardFromBoard"})
+
+LIST_ACTIONS = frozenset(
+    {"createList", "updateList", "moveListToBoard", "moveListFromBoard"}
+)
+
+LABEL_ACTIONS = frozenset({"createLabel", "updateLabel", "deleteLabel"})
+
+MEMBER_ACTIONS = frozenset(
+    {
+        "addMemberToBoard",
+        "removeMemberFromBoard",
+        "makeNormalMemberOfBoard",
+        "makeAdminOfBoard",
+        "makeObserverOfBoard",
+    }
+)
+
+CUSTOM_FIELD_ACTIONS = frozenset(
+    {"createCustomField", "updateCustomField", "deleteCustomField"}
+)
+
+
+class BoardMirror:
+    """Local copy of what film2trello reads from a Trello board: its lists,
+    cards of the inbox and the archive, labels and members. Kept current by
+    Trello webhook actions passed to apply(). Reads sync the whole board
+    again if the mirror has gone stale, e.g. because an action couldn't be
+    applied or because there's been no full sync for too long, in case some
+    webhook deliveries got lost."""
+
+    def __init__(
+        self,
+        path: Path,
+        board_id: str,
+        trello_api: httpx.AsyncClient,
+        max_age: float = MIRROR_MAX_AGE,
+    ) -> None:
+        self.board_id = board_id
+        self.trello_api = trello_api
+        self.max_age = max_age
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+        self.lock = asyncio.Lock()
+
+    def close(self) -> None:
+        self.db.close()
+
+    def get_state(self, key: str) -> str | None:
+        row = self.db.execute(
+            "SELECT value FROM state WHERE key = ?", (key,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def set_state(self, key: str, value: str | None) -> None:
+        with self.db:
+            if value is None:
+                self.db.execute("DELETE FROM state WHERE key = ?", (key,))
+            else:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)",
+                    (key, value),
+                )
+
+    def is_stale(self) -> bool:
+        synced_at = self.get_state("synced_at")
+        return (
+            synced_at is None
+            or self.get_state("stale") is not None
+            or time.time() - float(synced_at) > self.max_age
+        )
+
+    def mark_stale(self, reason: str) -> None:
+        logger.warning(f"Mirror of board {self.board_id} is stale: {reason}")
+        self.set_state("stale", reason)
+
+    async def ensure_synced(self) -> None:
+        async with self.lock:
+            if self.is_stale():
+                await self.sync()
+
+    async def sync(self) -> None:
+        logger.info(f"Syncing mirror of board {self.board_id}")
+        lists = (await self.trello_api.get(f"/boards/{self.board_id}/lists")).json()
+        lists_ids = [trello.get_inbox_id(lists), trello.get_archive_id(lists)]
+        cards = [
+            card
+            for list_id in lists_ids
+            async for card in trello.iter_cards(self.trello_api, list_id)
+        ]
+        labels = await self.fetch_labels()
+        members = await trello.get_board_members(
+            self.trello_api, self.board_id, refresh=True
+        )
+        with self.db:
+            self.db.execute("DELETE FROM lists")
+            self.db.execute("DELETE FROM cards")
+            self.db.execute("DELETE FROM labels")
+            self.db.execute("DELETE FROM members")
+            self.db.execute("DELETE FROM state WHERE key = 'metadata_field_id'")
+            self.store_lists(lists)
+            self.db.executemany(
+                "INSERT INTO cards (id, id_list, pos, data) VALUES (?, ?, ?, ?)",
+                [get_card_row(card) for card in cards],
+            )
+            self.store_labels(labels)
+            self.store_members(members)
+        self.set_state("synced_at", str(time.time()))
+        self.set_state("stale", None)
+        logger.info(f"Mirror of board {self.board_id} has {len(cards)} cards")
+
+    def store_lists(self, lists: list[dict]) -> None:
+        self.db.executemany(
+            # in the order Trello gives them, i.e. by their position
+            "INSERT INTO lists (id, data) VALUES (?, ?)",
+            [(lst["id"], json.dumps(lst)) for lst in lists],
+        )
+
+    def store_labels(self, labels: list[dict]) -> None:
+        self.db.executemany(
+            "INSERT INTO labels (id, name) VALUES (?, ?)",
+            [(label["id"], label["name"]) for label in labels],
+        )
+
+    def store_members(self, members: list[dict]) -> None:
+        self.db.executemany(
+            "INSERT INTO members (id, username) VALUES (?, ?)",
+            [(member["id"], member["username"]) for member in members],
+        )
+
+    async def fetch_labels(self) -> list[dict]:
+        return (
+            await self.trello_api.get(
+                f"/boards/{self.board_id}/labels",
+                params={"fields": "name,color", "limit": 1000},
+            )
+        ).json()
+
+    async def apply(self, payload: dict) -> None:
+        action = payload["action"]
+        async with self.lock:
+            if self.is_stale():
+                # the sync reads the board as it is now, incl. this action
+                await self.sync()
+                return
+            try:
+                await self.apply_action(action)
+            except Exception as exc:
+                logger.exception(f"Unable to apply {action['type']} to the mirror")
+                self.mark_stale(f"Unable to apply {action['type']}: {exc}")
+
+    async def apply_action(self, action: dict) -> None:
+        action_type = action["type"]
+        data = action.get("data", {})
+        logger.debug(f"Applying {action_type} to the mirror")
+        if action_type == "updateCard":
+            await self.update_card(data["card"])
+        elif action_type in CARD_ACTIONS:
+            await self.refresh_card(data["card"]["id"])
+        elif action_type in DELETED_CARD_ACTIONS:
+            self.delete_card(data["card"]["id"])
+        elif action_type in LIST_ACTIONS:
+            # which lists are the inbox and the archive might have changed
+            await self.sync()
+        elif action_type in LABEL_ACTIONS:
+            labels = await self.fetch_labels()
+            with self.db:
+                self.db.execute("DELETE FROM labels")
+                self.store_labels(labels)
+        elif action_type in MEMBER_ACTIONS:
+            members = await trello.get_board_members(
+                self.trello_api, self.board_id, refresh=True
+            )
+            with self.db:
+                self.db.execute("DELETE FROM members")
+                self.store_members(members)
+        elif action_type in CUSTOM_FIELD_ACTIONS:
+            self.set_state("metadata_field_id", None)
+        else:
+            logger.debug(f"Ignoring {action_type}, it doesn't change the mirror")
+
+    async def update_card(self, card_data: dict) -> None:
+        if card_data.get("closed"):
+            self.delete_card(card_data["id"])
+        elif card := self.get_card(card_data["id"]):
+            self.store_card(
+                card
+                | {
+                    key: value
+                    for key, value in card_data.items()
+                    if key in trello.CARD_FIELDS
+                }
+            )
+        else:
+            # e.g. moved to the inbox from another list
+            await self.refresh_card(card_data["id"])
+
+    async def refresh_card(self, card_id: str) -> None:
+        params = trello.get_cards_params()
+        params["fields"] += ",closed"
+        card = (await self.trello_api.get(f"/cards/{card_id}", params=params)).json()
+        if card.pop("closed", False):
+            self.delete_card(card_id)
+        else:
+            self.store_card(card)
+
+    def store_card(self, card: dict) -> None:
+        with self.db:
+            if card["idList"] in self.get_lists_ids():
+                self.db.execute(
+                    "INSERT OR REPLACE INTO cards (id, id_list, pos, data) "
+                    "VALUES (?, ?, ?, ?)",
+                    get_card_row(card),
+                )
+            else:
+                self.db.execute("DELETE FROM cards WHERE id = ?", (card["id"],))
+
+    def delete_card(self, card_id: str) -> None:
+        with self.db:
+            self.db.execute("DELETE FROM cards WHERE id = ?", (card_id,))
+
+    def get_card(self, card_id: str) -> dict | None:
+        row = self.db.execute(
+            "SELECT data FROM cards WHERE id = ?", (card_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_lists_ids(self) -> list[str]:
+        lists_ids = [
+            row[0] for row in self.db.execute("SELECT id FROM lists ORDER BY rowid")
+        ]
+        return [lists_ids[0], lists_ids[-1]] if lists_ids else []
+
+    async def check_username(self, username: str) -> str:
+        await self.ensure_synced()
+        row = self.db.execute(
+            "SELECT id FROM members WHERE username = ?", (username,)
+        ).fetchone()
+        if not row:
+            raise ValueError(f"User '{username}' is not allowed to the board")
+        return row[0]
+
+    async def get_working_lists_ids(self) -> list[str]:
+        await self.ensure_synced()
+        return self.get_lists_ids()
+
+    async def get_cards(self, lists_ids: list[str]) -> list[dict]:
+        await self.ensure_synced()
+        return [card for list_id in lists_ids for card in self.query_cards(list_id)]
+
+    async def iter_cards(self, list_id: str) -> AsyncGenerator[dict]:
+        await self.ensure_synced()
+        # all at once, as the cards get updated by webhooks while iterating
+        for card in self.query_cards(list_id):
+            yield card
+
+    async def get_old_cards(self, list_id: str, before: date) -> list[dict]:
+        await self.ensure_synced()
+        return [
+            card
+            for card in self.query_cards(list_id)
+            if trello.get_card_created_at(card["id"]).date() < before
+        ]
+
+    def query_cards(self, list_id: str) -> list[dict]:
+        rows = self.db.execute(
+            "SELECT data FROM cards WHERE id_list = ? ORDER BY pos", (list_id,)
+        )
+        return [json.loads(row[0]) for row in rows]
+
+    async def get_board_labels(self) -> dict[str, str]:
+        await self.ensure_synced()
+        label_ids = {
+            name: label_id
+            for label_id, name in self.db.execute("SELECT id, name FROM labels")
+        }
+        if any(label["name"] not in label_ids for label in trello.MANAGED_LABELS):
+            # creates the missing labels, webhook then brings them here
+            return await trello.get_board_labels(self.trello_api, self.board_id)
+        return label_ids
+
+    async def get_metadata_field_id(self) -> str:
+        await self.ensure_synced()
+        if field_id := self.get_state("metadata_field_id"):
+            return field_id
+        field_id = await trello.get_metadata_field_id(self.trello_api, self.board_id)
+        self.set_state("metadata_field_id", field_id)
+        return field_id
+
+
+def get_mirror_path(board_id: str) -> Path:
+    return get_data_dir() / f"board-{board_id}.sqlite"
+
+
+def get_card_row(card: dict) -> tuple[str, str, float, str]:
+    return (card["id"], card["idList"], card["pos"], json.dumps(card))
@@ -0,0 +1,125 @@
+import asyncio
+import cProfile
+import itertools
+import json
+import logging
+import os
+import time
+from collections.abc import Coroutine, Generator
+from pathlib import Path
+from typing import Any
+
+
+logger = logging.getLogger("film2trello.profiling")
+
+
+class Tracer:
+    """Timeline of asyncio tasks in the Chrome trace event format, which can
+    be opened in Perfetto or chrome://tracing. Every task gets its own row.
+    Each slice in the row is a step of the task, i.e. the time between two
+    awaits, and the gaps between slices are the time spent waiting."""
+
+    def __init__(self) -> None:
+        self.events: list[dict] = []
+        self.started_at = time.perf_counter()
+        self.task_ids = itertools.count(1)
+
+    def get_loop(self) -> asyncio.AbstractEventLoop:
+        loop = asyncio.new_event_loop()
+        loop.set_task_factory(self.create_task)
+        return loop
+
+    def create_task(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        coro: Coroutine,
+        **kwargs: Any,
+    ) -> asyncio.Task:
+        task_id = next(self.task_ids)
+        task = asyncio.Task(TracedCoroutine(coro, self, task_id), loop=loop, **kwargs)
+        self.events.append(
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": os.getpid(),
+                "tid": task_id,
+                "args": {"name": f"{task.get_name()} {get_name(coro)}"},
+            }
+        )
+        return task
+
+    def now(self) -> float:
+        return (time.perf_counter() - self.started_at) * 1_000_000
+
+    def record(self, name: str, category: str, task_id: int, started_at: float) -> None:
+        self.events.append(
+            {
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": started_at,
+                "dur": self.now() - started_at,
+                "pid": os.getpid(),
+                "tid": task_id,
+            }
+        )
+
+    def save(self, path: Path) -> None:
+        path.write_text(json.dumps({"traceEvents": self.events}))
+
+
+class TracedCoroutine(Coroutine):
+    def __init__(self, coro: Coroutine, tracer: Tracer, task_id: int) -> None:
+        self.coro = coro
+        self.tracer = tracer
+        self.task_id = task_id
+        self.name = get_name(coro)
+        self.created_at = tracer.now()
+
+    def send(self, value: Any) -> Any:
+        return self.step(self.coro.send, value)
+
+    def throw(self, *args: Any) -> Any:
+        return self.step(self.coro.throw, *args)
+
+    def close(self) -> None:
+        self.coro.close()
+
+    def __await__(self) -> Generator[Any, None, Any]:
+        return self.coro.__await__()
+
+    def step(self, method, *args: Any) -> Any:
+        started_at = self.tracer.now()
+        try:
+            return method(*args)
+        except BaseException:
+            # StopIteration included, the task is over
+            self.tracer.record(self.name, "task", self.task_id, self.created_at)
+            raise
+        finally:
+            self.tracer.record(self.name, "step", self.task_id, started_at)
+
+
+def get_name(coro: Coroutine) -> str:
+    return getattr(coro, "__qualname__", type(coro).__name__)
+
+
+class Profiling:
+    """CPU profile (pstats) and asyncio timeline (Chrome trace) of a run"""
+
+    def __init__(self, path_prefix: Path) -> None:
+        self.path_prefix = path_prefix
+        self.profiler = cProfile.Profile()
+        self.tracer = Tracer()
+
+    def start(self) -> None:
+        self.profiler.enable()
+
+    def stop(self) -> None:
+        self.profiler.disable()
+        pstats_path = self.path_prefix.with_name(f"{self.path_prefix.name}.pstats")
+        self.profiler.dump_stats(pstats_path)
+        trace_path = self.path_prefix.with_name(f"{self.path_prefix.name}.trace.json")
+        self.tracer.save(trace_path)
+        logger.info(f"CPU profile saved to {pstats_path}")
+        logger.info(f"Asyncio timeline saved to {trace_path}")
@@ -0,0 +1,31 @@
+import asyncio
+import logging
+import random
+from collections.abc import Awaitable, Callable
+
+
+logger = logging.getLogger("film2trello.scheduler")
+
+
+async def run_periodically(
+    job: Callable[[], Awaitable[None]],
+    interval: float,
+    jitter: float = 0,
+) -> None:
+    """Runs the job every interval ± jitter seconds, the first time after
+    up to jitter seconds. The next run waits for the previous one to finish.
+    Failures are only logged, so that one bad run doesn't stop the
+    schedule."""
+    delay = random.uniform(0, jitter)
+    while True:
+        logger.info(f"Next run of {job.__name__} in {delay / 3600:.1f}h")
+        await asyncio.sleep(delay)
+        delay = get_delay(interval, jitter)
+        try:
+            await job()
+        except Exception:
+            logger.exception(f"Scheduled {job.__name__} failed")
+
+
+def get_delay(interval: float, jitter: float) -> float:
+    return max(0, interval + random.uniform(-jitter, jitter))
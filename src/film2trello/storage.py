@@ -0,0 +1,49 @@
+import fcntl
+import json
+import os
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any
+
+
+def get_data_dir() -> Path:
+    if path := os.environ.get("FILM2TRELLO_DATA_DIR"):
+        return Path(path)
+    cache_dir = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache_dir) / "film2trello"
+
+
+def load_json(path: Path, default: Any = None) -> Any:
+    try:
+        return json.loads(path.read_text())
+    except FileNotFoundError:
+        return default
+
+
+def save_json(path: Path, data: Any) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    tmp_path.write_text(json.dumps(data, ensure_ascii=False))
+    tmp_path.replace(path)
+
+
+class LockedError(RuntimeError):
+    pass
+
+
+@contextmanager
+def lock_file(path: Path) -> Iterator[None]:
+    """Holds an exclusive lock on the file, which is shared by all processes
+    using the same data directory. Raises LockedError right away if someone
+    else holds the lock."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("w") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError as exc:
+            raise LockedError(f"Locked by another process: {path}") from exc
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
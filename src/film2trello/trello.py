@@ -1,16 +1,20 @@
 import asyncio
 import itertools
+import json
 import math
-from collections.abc import Callable, Coroutine
-from datetime import date
+import re
+import time
+from collections.abc import AsyncGenerator, Callable, Coroutine
+from datetime import UTC, date, datetime
 from functools import wraps
 from io import BytesIO
 from typing import Any, Literal
 
 import httpx
-from PIL import Image
 
-from film2trello.http import get_transport, raise_on_error
+from film2trello.cpu import run_cpu
+from film2trello.failures import SuppressedError, get_failure_cache
+from film2trello.http import get_content, get_transport, priority_var, raise_on_error
 
 
 COLORS = {
@@ -34,6 +38,30 @@ TVSHOW_LABEL = {"name": "SERIÁL", "color": "black"}
 
 AVAILABILITY_LABELS = ["KVIFF.TV", "NETFLIX", "STASH"]
 
+MANAGED_LABELS = [
+    *({"name": name, "color": color} for name, color in COLORS.items()),
+    KVIFFTV_LABEL,
+    NETFLIX_LABEL,
+    TVSHOW_LABEL,
+]
+
+CARD_FIELDS = ["name", "desc", "idList", "pos", "labels", "idLabels", "idMembers"]
+
+ATTACHMENT_FIELDS = ["name", "url", "previews"]
+
+METADATA_FIELD_NAME = "film2trello"
+
+MEMBERS_CACHE_TTL = 10 * 60  # seconds
+
+BOARD_ID_RE = re.compile(r"[0-9a-f]{24}")
+
+RATE_LIMIT = (100, 10)  # requests per seconds, Trello's limit per token
+
+
+members_cache: dict[str, tuple[float, list[dict]]] = {}
+
+board_ids_cache: dict[str, str] = {}
+
 
 def get_trello_api(key: str, token: str) -> httpx.AsyncClient:
     return httpx.AsyncClient(
@@ -42,7 +70,7 @@ def get_trello_api(key: str, token: str) -> httpx.AsyncClient:
             "Authorization": f'OAuth oauth_consumer_key="{key}", oauth_token="{token}"',
             "User-Agent": "film2trello (+https://github.com/honzajavorek/film2trello)",
         },
-        transport=get_transport(),
+        transport=get_transport(rate_limit=RATE_LIMIT),
         event_hooks={"response": [raise_on_error]},
     )
 
@@ -64,10 +92,43 @@ async def check_username(
     trello_api: httpx.AsyncClient,
     board_id: str,
     username: str,
-) -> None:
-    members = (await trello_api.get(f"/boards/{board_id}/members")).json()
-    if username not in [member["username"] for member in members]:
+) -> str:
+    members = await get_board_members(trello_api, board_id)
+    if not_in_members(username, members):
+        # maybe the user has been added to the board only recently
+        members = await get_board_members(trello_api, board_id, refresh=True)
+    if not_in_members(username, members):
         raise ValueError(f"User '{username}' is not allowed to the board")
+    return get_member_id(members, username)
+
+
+async def get_board_members(
+    trello_api: httpx.AsyncClient,
+    board_id: str,
+    refresh: bool = False,
+) -> list[dict]:
+    if not refresh and (cached := members_cache.get(board_id)):
+        cached_at, members = cached
+        if time.monotonic() - cached_at < MEMBERS_CACHE_TTL:
+            return members
+    members = (
+        await trello_api.get(
+            f"/boards/{board_id}/members", params={"fields": "username"}
+        )
+    ).json()
+    members_cache[board_id] = (time.monotonic(), members)
+    return members
+
+
+async def get_board_full_id(trello_api: httpx.AsyncClient, board_id: str) -> str:
+    """Boards are usually given by their short link, e.g. from their URL, but
+    what's being created on the board needs its full 24 characters long ID"""
+    if BOARD_ID_RE.fullmatch(board_id):
+        return board_id
+    if board_id not in board_ids_cache:
+        response = await trello_api.get(f"/boards/{board_id}", params={"fields": "id"})
+        board_ids_cache[board_id] = response.json()["id"]
+    return board_ids_cache[board_id]
 
 
 async def get_working_lists_ids(
@@ -83,13 +144,112 @@ async def get_cards(
     lists_ids: list[str],
 ) -> list[dict]:
     responses = await asyncio.gather(
-        *(trello_api.get(f"/lists/{list_id}/cards") for list_id in lists_ids)
+        *(
+            trello_api.get(f"/lists/{list_id}/cards", params=get_cards_params())
+            for list_id in lists_ids
+        )
     )
     return list(
         itertools.chain.from_iterable(response.json() for response in responses)
     )
 
 
+async def iter_cards(
+    trello_api: httpx.AsyncClient,
+    list_id: str,
+    fields: list[str] = CARD_FIELDS,
+    card_filter: Literal["open", "closed", "all"] = "open",
+) -> AsyncGenerator[dict]:
+    # Trello gives cards of a list ordered by their position, not by their
+    # IDs, so there's no cursor to page through them reliably
+    response = await trello_api.get(
+        f"/lists/{list_id}/cards",
+        params=get_cards_params(fields) | {"filter": card_filter},
+    )
+    for card in response.json():
+        yield card
+
+
+def get_cards_params(fields: list[str] = CARD_FIELDS) -> dict[str, str]:
+    return {
+        "fields": ",".join(fields),
+        "attachments": "true",
+        "attachment_fields": ",".join(ATTACHMENT_FIELDS),
+        "customFieldItems": "true",
+    }
+
+
+async def get_board_labels(
+    trello_api: httpx.AsyncClient,
+    board_id: str,
+    labels: list[dict] = MANAGED_LABELS,
+) -> dict[str, str]:
+    board_labels = (
+        await trello_api.get(
+            f"/boards/{board_id}/labels",
+            params={"fields": "name,color", "limit": 1000},
+        )
+    ).json()
+    label_ids = {label["name"]: label["id"] for label in board_labels}
+    missing_labels = [label for label in labels if label["name"] not in label_ids]
+    if not missing_labels:
+        return label_ids
+    board_full_id = await get_board_full_id(trello_api, board_id)
+    responses = await asyncio.gather(
+        *(
+            trello_api.post("/labels", json={**label, "idBoard": board_full_id})
+            for label in missing_labels
+        )
+    )
+    for response in responses:
+        label = response.json()
+        label_ids[label["name"]] = label["id"]
+    return label_ids
+
+
+async def get_metadata_field_id(
+    trello_api: httpx.AsyncClient,
+    board_id: str,
+) -> str:
+    if field_id := await find_metadata_field_id(trello_api, board_id):
+        return field_id
+    response = await trello_api.post(
+        "/customFields",
+        json={
+            "idModel": await get_board_full_id(trello_api, board_id),
+            "modelType": "board",
+            "name": METADATA_FIELD_NAME,
+            "type": "text",
+            "pos": "bottom",
+            "display_cardFront": False,
+        },
+    )
+    return response.json()["id"]
+
+
+async def find_metadata_field_id(
+    trello_api: httpx.AsyncClient,
+    board_id: str,
+) -> str | None:
+    fields = (await trello_api.get(f"/boards/{board_id}/customFields")).json()
+    for field in fields:
+        if field["name"] == METADATA_FIELD_NAME:
+            return field["id"]
+    return None
+
+
+async def update_card_metadata(
+    trello_api: httpx.AsyncClient,
+    card_id: str,
+    field_id: str,
+    metadata: dict,
+) -> None:
+    await trello_api.put(
+        f"/cards/{card_id}/customField/{field_id}/item",
+        json={"value": {"text": json.dumps(metadata, separators=(",", ":"))}},
+    )
+
+
 async def update_card(
     trello_api: httpx.AsyncClient,
     card_id: str,
@@ -106,36 +266,23 @@ async def create_card(
     return response.json()["id"]
 
 
-async def join_card(
+async def delete_card(
     trello_api: httpx.AsyncClient,
     card_id: str,
-    username: str,
 ) -> None:
-    card_members = (await trello_api.get(f"/cards/{card_id}/members")).json()
-    if not_in_members(username, card_members):
-        user_id = (await trello_api.get(f"/members/{username}")).json()["id"]
-        await trello_api.post(
-            f"/cards/{card_id}/members",
-            json={"value": user_id},
-        )
+    await trello_api.delete(f"/cards/{card_id}")
 
 
-async def update_card_labels(
+async def join_card(
     trello_api: httpx.AsyncClient,
-    card_id: str,
-    labels: list[dict],
+    card: dict,
+    member_id: str,
 ) -> None:
-    card_labels = (await trello_api.get(f"/cards/{card_id}/labels")).json()
-    labels = get_missing_labels(card_labels, labels)
-
-    async def update_label(label: dict) -> None:
-        try:
-            await trello_api.post(f"/cards/{card_id}/labels", params=label)
-        except httpx.HTTPStatusError as e:
-            if "label is already on the card" not in e.response.text:
-                raise
-
-    await asyncio.gather(*(update_label(label) for label in labels))
+    if member_id not in card["idMembers"]:
+        await trello_api.post(
+            f"/cards/{card['id']}/members",
+            json={"value": member_id},
+        )
 
 
 async def update_card_attachments(
@@ -144,8 +291,10 @@ async def update_card_attachments(
     card_id: str,
     page_urls: list[str],
     poster_url: str | None = None,
+    attachments: list[dict] | None = None,
 ) -> list[str]:
-    attachments = (await trello_api.get(f"/cards/{card_id}/attachments")).json()
+    if attachments is None:
+        attachments = (await trello_api.get(f"/cards/{card_id}/attachments")).json()
     page_urls = get_missing_attached_urls(attachments, page_urls)
 
     await asyncio.gather(
@@ -155,13 +304,29 @@ async def update_card_attachments(
         )
     )
     if not has_poster(attachments) and poster_url:
+        failure_cache = get_failure_cache()
+        try:
+            if priority_var.get() == "background":
+                failure_cache.check("poster", poster_url)
+            poster = await get_content(scraper, poster_url)
+            thumbnail = await run_cpu(create_thumbnail, poster)
+        except SuppressedError:
+            return []
+        except httpx.HTTPStatusError as exc:
+            if exc.response.is_client_error:
+                failure_cache.record_failure("poster", poster_url, "http", str(exc))
+            return [f"Unable to update poster: {exc}"]
+        except (ValueError, OSError) as exc:
+            # Pillow raises OSError for images it can't identify
+            failure_cache.record_failure("poster", poster_url, "decode", str(exc))
+            return [f"Unable to update poster: {exc}"]
+        failure_cache.record_success("poster", poster_url)
         try:
-            response = await scraper.get(poster_url)
             await trello_api.post(
-                f"/cards/{card_id}/attachments",
-                files={"file": create_thumbnail(response.content)},
+                f"/cards/{card_id}/attachments", files={"file": thumbnail}
             )
-        except (httpx.HTTPStatusError, ValueError) as exc:
+        except httpx.HTTPStatusError as exc:
+            # Trello's fault, not the poster's
             return [f"Unable to update poster: {exc}"]
     return []
 
@@ -203,14 +368,24 @@ def get_card_url(card_id: str) -> str:
     return f"https://trello.com/c/{card_id}"
 
 
+def get_card_created_at(card_id: str) -> datetime:
+    # IDs of Trello cards start with the time they were created
+    return datetime.fromtimestamp(int(card_id[:8], 16), UTC)
+
+
 def get_board_url(board_id: str) -> str:
     return f"https://trello.com/b/{board_id}"
 
 
-def find_card_id(cards: list[dict], title: str, url: str) -> str | None:
+def find_card(cards: list[dict], title: str, url: str) -> dict | None:
     for card in cards:
         if title in card["name"] or url in card["desc"]:
-            return card["id"]
+            return card
+
+
+def find_card_id(cards: list[dict], title: str, url: str) -> str | None:
+    if card := find_card(cards, title, url):
+        return card["id"]
 
 
 def get_inbox_id(lists: list[dict]) -> str:
@@ -225,6 +400,13 @@ def not_in_members(username, members) -> bool:
     return username not in [member["username"] for member in members]
 
 
+def get_member_id(members: list[dict], username: str) -> str:
+    for member in members:
+        if member["username"] == username:
+            return member["id"]
+    raise ValueError(f"User '{username}' is not a member")
+
+
 def prepare_card_data(
     name: str,
     csfd_url: str,
@@ -239,6 +421,24 @@ def prepare_card_data(
     return data
 
 
+def get_card_metadata(card: dict, field_id: str) -> dict | None:
+    for item in card.get("customFieldItems") or []:
+        if item["idCustomField"] == field_id:
+            try:
+                return json.loads(item["value"]["text"])
+            except ValueError:
+                return None
+    return None
+
+
+def get_card_changes(card: dict, card_data: dict) -> dict:
+    return {
+        key: value
+        for key, value in card_data.items()
+        if key not in card or card[key] != value
+    }
+
+
 def prepare_duration_labels(durations: list[int]) -> list[dict[str, str]]:
     labels = []
     seen = set()
@@ -271,9 +471,25 @@ def get_duration_bracket(duration: int) -> str:
         return "3+h"
 
 
-def get_missing_labels(existing_labels: list[dict], labels: list[dict]) -> list[dict]:
-    names = {label["name"] for label in existing_labels}
-    return [label for label in labels if label["name"] not in names]
+def get_card_label_ids(
+    card: dict,
+    labels: list[dict],
+    label_ids: dict[str, str],
+) -> list[str]:
+    managed_names = {label["name"] for label in MANAGED_LABELS}
+    names = {label["name"] for label in labels}
+    card_label_names = {label["id"]: label["name"] for label in card["labels"]}
+    # labels not managed by film2trello, e.g. STASH, are left alone
+    card_label_ids = [
+        label_id
+        for label_id in card["idLabels"]
+        if card_label_names.get(label_id) in names
+        or card_label_names.get(label_id) not in managed_names
+    ]
+    for label in labels:
+        if label_ids[label["name"]] not in card_label_ids:
+            card_label_ids.append(label_ids[label["name"]])
+    return card_label_ids
 
 
 def get_missing_attached_urls(
@@ -297,6 +513,8 @@ def has_poster(attachments) -> bool:
 def create_thumbnail(
     image_bytes: bytes,
 ) -> tuple[Literal["poster.jpg"], BytesIO, Literal["image/jpeg"]]:
+    from PIL import Image
+
     with Image.open(BytesIO(image_bytes)) as image:
         image = image.convert("RGB")
         image.thumbnail(THUMBNAIL_SIZE)
@@ -304,3 +522,22 @@ def create_thumbnail(
         image.save(out_file, "JPEG")
         out_file.seek(0)
         return ("poster.jpg", out_file, "image/jpeg")
+
+
+async def register_webhook(
+    trello_api: httpx.AsyncClient,
+    board_id: str,
+    callback_url: str,
+) -> None:
+    try:
+        await trello_api.post(
+            "/webhooks",
+            json={
+                "callbackURL": callback_url,
+                "idModel": await get_board_full_id(trello_api, board_id),
+                "description": "film2trello",
+            },
+        )
+    except httpx.HTTPStatusError as exc:
+        if "already exists" not in exc.response.text:
+            raise
@@ -0,0 +1,98 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import logging
+
+from film2trello.mirror import BoardMirror
+
+
+logger = logging.getLogger("film2trello.webhook")
+
+
+MAX_BODY_SIZE = 1024 * 1024
+
+STATUS_TEXTS = {
+    200: "OK",
+    400: "Bad Request",
+    401: "Unauthorized",
+    405: "Method Not Allowed",
+    413: "Content Too Large",
+}
+
+
+async def serve_webhook(
+    mirror: BoardMirror,
+    host: str,
+    port: int,
+    callback_url: str,
+    secret: str,
+) -> asyncio.Server:
+    """Receives Trello webhook actions and applies them to the mirror. Trello
+    checks the callback URL with a HEAD request when the webhook is being
+    registered, then POSTs actions to it. Actions not signed with the secret
+    of the Trello key are refused, as the mirror trusts whatever they say."""
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        payload = None
+        try:
+            status, payload = await read_action(reader, callback_url, secret)
+        except (ValueError, asyncio.IncompleteReadError) as exc:
+            logger.warning(f"Invalid webhook request: {exc}")
+            status = 400
+        writer.write(
+            f"HTTP/1.1 {status} {STATUS_TEXTS[status]}\r\n"
+            "Content-Length: 0\r\n"
+            "Connection: close\r\n\r\n".encode()
+        )
+        await writer.drain()
+        writer.close()
+        await writer.wait_closed()
+        if payload:
+            try:
+                await mirror.apply(payload)
+            except Exception:
+                logger.exception("Unable to apply the webhook action")
+
+    server = await asyncio.start_server(handle, host, port)
+    logger.info(f"Receiving Trello webhooks on {host}:{port}")
+    return server
+
+
+async def read_action(
+    reader: asyncio.StreamReader,
+    callback_url: str,
+    secret: str,
+) -> tuple[int, dict | None]:
+    request_line = (await reader.readline()).decode("latin-1")
+    method = request_line.split(" ", 1)[0]
+    headers = {}
+    while (line := (await reader.readline()).decode("latin-1").strip()) != "":
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    if method in ("HEAD", "GET"):
+        return 200, None
+    if method != "POST":
+        return 405, None
+    content_length = int(headers.get("content-length", 0))
+    if content_length > MAX_BODY_SIZE:
+        return 413, None
+    body = await reader.readexactly(content_length)
+    if not hmac.compare_digest(
+        headers.get("x-trello-webhook", ""),
+        get_signature(secret, body, callback_url),
+    ):
+        return 401, None
+    payload = json.loads(body)
+    if "action" not in payload:
+        raise ValueError("No action in the payload")
+    return 200, payload
+
+
+def get_signature(secret: str, body: bytes, callback_url: str) -> str:
+    digest = hmac.new(
+        secret.encode(), body + callback_url.encode(), hashlib.sha1
+    ).digest()
+    return base64.b64encode(digest).decode()
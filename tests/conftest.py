@@ -0,0 +1,25 @@
+import pytest
+
+from film2trello import trello
+from film2trello.failures import get_failure_cache
+
+
+@pytest.fixture(autouse=True)
+def data_dir(tmp_path, monkeypatch):
+    path = tmp_path / "data"
+    monkeypatch.setenv("FILM2TRELLO_DATA_DIR", str(path))
+    return path
+
+
+@pytest.fixture(autouse=True)
+def failure_cache(data_dir):
+    get_failure_cache.cache_clear()
+    yield get_failure_cache()
+    get_failure_cache.cache_clear()
+
+
+@pytest.fixture(autouse=True)
+def board_ids_cache():
+    trello.board_ids_cache.clear()
+    yield trello.board_ids_cache
+    trello.board_ids_cache.clear()
@@ -0,0 +1,97 @@
+import gzip
+import time
+
+import httpx
+import pytest
+
+from film2trello.cassette import Cassette, CassetteError, CassetteTransport
+
+
+def handler(request: httpx.Request) -> httpx.Response:
+    if request.url.path == "/slow":
+        time.sleep(0.2)
+    return httpx.Response(
+        200,
+        headers={"Content-Encoding": "gzip"},
+        content=gzip.compress(f"{request.method} {request.url.path}".encode()),
+    )
+
+
+async def record(path, requests) -> list[str]:
+    cassette = Cassette(path, "record")
+    transport = CassetteTransport(httpx.MockTransport(handler), cassette)
+    async with httpx.AsyncClient(transport=transport) as client:
+        texts = [(await client.request(*request)).text for request in requests]
+    cassette.close()
+    return texts
+
+
+@pytest.mark.asyncio
+async def test_cassette_replays_recorded_traffic(tmp_path):
+    path = tmp_path / "cassette.jsonl.gz"
+    requests = [
+        ("GET", "https://www.csfd.cz/film/8283/"),
+        ("POST", "https://trello.com/1/cards"),
+        ("GET", "https://www.csfd.cz/film/8283/"),
+    ]
+    recorded_texts = await record(path, requests)
+
+    def offline(request: httpx.Request) -> httpx.Response:
+        raise AssertionError("Network used during replay")
+
+    cassette = Cassette(path, "replay")
+    transport = CassetteTransport(httpx.MockTransport(offline), cassette)
+    async with httpx.AsyncClient(transport=transport) as client:
+        replayed_texts = [(await client.request(*request)).text for request in requests]
+
+    assert (
+        recorded_texts
+        == replayed_texts
+        == [
+            "GET /film/8283/",
+            "POST /1/cards",
+            "GET /film/8283/",
+        ]
+    )
+
+
+@pytest.mark.asyncio
+async def test_cassette_does_not_record_request_headers(tmp_path):
+    path = tmp_path / "cassette.jsonl.gz"
+    cassette = Cassette(path, "record")
+    transport = CassetteTransport(httpx.MockTransport(handler), cassette)
+    async with httpx.AsyncClient(
+        transport=transport, headers={"Authorization": "OAuth s3cr3t"}
+    ) as client:
+        await client.get("https://trello.com/1/boards/123/lists")
+    cassette.close()
+
+    assert b"s3cr3t" not in gzip.decompress(path.read_bytes())
+
+
+@pytest.mark.asyncio
+async def test_cassette_raises_on_unrecorded_request(tmp_path):
+    path = tmp_path / "cassette.jsonl.gz"
+    await record(path, [("GET", "https://www.csfd.cz/film/8283/")])
+
+    cassette = Cassette(path, "replay")
+    transport = CassetteTransport(httpx.MockTransport(handler), cassette)
+    async with httpx.AsyncClient(transport=transport) as client:
+        with pytest.raises(CassetteError):
+            await client.get("https://www.csfd.cz/film/1/")
+
+
+@pytest.mark.parametrize("latency, min_duration", [("original", 0.2), ("zero", 0)])
+@pytest.mark.asyncio
+async def test_cassette_replay_latency(tmp_path, latency, min_duration):
+    path = tmp_path / "cassette.jsonl.gz"
+    await record(path, [("GET", "https://example.com/slow")])
+
+    cassette = Cassette(path, "replay", latency=latency)
+    transport = CassetteTransport(httpx.MockTransport(handler), cassette)
+    async with httpx.AsyncClient(transport=transport) as client:
+        started_at = time.monotonic()
+        await client.get("https://example.com/slow")
+        duration = time.monotonic() - started_at
+
+    assert min_duration <= duration < min_duration + 0.15
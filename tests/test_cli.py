@@ -0,0 +1,81 @@
+import subprocess
+import sys
+
+import pytest
+from click.testing import CliRunner
+
+from film2trello.cli import main
+
+
+def measure_import(code: str) -> tuple[float, set[str]]:
+    """Runs the code in a fresh interpreter and returns the cumulative time
+    of its imports in milliseconds, together with the imported modules."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    total_us = 0
+    modules = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line.removeprefix("import time:").split("|")
+        modules.add(name.strip())
+        if not name.startswith("  "):  # nested imports are indented
+            total_us += int(cumulative)
+    return total_us / 1000, modules
+
+
+@pytest.mark.parametrize(
+    "command, code, budget_ms, forbidden_modules",
+    [
+        (
+            "--help",
+            "from film2trello.cli import main",
+            500,
+            {"telegram", "PIL", "httpx", "lxml"},
+        ),
+        (
+            "inbox",
+            "import film2trello.cli, film2trello.core",
+            1500,
+            {"telegram", "PIL"},
+        ),
+        (
+            "kviff-index",
+            "import film2trello.cli, film2trello.kvifftv",
+            1500,
+            {"telegram", "PIL"},
+        ),
+        (
+            "bot",
+            "import film2trello.cli, film2trello.bot",
+            2500,
+            {"PIL"},
+        ),
+    ],
+)
+def test_command_import_time(command, code, budget_ms, forbidden_modules):
+    import_time_ms, modules = measure_import(code)
+
+    assert not (forbidden_modules & modules), f"{command} imports too much"
+    assert import_time_ms < budget_ms, f"{command} imports in {import_time_ms:.0f}ms"
+
+
+def test_bot_webhook_url_requires_trello_secret(monkeypatch):
+    monkeypatch.delenv("TRELLO_SECRET", raising=False)
+    result = CliRunner().invoke(
+        main,
+        [
+            "bot",
+            "--telegram-token=telegram",
+            "--trello-key=key",
+            "--trello-token=token",
+            "--webhook-url=https://example.com/trello",
+        ],
+    )
+
+    assert result.exit_code == 2
+    assert "--webhook-url requires --trello-secret" in result.output
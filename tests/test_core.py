@@ -0,0 +1,973 @@
+import asyncio
+import io
+import json
+import threading
+import time
+from pathlib import Path
+
+import httpx
+import pytest
+
+from film2trello import core, kvifftv, trello
+from film2trello.journal import Journal, get_journal_path, get_lock_path
+from film2trello.mirror import BoardMirror, get_mirror_path
+from film2trello.storage import LockedError, lock_file
+
+
+@pytest.fixture()
+def film() -> core.Film:
+    return core.Film(
+        title="Poslední skaut / The Last Boy Scout (1991)",
+        csfd_url="https://www.csfd.cz/film/8283-posledni-skaut/prehled/",
+        poster_url="https://image.pmgstatic.com/poster.jpg",
+        kvifftv_url=None,
+        netflix_url=None,
+        durations=[105],
+        is_tvshow=False,
+    )
+
+
+@pytest.fixture()
+def label_ids() -> dict[str, str]:
+    return {label["name"]: f"id-{label['name']}" for label in trello.MANAGED_LABELS}
+
+
+@pytest.mark.asyncio
+async def test_update_inbox_card_steady_state_sends_no_requests(film, label_ids):
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(200, json={})
+
+    card = {
+        "id": "1",
+        "name": film["title"],
+        "desc": film["csfd_url"],
+        "labels": [{"id": "id-2h", "name": "2h", "color": "orange"}],
+        "idLabels": ["id-2h"],
+        "attachments": [
+            {"name": film["csfd_url"], "url": film["csfd_url"], "previews": []},
+            {"name": "poster.jpg", "url": "...", "previews": [{}]},
+        ],
+    }
+    transport = httpx.MockTransport(handler)
+    async with httpx.AsyncClient(
+        base_url="https://trello.com/1/", transport=transport
+    ) as client:
+        errors = await core.update_inbox_card(
+            client, client, card, film["csfd_url"], film, label_ids
+        )
+
+    assert errors == []
+    assert requests == []
+
+
+@pytest.mark.asyncio
+async def test_update_inbox_card_sends_only_changes(film, label_ids):
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(200, json={})
+
+    card = {
+        "id": "1",
+        "name": "Posledni skaut",
+        "desc": film["csfd_url"],
+        "labels": [
+            {"id": "id-3+h", "name": "3+h", "color": "purple"},
+            {"id": "id-STASH", "name": "STASH", "color": "green"},
+        ],
+        "idLabels": ["id-3+h", "id-STASH"],
+        "attachments": [
+            {"name": film["csfd_url"], "url": film["csfd_url"], "previews": []},
+            {"name": "poster.jpg", "url": "...", "previews": [{}]},
+        ],
+    }
+    transport = httpx.MockTransport(handler)
+    async with httpx.AsyncClient(
+        base_url="https://trello.com/1/", transport=transport
+    ) as client:
+        await core.update_inbox_card(
+            client, client, card, film["csfd_url"], film, label_ids
+        )
+
+    assert [(request.method, request.url.path) for request in requests] == [
+        ("PUT", "/1/cards/1/"),
+    ]
+    assert json.loads(requests[0].content) == {
+        "name": film["title"],
+        "idLabels": ["id-STASH", "id-2h"],
+    }
+
+
+def get_metadata_item(film: core.Film) -> dict:
+    metadata = core.get_film_metadata(film) | {"scraped_at": "2020-04-06T11:20:15"}
+    return {"idCustomField": "field", "value": {"text": json.dumps(metadata)}}
+
+
+@pytest.mark.asyncio
+async def test_update_inbox_card_writes_metadata(film, label_ids):
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(200, json={})
+
+    card = {
+        "id": "1",
+        "name": film["title"],
+        "desc": film["csfd_url"],
+        "labels": [{"id": "id-2h", "name": "2h", "color": "orange"}],
+        "idLabels": ["id-2h"],
+        "attachments": [
+            {"name": film["csfd_url"], "url": film["csfd_url"], "previews": []},
+            {"name": "poster.jpg", "url": "...", "previews": [{}]},
+        ],
+        "customFieldItems": [],
+    }
+    transport = httpx.MockTransport(handler)
+    async with httpx.AsyncClient(
+        base_url="https://trello.com/1/", transport=transport
+    ) as client:
+        await core.update_inbox_card(
+            client, client, card, film["csfd_url"], film, label_ids, "field"
+        )
+        card["customFieldItems"] = [get_metadata_item(film)]
+        await core.update_inbox_card(
+            client, client, card, film["csfd_url"], film, label_ids, "field"
+        )
+
+    assert [(request.method, request.url.path) for request in requests] == [
+        ("PUT", "/1/cards/1/customField/field/item"),
+    ]
+    metadata = json.loads(json.loads(requests[0].content)["value"]["text"])
+    assert metadata["csfd_id"] == 8283
+    assert metadata["durations"] == [105]
+
+
+@pytest.mark.asyncio
+async def test_get_csfd_url_kvifftv_scrapes_and_indexes(tmp_path):
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(
+            200, content=(Path(__file__).parent / "kvifftv.html").read_bytes()
+        )
+
+    index = kvifftv.KviffTvIndex(tmp_path / "kvifftv.json")
+    message_text = "https://kviff.tv/katalog/smolny-pich-aneb-pitomy-porno"
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        csfd_url = await core.get_csfd_url(client, message_text, index)
+        csfd_url_indexed = await core.get_csfd_url(client, message_text, index)
+
+    assert csfd_url == csfd_url_indexed == "https://www.csfd.cz/film/988751"
+    assert len(requests) == 1
+    assert (
+        kvifftv.KviffTvIndex(tmp_path / "kvifftv.json").get(
+            "smolny-pich-aneb-pitomy-porno"
+        )
+        == "https://www.csfd.cz/film/988751"
+    )
+
+
+@pytest.mark.asyncio
+async def test_get_csfd_url_kvifftv_remembers_missing_link(tmp_path):
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(200, text="<html></html>")
+
+    index = kvifftv.KviffTvIndex(tmp_path / "kvifftv.json")
+    message_text = "https://kviff.tv/katalog/bod-varu"
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        for _ in range(2):
+            with pytest.raises(ValueError):
+                await core.get_csfd_url(client, message_text, index)
+
+    assert len(requests) == 1
+
+
+def test_sort_inbox_key(film):
+    card = {"id": "1", "name": film["title"], "labels": [{"name": "Netflix"}]}
+
+    assert core.sort_inbox_key(card, film) == (105, 0, film["title"])
+
+
+def test_sort_inbox_key_without_film():
+    card = {"id": "1", "name": "Foo (2020)", "labels": None}
+
+    assert core.sort_inbox_key(card, None) == (1000, 1, "Foo (2020)")
+
+
+def test_get_inbox_item(film):
+    card = {"id": "1", "name": film["title"], "labels": [], "pos": 16384}
+    item = core.get_inbox_item(card, film)
+
+    assert item == core.InboxItem("1", 16384, (105, 1, film["title"]))
+    assert not hasattr(item, "__dict__")
+
+
+@pytest.mark.asyncio
+async def test_film_cache_scrapes_film_once(film, monkeypatch):
+    scraped_urls = []
+
+    async def scrape_film(scraper: httpx.AsyncClient, csfd_url: str) -> core.Film:
+        scraped_urls.append(csfd_url)
+        await asyncio.sleep(0.01)
+        return film
+
+    monkeypatch.setattr(core, "scrape_film", scrape_film)
+    films = core.FilmCache(httpx.AsyncClient())
+    results = await asyncio.gather(
+        films.get(film["csfd_url"]),
+        films.get(film["csfd_url"]),
+    )
+    results.append(await films.get(film["csfd_url"]))
+
+    assert results == [film, film, film]
+    assert scraped_urls == [film["csfd_url"]]
+
+
+@pytest.mark.asyncio
+async def test_film_cache_forgets_failures(film, monkeypatch):
+    scraped_urls = []
+
+    async def scrape_film(scraper: httpx.AsyncClient, csfd_url: str) -> core.Film:
+        scraped_urls.append(csfd_url)
+        if len(scraped_urls) == 1:
+            raise ValueError("Could not parse year from title")
+        return film
+
+    monkeypatch.setattr(core, "scrape_film", scrape_film)
+    films = core.FilmCache(httpx.AsyncClient())
+    with pytest.raises(ValueError):
+        await films.get(film["csfd_url"])
+
+    assert await films.get(film["csfd_url"]) == film
+    assert len(scraped_urls) == 2
+
+
+@pytest.mark.asyncio
+async def test_film_cache_is_bounded(film, monkeypatch):
+    async def scrape_film(scraper: httpx.AsyncClient, csfd_url: str) -> core.Film:
+        return film
+
+    monkeypatch.setattr(core, "scrape_film", scrape_film)
+    films = core.FilmCache(httpx.AsyncClient(), maxsize=2)
+    for i in range(5):
+        await films.get(f"https://www.csfd.cz/film/{i}/")
+
+    assert list(films.films) == [
+        "https://www.csfd.cz/film/3/",
+        "https://www.csfd.cz/film/4/",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_import_films(film, monkeypatch):
+    list_url = "https://www.csfd.cz/uzivatel/123456-honzajavorek/chci-videt/"
+    list_pages = {
+        list_url: "csfd_user_list.html",
+        f"{list_url}?page=2": "csfd_user_list_2.html",
+    }
+    created_cards = []
+
+    def scraper_handler(request: httpx.Request) -> httpx.Response:
+        path = Path(__file__).parent / list_pages[str(request.url)]
+        return httpx.Response(200, content=path.read_bytes())
+
+    def trello_handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path == "/1/boards/board/lists":
+            return httpx.Response(200, json=[{"id": "inbox"}, {"id": "archive"}])
+        if request.url.path == "/1/lists/inbox/cards":
+            return httpx.Response(
+                200, json=[{"id": "1", "name": film["title"], "desc": film["csfd_url"]}]
+            )
+        if request.url.path == "/1/lists/archive/cards":
+            return httpx.Response(200, json=[])
+        if request.url.path == "/1/boards/board/labels":
+            return httpx.Response(
+                200,
+                json=[
+                    {"id": f"id-{label['name']}", **label}
+                    for label in trello.MANAGED_LABELS
+                ],
+            )
+        if request.url.path == "/1/boards/board/customFields":
+            return httpx.Response(200, json=[])
+        if request.url.path == "/1/boards/board":
+            return httpx.Response(200, json={"id": "5e8b3a1c2f4d6e7a8b9c0d1e"})
+        if request.url.path == "/1/customFields":
+            return httpx.Response(200, json={"id": "field"})
+        if request.url.path == "/1/cards":
+            created_cards.append(json.loads(request.content))
+            return httpx.Response(200, json={"id": f"new-{len(created_cards)}"})
+        return httpx.Response(200, json={})
+
+    async def scrape_film(scraper: httpx.AsyncClient, csfd_url: str) -> core.Film:
+        if "cernobyl" in csfd_url:
+            raise ValueError("Could not parse year from title")
+        return film | {"title": csfd_url, "csfd_url": csfd_url, "poster_url": None}
+
+    monkeypatch.setattr(core, "scrape_film", scrape_film)
+    async with (
+        httpx.AsyncClient(transport=httpx.MockTransport(scraper_handler)) as scraper,
+        httpx.AsyncClient(
+            base_url="https://trello.com/1/",
+            transport=httpx.MockTransport(trello_handler),
+        ) as trello_api,
+    ):
+        messages = [
+            message
+            async for message in core.import_films(
+                scraper, trello_api, list_url, "board"
+            )
+        ]
+
+    assert messages[-1] == (
+        "Done! Created 2 cards, 1 films were already on the board, "
+        "1 failed: https://trello.com/b/board"
+    )
+    assert sorted(card["desc"] for card in created_cards) == [
+        "https://www.csfd.cz/film/1004889-drive-my-car/prehled/",
+        "https://www.csfd.cz/film/346500-pod-cernou-vlajkou/449077-serie-1/prehled/",
+    ]
+    assert created_cards[0]["idList"] == "inbox"
+    assert created_cards[0]["idLabels"] == ["id-2h"]
+
+
+def get_inbox_film(film: core.Film, card_id: str, duration: int) -> core.Film:
+    return film | {
+        "title": f"Film {card_id}",
+        "csfd_url": f"https://www.csfd.cz/film/{card_id}/prehled/",
+        "durations": [duration],
+    }
+
+
+@pytest.fixture()
+def inbox_board(film):
+    films = {
+        card_id: get_inbox_film(film, card_id, duration)
+        for card_id, duration in [("1", 200), ("2", 90), ("3", 20)]
+    }
+    cards = [
+        {
+            "id": card_id,
+            "name": card_film["title"],
+            "desc": card_film["csfd_url"],
+            "pos": int(card_id),
+            "labels": [],
+            "idLabels": [],
+            "attachments": [
+                {
+                    "name": card_film["csfd_url"],
+                    "url": card_film["csfd_url"],
+                    "previews": [],
+                },
+                {"name": "poster.jpg", "url": "...", "previews": [{}]},
+            ],
+        }
+        for card_id, card_film in films.items()
+    ]
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        if request.url.path.endswith("/lists"):
+            board_id = request.url.path.split("/")[-2]
+            return httpx.Response(
+                200, json=[{"id": f"{board_id}-inbox"}, {"id": f"{board_id}-archive"}]
+            )
+        if request.url.path.endswith("/labels"):
+            return httpx.Response(
+                200,
+                json=[
+                    {"id": f"id-{label['name']}", **label}
+                    for label in trello.MANAGED_LABELS
+                ],
+            )
+        if request.url.path.endswith("/customFields"):
+            return httpx.Response(200, json=[{"id": "field", "name": "film2trello"}])
+        if request.url.path.endswith("-inbox/cards"):
+            if "fields" in request.url.params:
+                return httpx.Response(200, json=cards)
+            return httpx.Response(200, json=[])
+        return httpx.Response(200, json={})
+
+    return httpx.MockTransport(handler), requests, films
+
+
+def get_positions(requests: list[httpx.Request]) -> dict[str, int]:
+    return {
+        request.url.path.split("/")[-2]: json.loads(request.content)["pos"]
+        for request in requests
+        if request.method == "PUT" and "pos" in json.loads(request.content)
+    }
+
+
+@pytest.mark.asyncio
+async def test_process_inbox_resumes_and_retries(inbox_board, monkeypatch):
+    transport, requests, films = inbox_board
+    scraped_urls = []
+
+    async def scrape_film(scraper: httpx.AsyncClient, csfd_url: str) -> core.Film:
+        scraped_urls.append(csfd_url)
+        if csfd_url == films["3"]["csfd_url"] and scraped_urls.count(csfd_url) == 1:
+            raise ValueError("Could not parse year from title")
+        return next(film for film in films.values() if film["csfd_url"] == csfd_url)
+
+    monkeypatch.setattr(core, "scrape_film", scrape_film)
+    journal = Journal(get_journal_path("board"))
+    journal.record("1", "done", film=dict(films["1"]))
+    journal.record("2", "failed", error="Anubis challenge")
+    journal.close()
+
+    async with (
+        httpx.AsyncClient() as scraper,
+        httpx.AsyncClient(base_url="https://trello.com/1/", transport=transport) as api,
+    ):
+        summary = await core.process_inbox(
+            scraper, api, "board", core.FilmCache(scraper), resume=True
+        )
+
+    assert summary == core.InboxSummary(
+        board_id="board", processed=2, resumed=1, failed=[]
+    )
+    assert scraped_urls == [
+        films["2"]["csfd_url"],
+        films["3"]["csfd_url"],
+        films["3"]["csfd_url"],
+    ]
+    assert get_positions(requests) == {"3": 1, "1": 3}
+    assert not get_journal_path("board").exists()
+
+
+@pytest.mark.asyncio
+async def test_process_inbox_sorts_cards_without_film_last(inbox_board, monkeypatch):
+    transport, requests, films = inbox_board
+    note = {"id": "0", "name": "Note", "desc": "", "pos": 0, "labels": []}
+
+    async def scrape_film(scraper: httpx.AsyncClient, csfd_url: str) -> core.Film:
+        return next(film for film in films.values() if film["csfd_url"] == csfd_url)
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        response = await transport.handle_async_request(request)
+        if request.url.path.endswith("-inbox/cards") and "fields" in request.url.params:
+            await response.aread()
+            return httpx.Response(200, json=[note, *response.json()])
+        return response
+
+    monkeypatch.setattr(core, "scrape_film", scrape_film)
+    async with (
+        httpx.AsyncClient() as scraper,
+        httpx.AsyncClient(
+            base_url="https://trello.com/1/", transport=httpx.MockTransport(handler)
+        ) as api,
+    ):
+        await core.process_inbox(scraper, api, "board", core.FilmCache(scraper))
+
+    # the same as with --sort-only
+    assert get_positions(requests) == {"3": 1, "1": 3, "0": 4}
+
+
+@pytest.mark.asyncio
+async def test_process_inbox_keeps_journal_of_failed_cards(inbox_board, monkeypatch):
+    transport, _, films = inbox_board
+
+    async def scrape_film(scraper: httpx.AsyncClient, csfd_url: str) -> core.Film:
+        if csfd_url == films["3"]["csfd_url"]:
+            raise ValueError("Could not parse year from title")
+        return next(film for film in films.values() if film["csfd_url"] == csfd_url)
+
+    monkeypatch.setattr(core, "scrape_film", scrape_film)
+    async with (
+        httpx.AsyncClient() as scraper,
+        httpx.AsyncClient(base_url="https://trello.com/1/", transport=transport) as api,
+    ):
+        summary = await core.process_inbox(
+            scraper, api, "board", core.FilmCache(scraper)
+        )
+
+    assert summary["processed"] == 2
+    assert summary["failed"] == ["3"]
+    assert Journal(get_journal_path("board"), resume=True).get("3")["status"] == (
+        "failed"
+    )
+
+
+@pytest.mark.asyncio
+async def test_process_inboxes_shares_films_and_isolates_errors(
+    inbox_board, monkeypatch
+):
+    transport, _, films = inbox_board
+    scraped_urls = []
+
+    async def scrape_film(scraper: httpx.AsyncClient, csfd_url: str) -> core.Film:
+        scraped_urls.append(csfd_url)
+        await asyncio.sleep(0.01)
+        return next(film for film in films.values() if film["csfd_url"] == csfd_url)
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if "broken" in request.url.path:
+            raise httpx.ConnectError("Connection refused", request=request)
+        return await transport.handle_async_request(request)
+
+    monkeypatch.setattr(core, "scrape_film", scrape_film)
+    # without the decorators, which would create real clients
+    process_inboxes = core.process_inboxes.__wrapped__.__wrapped__
+    async with (
+        httpx.AsyncClient() as scraper,
+        httpx.AsyncClient(
+            base_url="https://trello.com/1/", transport=httpx.MockTransport(handler)
+        ) as api,
+    ):
+        summaries = await process_inboxes(scraper, api, ["a", "b", "broken"])
+
+    assert summaries == [
+        core.InboxSummary(board_id="a", processed=3, resumed=0, failed=[]),
+        core.InboxSummary(board_id="b", processed=3, resumed=0, failed=[]),
+        core.InboxSummary(
+            board_id="broken",
+            processed=0,
+            resumed=0,
+            failed=[],
+            error="Connection refused",
+        ),
+    ]
+    assert sorted(scraped_urls) == sorted(film["csfd_url"] for film in films.values())
+
+
+@pytest.mark.asyncio
+async def test_process_inbox_closes_journal_on_error(inbox_board, monkeypatch):
+    transport, _, films = inbox_board
+    closed = []
+
+    class Journal(core.Journal):
+        def close(self, remove: bool = False) -> None:
+            closed.append(remove)
+            super().close(remove)
+
+    async def scrape_film(scraper: httpx.AsyncClient, csfd_url: str) -> core.Film:
+        return next(film for film in films.values() if film["csfd_url"] == csfd_url)
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if request.method == "PUT" and "pos" in json.loads(request.content):
+            raise httpx.ConnectError("Connection refused", request=request)
+        return await transport.handle_async_request(request)
+
+    monkeypatch.setattr(core, "scrape_film", scrape_film)
+    monkeypatch.setattr(core, "Journal", Journal)
+    async with (
+        httpx.AsyncClient() as scraper,
+        httpx.AsyncClient(
+            base_url="https://trello.com/1/", transport=httpx.MockTransport(handler)
+        ) as api,
+    ):
+        with pytest.raises(httpx.ConnectError):
+            await core.process_inbox(scraper, api, "board", core.FilmCache(scraper))
+
+    assert closed == [False]
+    assert get_journal_path("board").exists()
+
+
+@pytest.mark.asyncio
+async def test_process_inbox_refuses_board_processed_elsewhere(inbox_board):
+    transport, requests, _ = inbox_board
+    async with (
+        httpx.AsyncClient() as scraper,
+        httpx.AsyncClient(base_url="https://trello.com/1/", transport=transport) as api,
+    ):
+        with lock_file(get_lock_path("board")), pytest.raises(LockedError):
+            await core.process_inbox(scraper, api, "board", core.FilmCache(scraper))
+
+    assert requests == []
+
+
+@pytest.mark.asyncio
+async def test_sort_inbox_uses_card_metadata(film):
+    cards = [
+        {"id": "1", "name": "Long", "pos": 1, "labels": [], "customFieldItems": []},
+        {
+            "id": "2",
+            "name": "Short",
+            "pos": 2,
+            "labels": [],
+            "customFieldItems": [
+                get_metadata_item(film | {"durations": [20]}),
+            ],
+        },
+        {
+            "id": "3",
+            "name": "Medium",
+            "pos": 3,
+            "labels": [],
+            "customFieldItems": [get_metadata_item(film)],
+        },
+    ]
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        if request.url.path == "/1/boards/board/lists":
+            return httpx.Response(200, json=[{"id": "inbox"}, {"id": "archive"}])
+        if request.url.path == "/1/boards/board/customFields":
+            return httpx.Response(200, json=[{"id": "field", "name": "film2trello"}])
+        if request.url.path == "/1/lists/inbox/cards":
+            return httpx.Response(200, json=cards)
+        return httpx.Response(200, json={})
+
+    async with httpx.AsyncClient(
+        base_url="https://trello.com/1/", transport=httpx.MockTransport(handler)
+    ) as client:
+        await core.sort_inbox(client, "board")
+
+    assert get_positions(requests) == {"2": 1, "3": 2, "1": 3}
+
+
+@pytest.fixture()
+def message_board():
+    cards = []
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        if request.url.path == "/1/boards/board/members":
+            return httpx.Response(200, json=[{"id": "id-honza", "username": "honza"}])
+        if request.url.path == "/1/boards/board/lists":
+            return httpx.Response(200, json=[{"id": "inbox"}, {"id": "archive"}])
+        if request.url.path == "/1/lists/inbox/cards":
+            return httpx.Response(200, json=cards)
+        if request.url.path == "/1/boards/board/customFields":
+            return httpx.Response(200, json=[{"id": "field", "name": "film2trello"}])
+        if request.url.path == "/1/boards/board/labels":
+            return httpx.Response(
+                200,
+                json=[
+                    {"id": f"id-{label['name']}", **label}
+                    for label in trello.MANAGED_LABELS
+                ],
+            )
+        if request.method == "POST" and request.url.path == "/1/cards":
+            return httpx.Response(200, json={"id": "new"})
+        if request.url.path.endswith("/cards"):
+            return httpx.Response(200, json=[])
+        return httpx.Response(200, json={})
+
+    trello.members_cache.clear()
+    yield httpx.MockTransport(handler), requests, cards
+    trello.members_cache.clear()
+
+
+@pytest.mark.asyncio
+async def test_process_message_sends_card_link_before_scraping(
+    film, message_board, monkeypatch
+):
+    transport, requests, _ = message_board
+    link_sent = asyncio.Event()
+    events = []
+
+    async def scrape_film(scraper: httpx.AsyncClient, csfd_url: str) -> core.Film:
+        # the scraping can't finish until the user has got the link
+        await asyncio.wait_for(link_sent.wait(), timeout=1)
+        events.append("scraped")
+        return film | {"poster_url": None}
+
+    monkeypatch.setattr(core, "scrape_film", scrape_film)
+    async with (
+        httpx.AsyncClient() as scraper,
+        httpx.AsyncClient(base_url="https://trello.com/1/", transport=transport) as api,
+    ):
+        async for message in core.process_message(
+            scraper, api, "honza", "https://www.csfd.cz/film/8283/", "board"
+        ):
+            events.append(message)
+            if message.startswith("Card created"):
+                link_sent.set()
+
+    link_index = events.index("Card created, filling it in: https://trello.com/c/new")
+    assert link_index < events.index("scraped")
+    assert events[-1] == "Done! This is your card: https://trello.com/c/new"
+    created = json.loads(requests[[r.method for r in requests].index("POST")].content)
+    assert created["name"] == "https://www.csfd.cz/film/8283/"
+    assert created["idMembers"] == ["id-honza"]
+    updated = json.loads(
+        next(
+            request.content
+            for request in requests
+            if request.method == "PUT" and request.url.path == "/1/cards/new/"
+        )
+    )
+    assert updated["name"] == film["title"]
+    assert updated["desc"] == film["csfd_url"]
+
+
+@pytest.mark.asyncio
+async def test_process_message_replaces_placeholder_with_existing_card(
+    film, message_board, monkeypatch
+):
+    transport, requests, cards = message_board
+    season_url = "https://www.csfd.cz/film/346500-pod-cernou-vlajkou/449077-serie-1/"
+    season_film = film | {
+        "title": "Pod černou vlajkou - Série 1",
+        "csfd_url": f"{season_url}prehled/",
+        "poster_url": None,
+    }
+    cards.append(
+        {
+            "id": "season",
+            "name": season_film["title"],
+            "desc": season_film["csfd_url"],
+            "idList": "inbox",
+            "labels": [],
+            "idLabels": [],
+            "idMembers": ["id-honza"],
+            "attachments": [],
+        }
+    )
+
+    async def scrape_film(scraper: httpx.AsyncClient, csfd_url: str) -> core.Film:
+        return season_film
+
+    monkeypatch.setattr(core, "scrape_film", scrape_film)
+    async with (
+        httpx.AsyncClient() as scraper,
+        httpx.AsyncClient(base_url="https://trello.com/1/", transport=transport) as api,
+    ):
+        messages = [
+            message
+            async for message in core.process_message(
+                scraper,
+                api,
+                "honza",
+                "https://www.csfd.cz/film/346500-pod-cernou-vlajkou/",
+                "board",
+            )
+        ]
+
+    assert ("DELETE", "/1/cards/new") in [
+        (request.method, request.url.path) for request in requests
+    ]
+    assert messages[-1] == "Done! This is your card: https://trello.com/c/season"
+
+
+@pytest.mark.asyncio
+async def test_process_message_deletes_placeholder_when_scraping_fails(
+    message_board, monkeypatch
+):
+    transport, requests, _ = message_board
+
+    async def scrape_film(scraper: httpx.AsyncClient, csfd_url: str) -> core.Film:
+        raise ValueError("Could not parse year from title")
+
+    monkeypatch.setattr(core, "scrape_film", scrape_film)
+    async with (
+        httpx.AsyncClient() as scraper,
+        httpx.AsyncClient(base_url="https://trello.com/1/", transport=transport) as api,
+    ):
+        with pytest.raises(ValueError):
+            async for _ in core.process_message(
+                scraper, api, "honza", "https://www.csfd.cz/film/8283/", "board"
+            ):
+                pass
+
+    assert ("DELETE", "/1/cards/new") in [
+        (request.method, request.url.path) for request in requests
+    ]
+
+
+@pytest.mark.asyncio
+async def test_process_message_same_film_at_once_creates_one_card(
+    film, message_board, monkeypatch
+):
+    transport, requests, _ = message_board
+
+    async def scrape_film(scraper: httpx.AsyncClient, csfd_url: str) -> core.Film:
+        await asyncio.sleep(0.01)
+        return film | {"poster_url": None}
+
+    async def process(message_text: str) -> list[str]:
+        return [
+            message
+            async for message in core.process_message(
+                scraper, api, "honza", message_text, "board"
+            )
+        ]
+
+    monkeypatch.setattr(core, "scrape_film", scrape_film)
+    async with (
+        httpx.AsyncClient() as scraper,
+        httpx.AsyncClient(base_url="https://trello.com/1/", transport=transport) as api,
+    ):
+        results = await asyncio.gather(
+            process("https://www.csfd.cz/film/8283/"),
+            process("https://www.csfd.cz/film/8283-posledni-skaut/prehled/"),
+        )
+
+    created = [
+        request
+        for request in requests
+        if request.method == "POST" and request.url.path == "/1/cards"
+    ]
+    assert len(created) == 1
+    assert [messages[-1] for messages in results] == [
+        "Done! This is your card: https://trello.com/c/new"
+    ] * 2
+
+
+@pytest.mark.asyncio
+async def test_process_message_not_allowed_creates_no_card(
+    film, message_board, monkeypatch
+):
+    transport, requests, _ = message_board
+
+    async def scrape_film(scraper: httpx.AsyncClient, csfd_url: str) -> core.Film:
+        return film
+
+    monkeypatch.setattr(core, "scrape_film", scrape_film)
+    async with (
+        httpx.AsyncClient() as scraper,
+        httpx.AsyncClient(base_url="https://trello.com/1/", transport=transport) as api,
+    ):
+        with pytest.raises(ValueError, match="not allowed"):
+            async for _ in core.process_message(
+                scraper, api, "zuzka", "https://www.csfd.cz/film/8283/", "board"
+            ):
+                pass
+
+    assert "POST" not in [request.method for request in requests]
+    # reading them could create missing labels or the custom field
+    paths = [request.url.path for request in requests]
+    assert "/1/boards/board/labels" not in paths
+    assert "/1/boards/board/customFields" not in paths
+
+
+@pytest.mark.asyncio
+async def test_process_message_reads_board_from_mirror(
+    film, message_board, monkeypatch
+):
+    transport, requests, _ = message_board
+
+    async def scrape_film(scraper: httpx.AsyncClient, csfd_url: str) -> core.Film:
+        return film | {"poster_url": None}
+
+    monkeypatch.setattr(core, "scrape_film", scrape_film)
+    async with (
+        httpx.AsyncClient() as scraper,
+        httpx.AsyncClient(base_url="https://trello.com/1/", transport=transport) as api,
+    ):
+        mirror = BoardMirror(get_mirror_path("board"), "board", api)
+        await mirror.sync()
+        await mirror.get_metadata_field_id()
+        requests.clear()
+        messages = [
+            message
+            async for message in core.process_message(
+                scraper,
+                api,
+                "honza",
+                "https://www.csfd.cz/film/8283/",
+                "board",
+                mirror=mirror,
+            )
+        ]
+        mirror.close()
+
+    assert messages[-1] == "Done! This is your card: https://trello.com/c/new"
+    assert [request.method for request in requests if request.method == "GET"] == []
+
+
+@pytest.mark.asyncio
+async def test_scrape_films_streams_results(film, monkeypatch):
+    read_urls = []
+
+    def get_urls():
+        for url in ["https://www.csfd.cz/film/1/", "", "invalid", "slow", "b"]:
+            read_urls.append(url)
+            yield url
+
+    async def get_csfd_url(scraper: httpx.AsyncClient, message_text: str) -> str:
+        if message_text == "invalid":
+            raise ValueError("Could not find a valid film URL")
+        return message_text
+
+    async def scrape_film(scraper: httpx.AsyncClient, csfd_url: str) -> core.Film:
+        await asyncio.sleep(0.05 if csfd_url == "slow" else 0)
+        return film | {"csfd_url": csfd_url}
+
+    monkeypatch.setattr(core, "get_csfd_url", get_csfd_url)
+    monkeypatch.setattr(core, "scrape_film", scrape_film)
+    results = []
+    async with httpx.AsyncClient() as scraper:
+        async for result in core.scrape_films(scraper, get_urls(), concurrency=2):
+            results.append(result)
+            if len(results) == 1:
+                # only as many URLs are read as there's room for
+                assert len(read_urls) <= 3
+
+    assert [result["url"] for result in results] == [
+        "https://www.csfd.cz/film/1/",
+        "invalid",
+        "b",
+        "slow",
+    ]
+    assert results[0]["title"] == film["title"]
+    assert results[1] == {"url": "invalid", "error": "Could not find a valid film URL"}
+
+
+def test_scrape_films_doesnt_wait_for_input_when_stopped(film, monkeypatch):
+    end_of_input = threading.Event()
+    # in case the test fails, the reading thread gets released eventually
+    threading.Timer(5, end_of_input.set).start()
+
+    def get_urls():
+        yield "https://www.csfd.cz/film/1/"
+        # e.g. an interactive stdin nobody types into
+        end_of_input.wait()
+
+    async def get_csfd_url(scraper: httpx.AsyncClient, message_text: str) -> str:
+        return message_text
+
+    async def scrape_film(scraper: httpx.AsyncClient, csfd_url: str) -> core.Film:
+        # meanwhile the next URL is being read
+        await asyncio.sleep(0.05)
+        return film | {"csfd_url": csfd_url}
+
+    async def scrape_first() -> dict:
+        async with httpx.AsyncClient() as scraper:
+            async for result in core.scrape_films(scraper, get_urls()):
+                return result
+
+    monkeypatch.setattr(core, "get_csfd_url", get_csfd_url)
+    monkeypatch.setattr(core, "scrape_film", scrape_film)
+    started_at = time.monotonic()
+    result = asyncio.run(scrape_first())
+
+    assert result["url"] == "https://www.csfd.cz/film/1/"
+    assert time.monotonic() - started_at < 2
+    end_of_input.set()
+
+
+@pytest.mark.asyncio
+async def test_write_films(film, monkeypatch):
+    async def scrape_url(scraper: httpx.AsyncClient, url: str) -> dict:
+        if url == "invalid":
+            return {"url": url, "error": "Failed"}
+        return {"url": url, **film}
+
+    monkeypatch.setattr(core, "scrape_url", scrape_url)
+    output = io.StringIO()
+    async with httpx.AsyncClient() as scraper:
+        failed_count = await core.write_films.__wrapped__(
+            scraper, iter(["https://www.csfd.cz/film/1/", "invalid"]), output
+        )
+
+    lines = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert failed_count == 1
+    assert sorted(line["url"] for line in lines) == [
+        "https://www.csfd.cz/film/1/",
+        "invalid",
+    ]
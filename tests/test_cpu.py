@@ -0,0 +1,50 @@
+import threading
+
+import pytest
+
+from film2trello import cpu
+
+
+def get_thread_name() -> str:
+    return threading.current_thread().name
+
+
+@pytest.mark.parametrize(
+    "free_threaded, picklable, releases_gil, expected",
+    [
+        (True, True, False, "thread"),
+        (True, False, False, "thread"),
+        (False, True, False, "process"),
+        (False, False, True, "thread"),
+        (False, False, False, None),
+    ],
+)
+def test_get_executor(monkeypatch, free_threaded, picklable, releases_gil, expected):
+    monkeypatch.setattr(cpu, "is_free_threaded", lambda: free_threaded)
+    pools = {"thread": cpu.get_thread_pool(), None: None}
+    if expected == "process":
+        pools["process"] = cpu.get_process_pool()
+
+    assert cpu.get_executor(picklable, releases_gil) is pools[expected]
+
+
+@pytest.mark.asyncio
+async def test_run_cpu_in_thread_pool(monkeypatch):
+    monkeypatch.setattr(cpu, "is_free_threaded", lambda: True)
+
+    assert (await cpu.run_cpu(get_thread_name)).startswith("cpu")
+
+
+@pytest.mark.asyncio
+async def test_run_cpu_inline(monkeypatch):
+    monkeypatch.setattr(cpu, "is_free_threaded", lambda: False)
+
+    name = await cpu.run_cpu(get_thread_name, picklable=False)
+
+    assert name == threading.current_thread().name
+
+
+def test_get_workers_count(monkeypatch):
+    monkeypatch.setenv("FILM2TRELLO_CPU_WORKERS", "3")
+
+    assert cpu.get_workers_count() == 3
@@ -204,3 +204,78 @@ def test_parse_is_tvshow_true(filename, expected):
     csfd_html = html.fromstring(path.read_text())
 
     assert csfd.parse_is_tvshow(csfd_html) is expected
+
+
+@pytest.mark.parametrize(
+    "csfd_url, expected",
+    (
+        ("https://www.csfd.cz/film/988751", 988751),
+        ("https://www.csfd.cz/film/8283-posledni-skaut/prehled/", 8283),
+        (
+            "https://www.csfd.cz/film/346500-pod-cernou-vlajkou/449077-serie-1/prehled/",
+            346500,
+        ),
+        ("https://example.com", None),
+    ),
+)
+def test_get_film_id(csfd_url, expected):
+    assert csfd.get_film_id(csfd_url) == expected
+
+
+def test_get_user_list_url():
+    assert (
+        csfd.get_user_list_url(
+            "koukni https://www.csfd.cz/uzivatel/123456-honzajavorek/chci-videt/"
+        )
+        == "https://www.csfd.cz/uzivatel/123456-honzajavorek/chci-videt/"
+    )
+    assert csfd.get_user_list_url("https://www.csfd.cz/film/8283/") is None
+
+
+def test_parse_user_list_film_urls():
+    path = Path(__file__).parent / "csfd_user_list.html"
+    csfd_html = html.fromstring(path.read_text())
+    csfd_html.make_links_absolute(
+        "https://www.csfd.cz/uzivatel/123456-honzajavorek/chci-videt/"
+    )
+
+    assert csfd.parse_user_list_film_urls(csfd_html) == [
+        "https://www.csfd.cz/film/8283-posledni-skaut/prehled/",
+        "https://www.csfd.cz/film/683975-cernobyl/prehled/",
+    ]
+
+
+def test_parse_next_page_url():
+    path = Path(__file__).parent / "csfd_user_list.html"
+    csfd_html = html.fromstring(path.read_text())
+    csfd_html.make_links_absolute(
+        "https://www.csfd.cz/uzivatel/123456-honzajavorek/chci-videt/"
+    )
+
+    assert (
+        csfd.parse_next_page_url(csfd_html)
+        == "https://www.csfd.cz/uzivatel/123456-honzajavorek/chci-videt/?page=2"
+    )
+
+
+def test_parse_next_page_url_last_page():
+    path = Path(__file__).parent / "csfd_user_list_2.html"
+    csfd_html = html.fromstring(path.read_text())
+
+    assert csfd.parse_next_page_url(csfd_html) is None
+
+
+@pytest.mark.parametrize(
+    "csfd_url, expected",
+    [
+        ("https://www.csfd.cz/film/988751", (988751,)),
+        ("https://www.csfd.cz/film/8283-posledni-skaut/prehled/", (8283,)),
+        (
+            "https://www.csfd.cz/film/346500-pod-cernou-vlajkou/449077-serie-1/",
+            (346500, 449077),
+        ),
+        ("https://example.com", ()),
+    ],
+)
+def test_get_film_path_ids(csfd_url, expected):
+    assert csfd.get_film_path_ids(csfd_url) == expected
@@ -0,0 +1,147 @@
+import csv
+import io
+import json
+
+import httpx
+import pytest
+
+from film2trello import export, trello
+
+
+def get_card(number: int, list_id: str, **fields) -> dict:
+    return {
+        # IDs start with the time the card was created, 2024-01-01 here
+        "id": f"65920080{number:016x}",
+        "name": f"Film {number}",
+        "desc": f"https://www.csfd.cz/film/{number}-film/",
+        "idList": list_id,
+        "pos": number,
+        "labels": [{"id": "id-2h", "name": "2h", "color": "orange"}],
+        "idLabels": ["id-2h"],
+        "idMembers": ["id-honza"],
+        "closed": False,
+        "dateLastActivity": "2024-06-01T10:00:00.000Z",
+        **fields,
+    }
+
+
+@pytest.fixture()
+def board_api():
+    cards = {
+        "inbox": [
+            get_card(
+                1,
+                "inbox",
+                customFieldItems=[
+                    {
+                        "idCustomField": "field",
+                        "value": {
+                            "text": json.dumps(
+                                {"csfd_id": 1, "durations": [90], "kvifftv": True}
+                            )
+                        },
+                    }
+                ],
+            )
+        ],
+        # in the order of their positions, i.e. not of their IDs
+        "archive": [
+            get_card(number, "archive", pos=pos, closed=number % 2 == 0)
+            for pos, number in enumerate([*range(500, 1001), *range(3, 500)])
+        ],
+        "old": [get_card(2, "old")],
+    }
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        if request.url.path == "/1/boards/board/lists":
+            return httpx.Response(
+                200,
+                json=[
+                    {"id": "inbox", "name": "Inbox", "closed": False},
+                    {"id": "archive", "name": "Viděli jsme", "closed": False},
+                    {"id": "old", "name": "Staré", "closed": True},
+                ],
+            )
+        if request.url.path == "/1/boards/board/members":
+            return httpx.Response(200, json=[{"id": "id-honza", "username": "honza"}])
+        if request.url.path == "/1/boards/board/customFields":
+            return httpx.Response(200, json=[{"id": "field", "name": "film2trello"}])
+        list_id = request.url.path.split("/")[3]
+        return httpx.Response(200, json=cards[list_id])
+
+    trello.members_cache.clear()
+    yield httpx.MockTransport(handler), requests
+    trello.members_cache.clear()
+
+
+@pytest.mark.asyncio
+async def test_export_board_jsonl(board_api):
+    transport, requests = board_api
+    output = io.StringIO()
+
+    async with httpx.AsyncClient(
+        base_url="https://trello.com/1/", transport=transport
+    ) as client:
+        count = await export.export_board.__wrapped__(
+            client, "board", output, "jsonl", with_metadata=True
+        )
+
+    rows = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert count == len(rows) == 1000
+    assert rows[0] == {
+        "list_id": "inbox",
+        "list_name": "Inbox",
+        "card_id": "659200800000000000000001",
+        "card_url": "https://trello.com/c/659200800000000000000001",
+        "archived": False,
+        "name": "Film 1",
+        "csfd_url": "https://www.csfd.cz/film/1-film/",
+        "labels": ["2h"],
+        "members": ["honza"],
+        "created_at": "2024-01-01T00:00:00+00:00",
+        "last_activity_at": "2024-06-01T10:00:00.000Z",
+        "csfd_id": 1,
+        "durations": [90],
+        "is_tvshow": None,
+        "kvifftv": True,
+        "netflix": None,
+        "scraped_at": None,
+    }
+    assert rows[1]["csfd_id"] is None
+    assert len({row["card_id"] for row in rows}) == 1000
+    # the even ones from the archive list and the card of the archived list
+    assert sum(row["archived"] for row in rows) == 499 + 1
+    assert rows[-1]["list_name"] == "Staré"
+    assert rows[-1]["archived"] is True
+    lists_request, *_ = [
+        request for request in requests if request.url.path.endswith("/lists")
+    ]
+    assert lists_request.url.params["filter"] == "all"
+    archive_requests = [
+        request for request in requests if request.url.path.endswith("archive/cards")
+    ]
+    assert len(archive_requests) == 1
+    assert archive_requests[0].url.params["filter"] == "all"
+    assert "dateLastActivity" in archive_requests[0].url.params["fields"]
+
+
+@pytest.mark.asyncio
+async def test_export_board_csv(board_api):
+    transport, requests = board_api
+    output = io.StringIO()
+
+    async with httpx.AsyncClient(
+        base_url="https://trello.com/1/", transport=transport
+    ) as client:
+        await export.export_board.__wrapped__(client, "board", output, "csv")
+
+    rows = list(csv.DictReader(io.StringIO(output.getvalue())))
+    assert len(rows) == 1000
+    assert list(rows[0]) == export.EXPORT_FIELDS
+    assert rows[0]["labels"] == "2h"
+    assert rows[0]["list_name"] == "Inbox"
+    assert "/1/boards/board/customFields" not in [
+        request.url.path for request in requests
+    ]
@@ -0,0 +1,88 @@
+import time
+
+import pytest
+
+from film2trello.failures import (
+    BACKOFF_BASES,
+    BACKOFF_MAX,
+    FailureCache,
+    SuppressedError,
+)
+
+
+def test_failure_cache_backs_off_exponentially(tmp_path):
+    failure_cache = FailureCache(tmp_path / "failures.json")
+
+    delays = []
+    for _ in range(3):
+        failure = failure_cache.record_failure("poster", "https://x", "http", "404")
+        delays.append(failure["retry_at"] - failure["failed_at"])
+
+    base = BACKOFF_BASES["http"]
+    assert delays == [base, base * 2, base * 4]
+
+
+def test_failure_cache_backoff_is_capped(tmp_path):
+    failure_cache = FailureCache(tmp_path / "failures.json")
+
+    for _ in range(20):
+        failure = failure_cache.record_failure("poster", "https://x", "http", "404")
+
+    assert failure["retry_at"] - failure["failed_at"] == BACKOFF_MAX
+
+
+def test_failure_cache_resets_backoff_for_other_failure(tmp_path):
+    failure_cache = FailureCache(tmp_path / "failures.json")
+    failure_cache.record_failure("page", "https://x", "http", "404")
+    failure_cache.record_failure("page", "https://x", "http", "404")
+
+    failure = failure_cache.record_failure("page", "https://x", "antibot", "Anubis")
+
+    assert failure["count"] == 1
+    assert failure["retry_at"] - failure["failed_at"] == BACKOFF_BASES["antibot"]
+
+
+def test_failure_cache_suppresses_until_retry(tmp_path):
+    failure_cache = FailureCache(tmp_path / "failures.json")
+    failure_cache.record_failure("page", "https://x", "antibot", "Anubis")
+
+    with pytest.raises(SuppressedError, match="https://x"):
+        failure_cache.check("page", "https://x")
+    failure_cache.check("page", "https://y")
+    failure_cache.check("poster", "https://x")
+    failure_cache.failures["page https://x"]["retry_at"] = time.time() - 1
+    failure_cache.check("page", "https://x")
+
+    assert failure_cache.suppressed_count == 1
+
+
+def test_failure_cache_forgets_on_success(tmp_path):
+    failure_cache = FailureCache(tmp_path / "failures.json")
+    failure_cache.record_failure("page", "https://x", "antibot", "Anubis")
+
+    failure_cache.record_success("page", "https://x")
+
+    failure_cache.check("page", "https://x")
+    assert failure_cache.report() == []
+
+
+def test_failure_cache_persists_and_reports(tmp_path):
+    path = tmp_path / "failures.json"
+    failure_cache = FailureCache(path)
+    failure_cache.record_failure("poster", "https://x", "decode", "Broken")
+    failure_cache.record_failure("page", "https://y", "antibot", "Anubis")
+    failure_cache.save()
+
+    report = FailureCache(path).report()
+
+    assert [failure["resource"] for failure in report] == ["https://y", "https://x"]
+
+
+def test_failure_cache_prunes_old_failures(tmp_path):
+    path = tmp_path / "failures.json"
+    failure_cache = FailureCache(path)
+    failure_cache.record_failure("poster", "https://x", "decode", "Broken")
+    failure_cache.failures["poster https://x"]["failed_at"] -= BACKOFF_MAX * 3
+    failure_cache.save()
+
+    assert FailureCache(path).failures == {}
@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+
+from film2trello.graph import TaskGraph
+
+
+@pytest.mark.asyncio
+async def test_task_graph_runs_independent_steps_concurrently():
+    started = []
+    both_started = asyncio.Event()
+
+    async def step(name: str) -> str:
+        started.append(name)
+        if len(started) == 2:
+            both_started.set()
+        await asyncio.wait_for(both_started.wait(), timeout=1)
+        return name
+
+    async def join(a: str, b: str) -> str:
+        return a + b
+
+    async with TaskGraph() as graph:
+        graph.add("a", lambda: step("a"))
+        graph.add("b", lambda: step("b"))
+        graph.add("ab", join, "a", "b")
+
+        assert await graph.get("ab") == "ab"
+
+
+@pytest.mark.asyncio
+async def test_task_graph_cancels_steps_on_failure():
+    cancelled = asyncio.Event()
+
+    async def fail() -> None:
+        raise ValueError("Failed")
+
+    async def wait() -> None:
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    async def never() -> None:
+        raise AssertionError("Should not run")
+
+    with pytest.raises(ValueError):
+        async with TaskGraph() as graph:
+            graph.add("fail", fail)
+            graph.add("wait", wait)
+            graph.add("never", lambda _: never(), "fail")
+            await graph.get("fail")
+
+    assert cancelled.is_set()
+    assert isinstance(graph.tasks["never"].exception(), ValueError)
+
+
+@pytest.mark.asyncio
+async def test_task_graph_runs_step_after_other_step():
+    order = []
+
+    async def step(name: str) -> str:
+        await asyncio.sleep(0.01 if name == "a" else 0)
+        order.append(name)
+        return name
+
+    async with TaskGraph() as graph:
+        graph.add("a", lambda: step("a"))
+        graph.add("b", lambda: step("b"), after=("a",))
+
+        assert await graph.get("b") == "b"
+
+    assert order == ["a", "b"]
+
+
+@pytest.mark.asyncio
+async def test_task_graph_unknown_dependency():
+    async with TaskGraph() as graph:
+        with pytest.raises(ValueError, match="unknown"):
+            graph.add("a", asyncio.sleep, "b")
+
+
+@pytest.mark.asyncio
+async def test_task_graph_unknown_after():
+    async with TaskGraph() as graph:
+        with pytest.raises(ValueError, match="unknown"):
+            graph.add("a", asyncio.sleep, after=("b",))
@@ -1,3 +1,6 @@
+import asyncio
+import re
+import time
 from pathlib import Path
 
 import httpx
@@ -6,6 +9,7 @@ import stamina
 from lxml import html
 
 from film2trello import http
+from film2trello.failures import SuppressedError
 
 
 @pytest.fixture(autouse=True)
@@ -96,3 +100,530 @@ async def test_retry_transport_does_not_retry_success():
 
     assert response.status_code == 200
     assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_search_text_stops_at_first_match():
+    chunks_read = []
+
+    async def stream():
+        for chunk in [
+            b"<a href='https://www.csfd.cz/film/",
+            b"988751'>",
+            b"...",
+            b"...",
+        ]:
+            chunks_read.append(chunk)
+            yield chunk
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, content=stream())
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        url = await http.search_text(
+            client, "https://kviff.tv/katalog/foo", re.compile(r"https://\S+/\d+")
+        )
+
+    assert url == "https://www.csfd.cz/film/988751"
+    assert len(chunks_read) == 2
+
+
+@pytest.mark.asyncio
+async def test_search_text_match_at_the_very_end():
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, content=b"... https://www.csfd.cz/film/988751")
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        url = await http.search_text(
+            client, "https://kviff.tv/katalog/foo", re.compile(r"https://\S+/\d+")
+        )
+
+    assert url == "https://www.csfd.cz/film/988751"
+
+
+@pytest.mark.asyncio
+async def test_search_text_no_match():
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, content=b"...")
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        url = await http.search_text(
+            client, "https://kviff.tv/katalog/foo", re.compile(r"https://\S+/\d+")
+        )
+
+    assert url is None
+
+
+def get_hedging_transport(handler, **kwargs) -> http.HedgingTransport:
+    transport = http.HedgingTransport(httpx.MockTransport(handler), **kwargs)
+    transport.latencies["example.com"].extend([0.01] * 20)
+    transport.requests_count = 20
+    return transport
+
+
+@pytest.mark.asyncio
+async def test_hedging_transport_hedges_slow_request():
+    calls = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        if len(calls) == 1:
+            await asyncio.sleep(10)
+        return httpx.Response(200, text=f"response {len(calls)}")
+
+    transport = get_hedging_transport(handler)
+    async with httpx.AsyncClient(transport=transport) as client:
+        response = await asyncio.wait_for(client.get("https://example.com/"), 1)
+
+    assert response.text == "response 2"
+    assert len(calls) == 2
+    assert transport.hedged_count == 1
+
+
+@pytest.mark.asyncio
+async def test_hedging_transport_does_not_hedge_fast_request():
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        return httpx.Response(200, text="ok")
+
+    transport = get_hedging_transport(handler)
+    async with httpx.AsyncClient(transport=transport) as client:
+        await client.get("https://example.com/")
+
+    assert len(calls) == 1
+    assert transport.hedged_count == 0
+
+
+@pytest.mark.asyncio
+async def test_hedging_transport_respects_budget():
+    calls = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        await asyncio.sleep(0.05)
+        return httpx.Response(200, text="ok")
+
+    transport = get_hedging_transport(handler, max_share=0.1)
+    transport.hedged_count = 3
+    async with httpx.AsyncClient(transport=transport) as client:
+        await client.get("https://example.com/")
+
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_hedging_transport_records_latency_of_original_request():
+    calls = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        if len(calls) == 1:
+            await asyncio.sleep(10)
+        return httpx.Response(200, text="ok")
+
+    transport = get_hedging_transport(handler)
+    async with httpx.AsyncClient(transport=transport) as client:
+        await client.get("https://example.com/")
+
+    # not the few milliseconds of the hedge which won
+    assert transport.latencies["example.com"][-1] > 0.01
+
+
+class ClosingStream(httpx.AsyncByteStream):
+    def __init__(self) -> None:
+        self.closed = False
+
+    async def __aiter__(self):
+        yield b"late"
+
+    async def aclose(self) -> None:
+        self.closed = True
+
+
+@pytest.mark.asyncio
+async def test_hedging_transport_closes_late_response_of_loser():
+    stream = ClosingStream()
+    calls = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        if len(calls) == 1:
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                # e.g. the response has already been on its way
+                return httpx.Response(200, stream=stream)
+        return httpx.Response(200, text="ok")
+
+    transport = get_hedging_transport(handler)
+    async with httpx.AsyncClient(transport=transport) as client:
+        response = await client.get("https://example.com/")
+        await asyncio.sleep(0.01)
+
+    assert response.text == "ok"
+    assert stream.closed
+
+
+def test_hedging_is_off_by_default(monkeypatch):
+    monkeypatch.delenv("FILM2TRELLO_HEDGE", raising=False)
+
+    assert not http.is_hedging_enabled()
+
+    monkeypatch.setenv("FILM2TRELLO_HEDGE", "1")
+
+    assert http.is_hedging_enabled()
+
+
+@pytest.mark.asyncio
+async def test_hedging_transport_waits_for_other_request_on_failure():
+    calls = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        if len(calls) == 1:
+            await asyncio.sleep(0.1)
+            return httpx.Response(200, text="slow but ok")
+        raise httpx.ConnectError("boom", request=request)
+
+    transport = get_hedging_transport(handler)
+    async with httpx.AsyncClient(transport=transport) as client:
+        response = await client.get("https://example.com/")
+
+    assert response.text == "slow but ok"
+    assert len(calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_hedging_transport_does_not_hedge_unsafe_methods():
+    calls = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        await asyncio.sleep(0.05)
+        return httpx.Response(200, text="ok")
+
+    transport = get_hedging_transport(handler)
+    async with httpx.AsyncClient(transport=transport) as client:
+        await client.post("https://example.com/", json={"foo": "bar"})
+
+    assert len(calls) == 1
+
+
+def test_profile_stats_prefers_successful_profiles(tmp_path):
+    profile_stats = http.ProfileStats(tmp_path / "profiles.json")
+    good_profile, *bad_profiles = http.BROWSER_PROFILES
+    for _ in range(50):
+        profile_stats.record(good_profile, challenged=False)
+        for profile in bad_profiles:
+            profile_stats.record(profile, challenged=True)
+
+    choices = [profile_stats.choose() for _ in range(20)]
+
+    assert choices.count(good_profile) > 15
+
+
+def test_profile_stats_choose_excludes_profiles(tmp_path):
+    profile_stats = http.ProfileStats(tmp_path / "profiles.json")
+    exclude = http.BROWSER_PROFILES[1:]
+
+    assert profile_stats.choose(exclude=exclude) == http.BROWSER_PROFILES[0]
+    assert profile_stats.choose(exclude=http.BROWSER_PROFILES) in http.BROWSER_PROFILES
+
+
+def test_profile_stats_persist(tmp_path):
+    profile_stats = http.ProfileStats(tmp_path / "profiles.json")
+    profile_stats.record(http.BROWSER_PROFILES[0], challenged=True)
+    profile_stats.record(http.BROWSER_PROFILES[0], challenged=False)
+    profile_stats.save()
+
+    profile_stats = http.ProfileStats(tmp_path / "profiles.json")
+
+    assert profile_stats.counts == {http.BROWSER_PROFILES[0]["User-Agent"]: [1, 1]}
+
+
+def test_apply_profile_replaces_previous_profile():
+    chrome_profile, firefox_profile = (
+        http.BROWSER_PROFILES[0],
+        http.BROWSER_PROFILES[-1],
+    )
+    headers = httpx.Headers(http.get_default_headers(chrome_profile))
+    http.apply_profile(headers, firefox_profile)
+
+    assert headers["User-Agent"] == firefox_profile["User-Agent"]
+    assert "Sec-Ch-Ua" not in headers
+
+
+@pytest.mark.asyncio
+async def test_get_html_rotates_profile_on_antibot_page():
+    responses = [
+        (Path(__file__).parent / "csfd_antibot_cs.html").read_bytes(),
+        (Path(__file__).parent / "csfd.html").read_bytes(),
+    ]
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(200, content=responses[len(requests) - 1])
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        page = await http.get_html(client, "https://www.csfd.cz/film/8283/")
+
+    assert page["url"] == "https://www.csfd.cz/film/8283/"
+    assert len(requests) == 2
+    assert requests[0].headers["User-Agent"] != requests[1].headers["User-Agent"]
+    # the client goes on as the browser which hasn't been challenged
+    assert client.headers["User-Agent"] == requests[1].headers["User-Agent"]
+
+
+@pytest.mark.asyncio
+async def test_get_html_keeps_profile_of_client():
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(
+            200, content=(Path(__file__).parent / "csfd.html").read_bytes()
+        )
+
+    async with httpx.AsyncClient(
+        headers=http.get_default_headers(), transport=httpx.MockTransport(handler)
+    ) as client:
+        user_agent = client.headers["User-Agent"]
+        for film_id in range(5):
+            await http.get_html(client, f"https://www.csfd.cz/film/{film_id}/")
+
+    assert {request.headers["User-Agent"] for request in requests} == {user_agent}
+
+
+@pytest.mark.asyncio
+async def test_rate_limit_transport_waits_for_budget():
+    sent_at = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        sent_at.append(time.monotonic())
+        return httpx.Response(200, text="ok")
+
+    transport = http.RateLimitTransport(httpx.MockTransport(handler), 2, 0.2)
+    async with httpx.AsyncClient(transport=transport) as client:
+        await asyncio.gather(*(client.get("https://example.com/") for _ in range(5)))
+
+    assert len(sent_at) == 5
+    assert sent_at[1] - sent_at[0] < 0.1
+    assert sent_at[2] - sent_at[0] >= 0.2
+    assert sent_at[4] - sent_at[0] >= 0.4
+
+
+def get_blocking_handler(order: list[str]):
+    gate = asyncio.Event()
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        order.append(request.url.path.strip("/"))
+        await gate.wait()
+        return httpx.Response(200, text="ok")
+
+    return handler, gate
+
+
+async def send_with_priority(
+    client: httpx.AsyncClient, name: http.Priority, path: str
+) -> httpx.Response:
+    with http.priority(name):
+        return await client.get(f"https://example.com/{path}")
+
+
+@pytest.mark.asyncio
+async def test_priority_transport_lets_interactive_requests_first():
+    order = []
+    handler, gate = get_blocking_handler(order)
+    transport = http.PriorityTransport(
+        httpx.MockTransport(handler), capacity=1, min_shares={}
+    )
+    async with httpx.AsyncClient(transport=transport) as client:
+        tasks = [
+            asyncio.create_task(send_with_priority(client, "background", f"b{i}"))
+            for i in range(3)
+        ]
+        await asyncio.sleep(0.01)
+        tasks.append(
+            asyncio.create_task(send_with_priority(client, "interactive", "i0"))
+        )
+        await asyncio.sleep(0.01)
+        gate.set()
+        await asyncio.gather(*tasks)
+
+    assert order == ["b0", "i0", "b1", "b2"]
+    assert transport.active == 0
+
+
+@pytest.mark.asyncio
+async def test_priority_transport_guarantees_min_share():
+    order = []
+    handler, gate = get_blocking_handler(order)
+    transport = http.PriorityTransport(
+        httpx.MockTransport(handler),
+        capacity=1,
+        min_shares={"background": 0.25},
+        window=4,
+    )
+    async with httpx.AsyncClient(transport=transport) as client:
+        tasks = [
+            asyncio.create_task(send_with_priority(client, "background", f"b{i}"))
+            for i in range(3)
+        ]
+        tasks.extend(
+            asyncio.create_task(send_with_priority(client, "interactive", f"i{i}"))
+            for i in range(6)
+        )
+        await asyncio.sleep(0.01)
+        gate.set()
+        await asyncio.gather(*tasks)
+
+    assert order[:6] == ["b0", "i0", "i1", "i2", "i3", "b1"]
+
+
+@pytest.mark.asyncio
+async def test_priority_transport_forgets_cancelled_waiters():
+    order = []
+    handler, gate = get_blocking_handler(order)
+    transport = http.PriorityTransport(httpx.MockTransport(handler), capacity=1)
+    async with httpx.AsyncClient(transport=transport) as client:
+        first = asyncio.create_task(client.get("https://example.com/first"))
+        cancelled = asyncio.create_task(client.get("https://example.com/cancelled"))
+        await asyncio.sleep(0.01)
+        cancelled.cancel()
+        gate.set()
+        await first
+        await client.get("https://example.com/last")
+
+    assert order == ["first", "last"]
+    assert transport.active == 0
+
+
+@pytest.mark.asyncio
+async def test_priority_transport_records_wait_stats(monkeypatch):
+    stats = http.WaitStats()
+    monkeypatch.setattr(http, "wait_stats", stats)
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, text="ok")
+
+    transport = http.PriorityTransport(httpx.MockTransport(handler))
+    async with httpx.AsyncClient(transport=transport) as client:
+        await send_with_priority(client, "interactive", "i")
+        await send_with_priority(client, "background", "b")
+        await send_with_priority(client, "background", "b")
+
+    assert stats.counts == {"interactive": 1, "background": 2}
+    assert stats.format().startswith("interactive 1 requests waited")
+
+
+@pytest.mark.asyncio
+async def test_priority_transport_releases_turn_of_read_response():
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, text="ok")
+
+    transport = http.PriorityTransport(httpx.MockTransport(handler), capacity=1)
+    async with httpx.AsyncClient(transport=transport) as client:
+        for _ in range(2):
+            await asyncio.wait_for(client.get("https://example.com/"), 1)
+
+    assert transport.active == 0
+
+
+@pytest.mark.asyncio
+async def test_get_html_coalesces_concurrent_requests():
+    requests = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        await asyncio.sleep(0.01)
+        return httpx.Response(
+            200, content=(Path(__file__).parent / "csfd.html").read_bytes()
+        )
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        pages = await asyncio.gather(
+            http.get_html(client, "https://www.csfd.cz/film/8283/"),
+            http.get_html(client, "https://www.csfd.cz/film/8283/#comments"),
+        )
+        await http.get_html(client, "https://www.csfd.cz/film/8283/")
+
+    assert len(requests) == 2
+    assert pages[0]["html"] is pages[1]["html"]
+    assert pages[1]["request_url"] == "https://www.csfd.cz/film/8283/#comments"
+
+
+@pytest.mark.asyncio
+async def test_single_flight_survives_cancelled_caller():
+    calls = []
+    release = asyncio.Event()
+
+    async def fetch() -> str:
+        calls.append(1)
+        await release.wait()
+        return "result"
+
+    single_flight = http.SingleFlight()
+    first = asyncio.create_task(single_flight.run("key", fetch))
+    second = asyncio.create_task(single_flight.run("key", fetch))
+    await asyncio.sleep(0)
+    first.cancel()
+    release.set()
+
+    assert await second == "result"
+    assert first.cancelled()
+    assert calls == [1]
+    assert single_flight.calls == {}
+
+
+@pytest.mark.asyncio
+async def test_single_flight_shares_exception():
+    async def fetch() -> str:
+        await asyncio.sleep(0)
+        raise ValueError("Failed")
+
+    single_flight = http.SingleFlight()
+    results = await asyncio.gather(
+        single_flight.run("key", fetch),
+        single_flight.run("key", fetch),
+        return_exceptions=True,
+    )
+
+    assert [type(result) for result in results] == [ValueError, ValueError]
+    assert single_flight.coalesced_count == 1
+
+
+@pytest.mark.asyncio
+async def test_get_html_skips_page_which_keeps_failing(failure_cache):
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(
+            200, content=(Path(__file__).parent / "csfd_antibot_cs.html").read_bytes()
+        )
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        with (
+            stamina.set_testing(True, attempts=2),
+            pytest.raises(http.AntiBotError),
+        ):
+            await http.get_html(client, "https://www.csfd.cz/film/8283/")
+        requests.clear()
+
+        with pytest.raises(SuppressedError):
+            await http.get_html(client, "https://www.csfd.cz/film/8283/")
+        assert requests == []
+
+        # someone waiting for a reply gets another attempt
+        with (
+            stamina.set_testing(True, attempts=1),
+            http.priority("interactive"),
+            pytest.raises(http.AntiBotError),
+        ):
+            await http.get_html(client, "https://www.csfd.cz/film/8283/")
+        assert len(requests) == 1
+
+    assert [failure["count"] for failure in failure_cache.report()] == [2]
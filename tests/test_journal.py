@@ -0,0 +1,69 @@
+from film2trello.journal import Journal
+
+
+def test_journal_resume(tmp_path):
+    path = tmp_path / "inbox.jsonl"
+    journal = Journal(path)
+    journal.record("1", "done", film={"title": "Foo (2020)", "durations": [90]})
+    journal.record("2", "failed", error="Anubis challenge")
+    journal.record("3", "skipped")
+    journal.close()
+
+    journal = Journal(path, resume=True)
+
+    assert journal.get("1") == {
+        "card_id": "1",
+        "status": "done",
+        "film": {"title": "Foo (2020)", "durations": [90]},
+        "error": None,
+    }
+    assert journal.get("3")["status"] == "skipped"
+    assert journal.get("4") is None
+    assert journal.get("2")["status"] == "failed"
+
+
+def test_journal_resume_later_entries_win(tmp_path):
+    path = tmp_path / "inbox.jsonl"
+    journal = Journal(path)
+    journal.record("1", "failed", error="boom")
+    journal.close()
+
+    journal = Journal(path, resume=True)
+    journal.record("1", "done", film={"title": "Foo (2020)"})
+    journal.close()
+
+    assert Journal(path, resume=True).get("1")["status"] == "done"
+
+
+def test_journal_without_resume_starts_over(tmp_path):
+    path = tmp_path / "inbox.jsonl"
+    journal = Journal(path)
+    journal.record("1", "done")
+    journal.close()
+
+    assert Journal(path).get("1") is None
+
+
+def test_journal_resume_skips_corrupted_line(tmp_path):
+    path = tmp_path / "inbox.jsonl"
+    path.write_text(
+        '{"card_id": "1", "status": "done", "film": null, "error": null}\n{"card_'
+    )
+
+    journal = Journal(path, resume=True)
+    journal.record("2", "done")
+    journal.close()
+
+    journal = Journal(path, resume=True)
+
+    assert journal.get("1")["status"] == "done"
+    assert journal.get("2")["status"] == "done"
+
+
+def test_journal_close_remove(tmp_path):
+    path = tmp_path / "inbox.jsonl"
+    journal = Journal(path)
+    journal.record("1", "done")
+    journal.close(remove=True)
+
+    assert not path.exists()
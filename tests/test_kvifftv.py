@@ -0,0 +1,193 @@
+from datetime import UTC, datetime, timedelta
+from pathlib import Path
+
+import httpx
+import pytest
+from lxml import html
+
+from film2trello import kvifftv
+
+
+def test_get_slug():
+    assert (
+        kvifftv.get_slug("https://kviff.tv/katalog/smolny-pich-aneb-pitomy-porno")
+        == "smolny-pich-aneb-pitomy-porno"
+    )
+
+
+def test_get_slug_subpage():
+    assert (
+        kvifftv.get_slug(
+            "https://kviff.tv/katalog/smolny-pich-aneb-pitomy-porno/koupit-prehrani"
+        )
+        == "smolny-pich-aneb-pitomy-porno"
+    )
+
+
+def test_get_slug_invalid():
+    with pytest.raises(ValueError):
+        kvifftv.get_slug("https://www.csfd.cz/film/988751")
+
+
+def test_index_persists(tmp_path):
+    path = tmp_path / "kvifftv.json"
+    index = kvifftv.KviffTvIndex(path)
+    index.set("smolny-pich", "https://www.csfd.cz/film/988751")
+    index.set("bod-varu", None)
+    index.save()
+
+    index = kvifftv.KviffTvIndex(path)
+
+    assert "smolny-pich" in index
+    assert index.get("smolny-pich") == "https://www.csfd.cz/film/988751"
+    assert "bod-varu" in index
+    assert index.get("bod-varu") is None
+    assert "aferim" not in index
+
+
+def test_index_missing_expires(tmp_path):
+    index = kvifftv.KviffTvIndex(tmp_path / "kvifftv.json")
+    checked_at = datetime.now(UTC) - kvifftv.MISSING_TTL - timedelta(hours=1)
+    index.missing["bod-varu"] = checked_at.isoformat()
+
+    assert "bod-varu" not in index
+
+
+def test_index_find_kvifftv_url(tmp_path):
+    index = kvifftv.KviffTvIndex(tmp_path / "kvifftv.json")
+    index.set("smolny-pich-aneb-pitomy-porno", "https://www.csfd.cz/film/988751")
+
+    assert (
+        index.find_kvifftv_url(
+            "https://www.csfd.cz/film/988751-smolny-pich-aneb-pitomy-porno/prehled/"
+        )
+        == "https://kviff.tv/katalog/smolny-pich-aneb-pitomy-porno"
+    )
+    assert (
+        index.find_kvifftv_url("https://www.csfd.cz/film/8283-posledni-skaut/") is None
+    )
+
+
+def test_index_find_kvifftv_url_not_listed_recently(tmp_path):
+    index = kvifftv.KviffTvIndex(tmp_path / "kvifftv.json")
+    index.set("smolny-pich-aneb-pitomy-porno", "https://www.csfd.cz/film/988751")
+    listed_at = datetime.now(UTC) - kvifftv.LISTED_TTL - timedelta(hours=1)
+    index.listed["smolny-pich-aneb-pitomy-porno"] = listed_at.isoformat()
+    index.slugs_by_film_id = None
+
+    assert index.find_kvifftv_url("https://www.csfd.cz/film/988751") is None
+    assert index.get("smolny-pich-aneb-pitomy-porno")
+
+
+def test_parse_catalog_slugs():
+    path = Path(__file__).parent / "kvifftv_catalog.html"
+    catalog_html = html.fromstring(path.read_text())
+
+    assert kvifftv.parse_catalog_slugs(catalog_html) == [
+        "aferim",
+        "smolny-pich-aneb-pitomy-porno",
+    ]
+
+
+def test_parse_next_page_url():
+    path = Path(__file__).parent / "kvifftv_catalog.html"
+    catalog_html = html.fromstring(path.read_text())
+    catalog_html.make_links_absolute("https://kviff.tv/katalog/vypis")
+
+    assert (
+        kvifftv.parse_next_page_url(catalog_html)
+        == "https://kviff.tv/katalog/vypis?page=2"
+    )
+
+
+def test_parse_next_page_url_last_page():
+    path = Path(__file__).parent / "kvifftv_catalog_2.html"
+    catalog_html = html.fromstring(path.read_text())
+
+    assert kvifftv.parse_next_page_url(catalog_html) is None
+
+
+@pytest.fixture()
+def kvifftv_site():
+    pages = {
+        "/katalog/vypis": "kvifftv_catalog.html",
+        "/katalog/vypis?page=2": "kvifftv_catalog_2.html",
+        "/katalog/smolny-pich-aneb-pitomy-porno": "kvifftv.html",
+    }
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        try:
+            path = Path(__file__).parent / pages[request.url.raw_path.decode()]
+        except KeyError:
+            return httpx.Response(200, text="<html><body>Bez odkazů</body></html>")
+        return httpx.Response(200, content=path.read_bytes())
+
+    return httpx.MockTransport(handler), requests
+
+
+@pytest.mark.asyncio
+async def test_crawl_catalog(tmp_path, kvifftv_site):
+    transport, requests = kvifftv_site
+    index = kvifftv.KviffTvIndex(tmp_path / "kvifftv.json")
+    async with httpx.AsyncClient(transport=transport) as client:
+        count = await kvifftv.crawl_catalog(client, index, concurrency=2)
+
+    index = kvifftv.KviffTvIndex(tmp_path / "kvifftv.json")
+
+    assert count == 3
+    assert len(requests) == 5
+    assert index.films == {
+        "smolny-pich-aneb-pitomy-porno": "https://www.csfd.cz/film/988751"
+    }
+    assert "aferim" in index
+    assert "bod-varu" in index
+
+
+@pytest.mark.asyncio
+async def test_crawl_catalog_is_incremental(tmp_path, kvifftv_site):
+    transport, requests = kvifftv_site
+    index = kvifftv.KviffTvIndex(tmp_path / "kvifftv.json")
+    index.set("aferim", None)
+    index.set("bod-varu", None)
+    async with httpx.AsyncClient(transport=transport) as client:
+        count = await kvifftv.crawl_catalog(client, index)
+
+    assert count == 1
+    assert [request.url.path for request in requests] == [
+        "/katalog/vypis",
+        "/katalog/vypis",
+        "/katalog/smolny-pich-aneb-pitomy-porno",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_crawl_catalog_forgets_films_which_left(tmp_path, kvifftv_site):
+    transport, _ = kvifftv_site
+    index = kvifftv.KviffTvIndex(tmp_path / "kvifftv.json")
+    index.set("posledni-skaut", "https://www.csfd.cz/film/8283")
+    async with httpx.AsyncClient(transport=transport) as client:
+        await kvifftv.crawl_catalog(client, index)
+
+    assert "posledni-skaut" not in index
+    assert index.find_kvifftv_url("https://www.csfd.cz/film/8283") is None
+
+
+@pytest.mark.asyncio
+async def test_crawl_catalog_survives_failed_film(tmp_path):
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path == "/katalog/vypis":
+            path = Path(__file__).parent / "kvifftv_catalog_2.html"
+            return httpx.Response(200, content=path.read_bytes())
+        if request.url.path == "/katalog/bod-varu":
+            raise httpx.ReadTimeout("Timed out", request=request)
+        return httpx.Response(200, text="<html></html>")
+
+    index = kvifftv.KviffTvIndex(tmp_path / "kvifftv.json")
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        count = await kvifftv.crawl_catalog(client, index)
+
+    assert "bod-varu" not in index
+    assert count == 1
+    assert "aferim" in index
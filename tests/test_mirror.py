@@ -0,0 +1,256 @@
+import asyncio
+import json
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from datetime import date
+from pathlib import Path
+
+import httpx
+import pytest
+
+from film2trello import mirror as mirror_module, trello
+from film2trello.mirror import BoardMirror
+from film2trello.webhook import get_signature, serve_webhook
+
+
+CARD_ID = "65a0c1d2e3f4a5b6c7d8e9f0"
+
+OLD_CARD_ID = "4f0000000000000000000000"  # created in January 2012
+
+
+@pytest.fixture()
+def board():
+    cards = {
+        "inbox": [
+            {
+                "id": CARD_ID,
+                "name": "Poslední skaut",
+                "desc": "https://www.csfd.cz/film/8283-posledni-skaut/",
+                "idList": "inbox",
+                "pos": 1,
+                "labels": [],
+                "idLabels": [],
+                "idMembers": ["id-honza"],
+                "attachments": [],
+            },
+            {
+                "id": OLD_CARD_ID,
+                "name": "Kolja",
+                "desc": "https://www.csfd.cz/film/1234-kolja/",
+                "idList": "inbox",
+                "pos": 2,
+                "labels": [],
+                "idLabels": [],
+                "idMembers": [],
+                "attachments": [],
+            },
+        ],
+        "archive": [],
+    }
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        path = request.url.path
+        if path == "/1/boards/board/lists":
+            return httpx.Response(
+                200, json=[{"id": "inbox"}, {"id": "other"}, {"id": "archive"}]
+            )
+        if path.startswith("/1/lists/"):
+            return httpx.Response(200, json=cards[path.split("/")[3]])
+        if path == "/1/boards/board/labels":
+            return httpx.Response(
+                200,
+                json=[
+                    {"id": f"id-{label['name']}", **label}
+                    for label in trello.MANAGED_LABELS
+                ],
+            )
+        if path == "/1/boards/board/members":
+            return httpx.Response(200, json=[{"id": "id-honza", "username": "honza"}])
+        if path == "/1/cards/new":
+            return httpx.Response(
+                200,
+                json={
+                    "id": "new",
+                    "name": "Kolja",
+                    "desc": "",
+                    "idList": "inbox",
+                    "pos": 0,
+                    "closed": False,
+                    "labels": [],
+                    "idLabels": [],
+                    "idMembers": [],
+                    "attachments": [],
+                },
+            )
+        return httpx.Response(404, text="Not found")
+
+    trello.members_cache.clear()
+    yield httpx.MockTransport(handler), requests, cards
+    trello.members_cache.clear()
+
+
+@asynccontextmanager
+async def open_mirror(board) -> AsyncIterator[BoardMirror]:
+    transport, requests, _ = board
+    async with httpx.AsyncClient(
+        base_url="https://trello.com/1/",
+        transport=transport,
+        event_hooks={"response": [trello.raise_on_error]},
+    ) as trello_api:
+        mirror = BoardMirror(
+            mirror_module.get_mirror_path("board"), "board", trello_api
+        )
+        await mirror.sync()
+        requests.clear()
+        try:
+            yield mirror
+        finally:
+            mirror.close()
+
+
+def get_payload(action_type: str, **card: str | bool) -> dict:
+    return {"action": {"type": action_type, "data": {"card": card}}}
+
+
+@pytest.mark.asyncio
+async def test_mirror_reads_board_locally(board):
+    _, requests, _ = board
+
+    async with open_mirror(board) as board_mirror:
+        assert await board_mirror.check_username("honza") == "id-honza"
+        assert await board_mirror.get_working_lists_ids() == ["inbox", "archive"]
+        assert [card["id"] for card in await board_mirror.get_cards(["inbox"])] == [
+            CARD_ID,
+            OLD_CARD_ID,
+        ]
+        assert [
+            card["id"]
+            for card in await board_mirror.get_old_cards("inbox", date(2020, 1, 1))
+        ] == [OLD_CARD_ID]
+        assert (await board_mirror.get_board_labels())["1.5h"] == "id-1.5h"
+        assert requests == []
+
+
+@pytest.mark.asyncio
+async def test_mirror_unknown_user(board):
+    async with open_mirror(board) as board_mirror:
+        with pytest.raises(ValueError, match="not allowed"):
+            await board_mirror.check_username("vladimir")
+
+
+@pytest.mark.asyncio
+async def test_mirror_applies_card_update_without_requests(board):
+    _, requests, _ = board
+
+    async with open_mirror(board) as board_mirror:
+        payload = json.loads(
+            (Path(__file__).parent / "trello_webhook_update_card.json").read_text()
+        )
+
+        await board_mirror.apply(payload)
+
+        assert [card["id"] for card in await board_mirror.get_cards(["archive"])] == [
+            CARD_ID
+        ]
+        assert [card["id"] for card in await board_mirror.get_cards(["inbox"])] == [
+            OLD_CARD_ID
+        ]
+        assert requests == []
+
+
+@pytest.mark.asyncio
+async def test_mirror_forgets_cards_leaving_working_lists(board):
+    async with open_mirror(board) as board_mirror:
+        await board_mirror.apply(get_payload("updateCard", id=CARD_ID, idList="other"))
+        await board_mirror.apply(get_payload("updateCard", id=OLD_CARD_ID, closed=True))
+
+        assert await board_mirror.get_cards(["inbox", "archive"]) == []
+
+
+@pytest.mark.asyncio
+async def test_mirror_reads_created_card(board):
+    _, requests, _ = board
+
+    async with open_mirror(board) as board_mirror:
+        await board_mirror.apply(get_payload("createCard", id="new", name="Kolja"))
+
+        assert [card["id"] for card in await board_mirror.get_cards(["inbox"])] == [
+            "new",
+            CARD_ID,
+            OLD_CARD_ID,
+        ]
+        assert "closed" not in (await board_mirror.get_cards(["inbox"]))[0]
+        assert [request.url.path for request in requests] == ["/1/cards/new"]
+
+
+@pytest.mark.asyncio
+async def test_mirror_deleted_card(board):
+    async with open_mirror(board) as board_mirror:
+        await board_mirror.apply(get_payload("deleteCard", id=CARD_ID))
+
+        assert [card["id"] for card in await board_mirror.get_cards(["inbox"])] == [
+            OLD_CARD_ID
+        ]
+
+
+@pytest.mark.asyncio
+async def test_mirror_resyncs_after_failed_action(board):
+    _, _, cards = board
+
+    async with open_mirror(board) as board_mirror:
+        await board_mirror.apply(get_payload("addLabelToCard", id="unknown"))
+        cards["inbox"].pop()
+
+        assert board_mirror.is_stale()
+        assert [card["id"] for card in await board_mirror.get_cards(["inbox"])] == [
+            CARD_ID
+        ]
+        assert not board_mirror.is_stale()
+
+
+@pytest.mark.asyncio
+async def test_mirror_resyncs_when_too_old(board):
+    _, requests, _ = board
+
+    async with open_mirror(board) as board_mirror:
+        board_mirror.max_age = 0
+
+        await board_mirror.get_cards(["inbox"])
+
+        assert "/1/boards/board/lists" in [request.url.path for request in requests]
+
+
+@pytest.mark.asyncio
+async def test_webhook_receives_actions(board):
+    async with open_mirror(board) as board_mirror:
+        callback_url = "https://example.com/trello"
+        server = await serve_webhook(
+            board_mirror, "127.0.0.1", 0, callback_url, "secret"
+        )
+        port = server.sockets[0].getsockname()[1]
+        payload = (
+            Path(__file__).parent / "trello_webhook_update_card.json"
+        ).read_bytes()
+
+        async with (
+            server,
+            httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}") as client,
+        ):
+            head_response = await client.head("/trello")
+            unsigned_response = await client.post("/trello", content=payload)
+            response = await client.post(
+                "/trello",
+                content=payload,
+                headers={
+                    "X-Trello-Webhook": get_signature("secret", payload, callback_url)
+                },
+            )
+            async with asyncio.timeout(1):
+                while not await board_mirror.get_cards(["archive"]):
+                    await asyncio.sleep(0.01)
+
+        assert head_response.status_code == 200
+        assert unsigned_response.status_code == 401
+        assert response.status_code == 200
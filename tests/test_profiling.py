@@ -0,0 +1,44 @@
+import asyncio
+import json
+import pstats
+
+from film2trello.profiling import Profiling, Tracer
+
+
+async def sleepy(delay: float) -> float:
+    await asyncio.sleep(delay)
+    await asyncio.sleep(delay)
+    return delay
+
+
+async def main() -> list[float]:
+    return await asyncio.gather(sleepy(0.01), sleepy(0.02))
+
+
+def test_tracer_records_tasks_and_steps():
+    tracer = Tracer()
+    result = asyncio.run(main(), loop_factory=tracer.get_loop)
+
+    rows = {
+        event["tid"]: event["args"]["name"]
+        for event in tracer.events
+        if event["ph"] == "M"
+    }
+    tasks = [event for event in tracer.events if event.get("cat") == "task"]
+    steps = [event for event in tracer.events if event.get("cat") == "step"]
+
+    assert result == [0.01, 0.02]
+    assert [name.split()[-1] for name in rows.values()].count("sleepy") == 2
+    assert {"main", "sleepy"} <= {task["name"] for task in tasks}
+    assert len([step for step in steps if step["name"] == "sleepy"]) == 6
+    assert max(task["dur"] for task in tasks) >= 40_000
+
+
+def test_profiling_saves_standard_formats(tmp_path):
+    profiling = Profiling(tmp_path / "run")
+    profiling.start()
+    asyncio.run(main(), loop_factory=profiling.tracer.get_loop)
+    profiling.stop()
+
+    assert pstats.Stats(str(tmp_path / "run.pstats")).total_calls
+    assert json.loads((tmp_path / "run.trace.json").read_text())["traceEvents"]
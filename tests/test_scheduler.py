@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+
+from film2trello import scheduler
+
+
+@pytest.mark.asyncio
+async def test_run_periodically_survives_failures():
+    runs = []
+
+    async def job() -> None:
+        runs.append(len(runs))
+        if len(runs) == 1:
+            raise ValueError("Boom!")
+
+    task = asyncio.create_task(scheduler.run_periodically(job, 0.01))
+    await asyncio.sleep(0.1)
+    task.cancel()
+
+    assert len(runs) > 2
+
+
+@pytest.mark.asyncio
+async def test_run_periodically_never_overlaps():
+    running = []
+    concurrency = []
+
+    async def job() -> None:
+        running.append(True)
+        concurrency.append(len(running))
+        await asyncio.sleep(0.02)
+        running.pop()
+
+    task = asyncio.create_task(scheduler.run_periodically(job, 0.001))
+    await asyncio.sleep(0.1)
+    task.cancel()
+
+    assert len(concurrency) > 1
+    assert max(concurrency) == 1
+
+
+def test_get_delay():
+    delays = [scheduler.get_delay(100, 10) for _ in range(100)]
+
+    assert all(90 <= delay <= 110 for delay in delays)
+    assert len(set(delays)) > 1
+
+
+def test_get_delay_never_negative():
+    assert scheduler.get_delay(1, 10) >= 0
@@ -1,6 +1,15 @@
+import json
+from io import BytesIO
+
+import httpx
 import pytest
+from PIL import Image
 
 from film2trello import trello
+from film2trello.http import raise_on_error
+
+
+BOARD_FULL_ID = "5e8b3a1c2f4d6e7a8b9c0d1e"
 
 
 @pytest.mark.asyncio
@@ -139,20 +148,99 @@ def test_prepare_duration_labels_deduplicates_brackets():
     ]
 
 
-def test_get_missing_labels():
-    existing_labels = [
-        {"id": "...", "idBoard": "...", "name": "2.5h", "color": "red"},
-        {"id": "...", "idBoard": "...", "name": "3+h", "color": "purple"},
-    ]
+def test_get_card_label_ids():
+    card = {
+        "labels": [
+            {"id": "id-2.5h", "name": "2.5h", "color": "red"},
+            {"id": "id-NETFLIX", "name": "NETFLIX", "color": "black"},
+            {"id": "id-STASH", "name": "STASH", "color": "green"},
+        ],
+        "idLabels": ["id-2.5h", "id-NETFLIX", "id-STASH"],
+    }
     labels = [
         {"name": "KVIFF.TV", "color": "black"},
-        {"name": "3+h", "color": "purple"},
         {"name": "2.5h", "color": "red"},
     ]
+    label_ids = {"KVIFF.TV": "id-KVIFF.TV", "2.5h": "id-2.5h"}
+
+    assert trello.get_card_label_ids(card, labels, label_ids) == [
+        "id-2.5h",
+        "id-STASH",
+        "id-KVIFF.TV",
+    ]
+
+
+def test_get_card_label_ids_unchanged():
+    card = {
+        "labels": [
+            {"id": "id-SERIÁL", "name": "SERIÁL", "color": "black"},
+            {"id": "id-2.5h", "name": "2.5h", "color": "red"},
+        ],
+        "idLabels": ["id-2.5h", "id-SERIÁL"],
+    }
+    labels = [
+        {"name": "2.5h", "color": "red"},
+        {"name": "SERIÁL", "color": "black"},
+    ]
+    label_ids = {"SERIÁL": "id-SERIÁL", "2.5h": "id-2.5h"}
+
+    assert trello.get_card_label_ids(card, labels, label_ids) == card["idLabels"]
+
 
-    assert trello.get_missing_labels(existing_labels, labels) == [
+@pytest.mark.asyncio
+async def test_get_board_labels_creates_missing_labels():
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        if request.method == "POST":
+            label = json.loads(request.content)
+            return httpx.Response(200, json={"id": "new", **label})
+        if request.url.path == "/1/boards/board":
+            return httpx.Response(200, json={"id": BOARD_FULL_ID})
+        return httpx.Response(
+            200,
+            json=[
+                {"id": "1", "name": "KVIFF.TV", "color": "black"},
+                {"id": "2", "name": "STASH", "color": "green"},
+            ],
+        )
+
+    labels = [
         {"name": "KVIFF.TV", "color": "black"},
+        {"name": "NETFLIX", "color": "black"},
     ]
+    async with httpx.AsyncClient(
+        base_url="https://trello.com/1/", transport=httpx.MockTransport(handler)
+    ) as client:
+        label_ids = await trello.get_board_labels(client, "board", labels)
+
+    assert label_ids == {"KVIFF.TV": "1", "STASH": "2", "NETFLIX": "new"}
+    assert json.loads(requests[-1].content) == {
+        "name": "NETFLIX",
+        "color": "black",
+        "idBoard": BOARD_FULL_ID,
+    }
+
+
+@pytest.mark.asyncio
+async def test_get_board_full_id():
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(200, json={"id": BOARD_FULL_ID})
+
+    async with httpx.AsyncClient(
+        base_url="https://trello.com/1/", transport=httpx.MockTransport(handler)
+    ) as client:
+        assert await trello.get_board_full_id(client, "board") == BOARD_FULL_ID
+        assert await trello.get_board_full_id(client, "board") == BOARD_FULL_ID
+        assert await trello.get_board_full_id(client, BOARD_FULL_ID) == BOARD_FULL_ID
+
+    assert len(requests) == 1
+    assert requests[0].url.path == "/1/boards/board"
+    assert requests[0].url.params["fields"] == "id"
 
 
 def test_get_missing_attached_urls():
@@ -229,3 +317,274 @@ def test_has_poster():
 )
 def test_get_duration_bracket(duration, expected):
     assert trello.get_duration_bracket(duration) == expected
+
+
+def test_find_card():
+    cards = [
+        {"id": "1", "name": "Foo Bar (2020)", "desc": ""},
+        {
+            "id": "2",
+            "name": "",
+            "desc": "https://www.csfd.cz/film/8283-posledni-skaut/",
+        },
+    ]
+
+    assert (
+        trello.find_card(
+            cards,
+            "Poslední skaut / The Last Boy Scout (1991)",
+            "https://www.csfd.cz/film/8283-posledni-skaut/",
+        )
+        == cards[1]
+    )
+
+
+def test_get_card_changes():
+    card = {
+        "id": "1",
+        "name": "Poslední skaut / The Last Boy Scout (1991)",
+        "desc": "https://www.csfd.cz/film/8283-posledni-skaut/",
+        "pos": 16384,
+    }
+    card_data = {
+        "name": "Poslední skaut / The Last Boy Scout (1991)",
+        "desc": "https://www.csfd.cz/film/8283-posledni-skaut/prehled/",
+        "pos": "top",
+    }
+
+    assert trello.get_card_changes(card, card_data) == {
+        "desc": "https://www.csfd.cz/film/8283-posledni-skaut/prehled/",
+        "pos": "top",
+    }
+
+
+def test_get_card_changes_nothing_changed():
+    card = {"id": "1", "name": "Foo (2020)", "desc": "https://example.com"}
+    card_data = {"name": "Foo (2020)", "desc": "https://example.com"}
+
+    assert trello.get_card_changes(card, card_data) == {}
+
+
+@pytest.mark.asyncio
+async def test_iter_cards_reads_cards_in_position_order():
+    # cards moved around the list, IDs don't follow their positions
+    cards = [
+        {"id": f"{i:024x}", "name": f"Film {i}", "pos": pos}
+        for pos, i in enumerate([3, 5, 1, 4, 2], start=1)
+    ]
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(200, json=cards)
+
+    async with httpx.AsyncClient(
+        base_url="https://trello.com/1/", transport=httpx.MockTransport(handler)
+    ) as client:
+        result = [card async for card in trello.iter_cards(client, "1")]
+
+    assert result == cards
+    assert len(requests) == 1
+    assert "before" not in requests[0].url.params
+    assert requests[0].url.params["attachments"] == "true"
+
+
+@pytest.fixture()
+def members_api():
+    requests = []
+    members = [
+        {"id": "id-vladimir", "username": "vladimir"},
+        {"id": "id-honzajavorek", "username": "honzajavorek"},
+    ]
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(200, json=members)
+
+    trello.members_cache.clear()
+    yield httpx.MockTransport(handler), requests, members
+    trello.members_cache.clear()
+
+
+@pytest.mark.asyncio
+async def test_check_username_caches_board_members(members_api):
+    transport, requests, _ = members_api
+    async with httpx.AsyncClient(
+        base_url="https://trello.com/1/", transport=transport
+    ) as client:
+        member_ids = [
+            await trello.check_username(client, "board", "honzajavorek"),
+            await trello.check_username(client, "board", "vladimir"),
+        ]
+
+    assert member_ids == ["id-honzajavorek", "id-vladimir"]
+    assert len(requests) == 1
+
+
+@pytest.mark.asyncio
+async def test_check_username_refreshes_cache_for_unknown_user(members_api):
+    transport, requests, members = members_api
+    async with httpx.AsyncClient(
+        base_url="https://trello.com/1/", transport=transport
+    ) as client:
+        await trello.check_username(client, "board", "honzajavorek")
+        members.append({"id": "id-zuzka", "username": "zuzka"})
+        member_id = await trello.check_username(client, "board", "zuzka")
+
+    assert member_id == "id-zuzka"
+    assert len(requests) == 2
+
+
+@pytest.mark.asyncio
+async def test_check_username_not_allowed(members_api):
+    transport, _, _ = members_api
+    async with httpx.AsyncClient(
+        base_url="https://trello.com/1/", transport=transport
+    ) as client:
+        with pytest.raises(ValueError):
+            await trello.check_username(client, "board", "kvetoslava")
+
+
+@pytest.mark.asyncio
+async def test_join_card_already_member(members_api):
+    transport, requests, _ = members_api
+    card = {"id": "1", "idMembers": ["id-honzajavorek"]}
+    async with httpx.AsyncClient(
+        base_url="https://trello.com/1/", transport=transport
+    ) as client:
+        await trello.join_card(client, card, "id-honzajavorek")
+        await trello.join_card(client, card, "id-vladimir")
+
+    assert [(request.method, request.url.path) for request in requests] == [
+        ("POST", "/1/cards/1/members"),
+    ]
+
+
+def test_get_member_id():
+    members = [
+        {"id": "id-vladimir", "username": "vladimir"},
+        {"id": "id-honzajavorek", "username": "honzajavorek"},
+    ]
+
+    assert trello.get_member_id(members, "honzajavorek") == "id-honzajavorek"
+
+
+def test_get_card_metadata():
+    card = {
+        "customFieldItems": [
+            {"idCustomField": "other", "value": {"text": "foo"}},
+            {"idCustomField": "field", "value": {"text": '{"durations":[105]}'}},
+        ]
+    }
+
+    assert trello.get_card_metadata(card, "field") == {"durations": [105]}
+    assert trello.get_card_metadata(card, "missing") is None
+    assert trello.get_card_metadata({"customFieldItems": []}, "field") is None
+
+
+def test_get_card_metadata_invalid():
+    card = {"customFieldItems": [{"idCustomField": "field", "value": {"text": "{"}}]}
+
+    assert trello.get_card_metadata(card, "field") is None
+
+
+@pytest.mark.asyncio
+async def test_get_metadata_field_id_creates_field():
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        if request.method == "POST":
+            return httpx.Response(200, json={"id": "new"})
+        if request.url.path == "/1/boards/board":
+            return httpx.Response(200, json={"id": BOARD_FULL_ID})
+        return httpx.Response(200, json=[{"id": "1", "name": "Rating"}])
+
+    async with httpx.AsyncClient(
+        base_url="https://trello.com/1/", transport=httpx.MockTransport(handler)
+    ) as client:
+        field_id = await trello.get_metadata_field_id(client, "board")
+
+    assert field_id == "new"
+    assert json.loads(requests[-1].content)["name"] == "film2trello"
+    assert json.loads(requests[-1].content)["type"] == "text"
+    assert json.loads(requests[-1].content)["idModel"] == BOARD_FULL_ID
+
+
+@pytest.mark.asyncio
+async def test_update_card_attachments_skips_poster_which_keeps_failing(
+    failure_cache,
+):
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(200, content=b"not an image")
+
+    async with (
+        httpx.AsyncClient(
+            base_url="https://trello.com/1/", transport=httpx.MockTransport(handler)
+        ) as trello_api,
+        httpx.AsyncClient(transport=httpx.MockTransport(handler)) as scraper,
+    ):
+        errors = await trello.update_card_attachments(
+            trello_api, scraper, "card", [], "https://image.pmgstatic.com/x.jpg", []
+        )
+        requests.clear()
+        skipped_errors = await trello.update_card_attachments(
+            trello_api, scraper, "card", [], "https://image.pmgstatic.com/x.jpg", []
+        )
+
+    assert errors[0].startswith("Unable to update poster")
+    assert skipped_errors == []
+    assert requests == []
+    assert [failure["failure"] for failure in failure_cache.report()] == ["decode"]
+
+
+@pytest.mark.asyncio
+async def test_update_card_attachments_reports_failed_poster_upload(failure_cache):
+    image = BytesIO()
+    Image.new("RGB", (10, 10)).save(image, "PNG")
+
+    def trello_handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(500, text="Internal Server Error")
+
+    def scraper_handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, content=image.getvalue())
+
+    async with (
+        httpx.AsyncClient(
+            base_url="https://trello.com/1/",
+            transport=httpx.MockTransport(trello_handler),
+            event_hooks={"response": [raise_on_error]},
+        ) as trello_api,
+        httpx.AsyncClient(transport=httpx.MockTransport(scraper_handler)) as scraper,
+    ):
+        errors = await trello.update_card_attachments(
+            trello_api, scraper, "card", [], "https://image.pmgstatic.com/x.jpg", []
+        )
+
+    assert errors[0].startswith("Unable to update poster")
+    assert failure_cache.report() == []
+
+
+@pytest.mark.asyncio
+async def test_register_webhook_uses_full_board_id():
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        if request.method == "POST":
+            return httpx.Response(200, json={"id": "webhook"})
+        return httpx.Response(200, json={"id": BOARD_FULL_ID})
+
+    async with httpx.AsyncClient(
+        base_url="https://trello.com/1/", transport=httpx.MockTransport(handler)
+    ) as client:
+        await trello.register_webhook(client, "board", "https://example.com/trello")
+
+    assert json.loads(requests[-1].content) == {
+        "callbackURL": "https://example.com/trello",
+        "idModel": BOARD_FULL_ID,
+        "description": "film2trello",
+    }